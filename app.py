@@ -7,6 +7,7 @@ with user authentication and email notifications.
 
 from app import create_app
 from app.models import db, User, BulletinItem, EmailLog, EmailSubscription
+from app.services.outbox_service import outbox_worker
 import os
 import logging
 from logging.handlers import RotatingFileHandler
@@ -64,6 +65,11 @@ def main():
     host = os.environ.get('FLASK_HOST', '127.0.0.1')
     port = int(os.environ.get('FLASK_PORT', 8081))  # Changed to 8081
     debug = os.environ.get('FLASK_ENV') == 'development'
+    
+    # Send queued email from this process (only in the reloader's child in debug mode)
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        outbox_worker.start(app)
+    
     #this is NOT THE REAL PASSWORD, DUH
     print(f""" 
     ╔══════════════════════════════════════════════════════════╗
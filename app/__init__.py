@@ -44,7 +44,106 @@ def create_app(config_name='default'):
         app.config['MAIL_USERNAME'] = os.getenv('MAIL_USERNAME')
         app.config['MAIL_PASSWORD'] = os.getenv('MAIL_PASSWORD')
         app.config['MAIL_DEFAULT_SENDER'] = os.getenv('MAIL_DEFAULT_SENDER', os.getenv('MAIL_USERNAME'))
-    
+
+        # HTTP caching (ETags are derived from the data_versions table)
+        app.config['DATA_VERSION_TTL'] = int(os.getenv('DATA_VERSION_TTL', 5))
+        app.config['API_CACHE_CONTROL'] = os.getenv('API_CACHE_CONTROL', 'private, no-cache')
+        
+        # Seconds a resolved current user is reused across requests (0 disables)
+        app.config['IDENTITY_CACHE_TTL'] = int(os.getenv('IDENTITY_CACHE_TTL', 15))
+        # Seconds between reloads of the per-user token_version map
+        app.config['TOKEN_VERSION_TTL'] = int(os.getenv('TOKEN_VERSION_TTL', 30))
+        
+        # Token revocation (Bloom filter in front of the revoked_tokens table)
+        app.config['REVOCATION_SYNC_INTERVAL'] = int(os.getenv('REVOCATION_SYNC_INTERVAL', 5))
+        app.config['REVOCATION_REBUILD_INTERVAL'] = int(os.getenv('REVOCATION_REBUILD_INTERVAL', 3600))
+        
+        # Password hashing (runs in a process pool; 0 workers hashes inline)
+        app.config['PASSWORD_HASH_METHOD'] = os.getenv('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:600000')
+        app.config['PASSWORD_HASH_WORKERS'] = int(os.getenv('PASSWORD_HASH_WORKERS', os.cpu_count() or 2))
+        app.config['PASSWORD_HASH_QUEUE_LIMIT'] = int(os.getenv('PASSWORD_HASH_QUEUE_LIMIT', 0)) or None
+        app.config['PASSWORD_HASH_TIMEOUT'] = int(os.getenv('PASSWORD_HASH_TIMEOUT', 10))
+        
+        # Minutes between full recomputes of the dashboard counters
+        app.config['STATS_RECONCILE_MINUTES'] = int(os.getenv('STATS_RECONCILE_MINUTES', 60))
+        
+        # Pooled SMTP connections: pool size, sender threads, recycle after N messages or idle seconds
+        app.config['SMTP_POOL_SIZE'] = int(os.getenv('SMTP_POOL_SIZE', 4))
+        app.config['SMTP_SEND_WORKERS'] = int(os.getenv('SMTP_SEND_WORKERS', 4))
+        app.config['SMTP_POOL_MAX_MESSAGES'] = int(os.getenv('SMTP_POOL_MAX_MESSAGES', 100))
+        app.config['SMTP_POOL_IDLE_TIMEOUT'] = int(os.getenv('SMTP_POOL_IDLE_TIMEOUT', 30))
+        # Recipients per SMTP transaction for identical-content sends (1 sends one copy per recipient)
+        app.config['SMTP_BCC_BATCH_SIZE'] = int(os.getenv('SMTP_BCC_BATCH_SIZE', 50))
+        
+        # Send rate governor: token buckets shared by all processes (0 disables a bucket; defaults suit
+        # Google Workspace), pause and retries after a 421/45x throttling reply, seconds to recover full rate
+        app.config['SMTP_RATE_PER_SECOND'] = int(os.getenv('SMTP_RATE_PER_SECOND', 5))
+        app.config['SMTP_RATE_PER_MINUTE'] = int(os.getenv('SMTP_RATE_PER_MINUTE', 100))
+        app.config['SMTP_RATE_PER_DAY'] = int(os.getenv('SMTP_RATE_PER_DAY', 2000))
+        app.config['SMTP_RATE_MAX_WAIT'] = int(os.getenv('SMTP_RATE_MAX_WAIT', 30))
+        app.config['SMTP_THROTTLE_PAUSE'] = int(os.getenv('SMTP_THROTTLE_PAUSE', 30))
+        app.config['SMTP_THROTTLE_RETRIES'] = int(os.getenv('SMTP_THROTTLE_RETRIES', 2))
+        app.config['SMTP_RATE_RECOVERY'] = int(os.getenv('SMTP_RATE_RECOVERY', 300))
+        
+        # Email outbox: drain threads per process, claim batch size, dead-letter after N attempts, backoff base/cap seconds
+        app.config['OUTBOX_WORKERS'] = int(os.getenv('OUTBOX_WORKERS', 2))
+        app.config['OUTBOX_BATCH_SIZE'] = int(os.getenv('OUTBOX_BATCH_SIZE', 50))
+        app.config['OUTBOX_MAX_ATTEMPTS'] = int(os.getenv('OUTBOX_MAX_ATTEMPTS', 5))
+        app.config['OUTBOX_RETRY_BASE'] = int(os.getenv('OUTBOX_RETRY_BASE', 30))
+        app.config['OUTBOX_RETRY_MAX'] = int(os.getenv('OUTBOX_RETRY_MAX', 3600))
+        # Seconds workers get at exit to finish the batch they claimed
+        app.config['OUTBOX_SHUTDOWN_TIMEOUT'] = int(os.getenv('OUTBOX_SHUTDOWN_TIMEOUT', 30))
+        
+        # Rendered bulletin item fragments kept for email rendering
+        app.config['EMAIL_FRAGMENT_CACHE_SIZE'] = int(os.getenv('EMAIL_FRAGMENT_CACHE_SIZE', 2000))
+        
+        # Email log body compression: auto (zstd if installed, else zlib), zstd, zlib or none
+        app.config['EMAIL_BODY_COMPRESSION'] = os.getenv('EMAIL_BODY_COMPRESSION', 'auto')
+        
+        # Email log retention: keep detail rows N days, then archive or purge them (daily rollups are kept)
+        app.config['EMAIL_LOG_RETENTION_DAYS'] = int(os.getenv('EMAIL_LOG_RETENTION_DAYS', 180))
+        app.config['EMAIL_LOG_RETENTION_MODE'] = os.getenv('EMAIL_LOG_RETENTION_MODE', 'archive')
+        app.config['EMAIL_RETENTION_BATCH_SIZE'] = int(os.getenv('EMAIL_RETENTION_BATCH_SIZE', 500))
+        app.config['OUTBOX_RETENTION_DAYS'] = int(os.getenv('OUTBOX_RETENTION_DAYS', 30))
+        
+        # Scheduler leader lease: only one process runs jobs; it renews every SCHEDULER_HEARTBEAT seconds
+        # and another process takes over after SCHEDULER_LEASE_TTL seconds without a renewal
+        app.config['SCHEDULER_HEARTBEAT'] = int(os.getenv('SCHEDULER_HEARTBEAT', 15))
+        app.config['SCHEDULER_LEASE_TTL'] = int(os.getenv('SCHEDULER_LEASE_TTL', 60))
+        # A run missed while no scheduler was up still runs if it is at most this many seconds late
+        app.config['SCHEDULER_MISFIRE_GRACE'] = int(os.getenv('SCHEDULER_MISFIRE_GRACE', 3600))
+        # Job run history kept for the admin scheduler runs list
+        app.config['JOB_RUN_RETENTION_DAYS'] = int(os.getenv('JOB_RUN_RETENTION_DAYS', 90))
+        
+        # Bulletin polling (see scrape_schedule): school hours and evening end in Asia/Hong_Kong, poll interval
+        # in minutes for school hours, evenings and otherwise, holidays as 'YYYY-MM-DD:YYYY-MM-DD,YYYY-MM-DD'
+        app.config['SCRAPE_SCHOOL_HOURS'] = os.getenv('SCRAPE_SCHOOL_HOURS', '07:00-17:30')
+        app.config['SCRAPE_EVENING_END'] = os.getenv('SCRAPE_EVENING_END', '22:00')
+        app.config['SCRAPE_POLL_SCHOOL_MINUTES'] = int(os.getenv('SCRAPE_POLL_SCHOOL_MINUTES', 10))
+        app.config['SCRAPE_POLL_EVENING_MINUTES'] = int(os.getenv('SCRAPE_POLL_EVENING_MINUTES', 30))
+        app.config['SCRAPE_POLL_OFF_MINUTES'] = int(os.getenv('SCRAPE_POLL_OFF_MINUTES', 180))
+        app.config['SCRAPE_HOLIDAYS'] = os.getenv('SCRAPE_HOLIDAYS', '')
+        
+        # Digest dispatch: run interval, items per digest, subscriber timezone
+        app.config['DIGEST_INTERVAL_MINUTES'] = int(os.getenv('DIGEST_INTERVAL_MINUTES', 15))
+        app.config['DIGEST_MAX_ITEMS'] = int(os.getenv('DIGEST_MAX_ITEMS', 50))
+        app.config['DIGEST_TIMEZONE'] = os.getenv('DIGEST_TIMEZONE', 'Asia/Hong_Kong')
+        
+        # Seconds the admin stats snapshot (admin stats routes and /metrics) is reused
+        app.config['ADMIN_STATS_TTL'] = int(os.getenv('ADMIN_STATS_TTL', 30))
+        
+        # Per-request SQL profiling; warns when one statement repeats more than the threshold
+        app.config['QUERY_PROFILER_ENABLED'] = os.getenv('QUERY_PROFILER_ENABLED', 'true').lower() == 'true'
+        app.config['QUERY_REPEAT_WARN_THRESHOLD'] = int(os.getenv('QUERY_REPEAT_WARN_THRESHOLD', 10))
+        
+        # JSON encoding: auto (orjson if installed), orjson or default
+        app.config['JSON_PROVIDER'] = os.getenv('JSON_PROVIDER', 'auto')
+        
+        # Response compression (brotli when installed, otherwise gzip)
+        app.config['COMPRESS_ENABLED'] = os.getenv('COMPRESS_ENABLED', 'true').lower() == 'true'
+        app.config['COMPRESS_MIN_SIZE'] = int(os.getenv('COMPRESS_MIN_SIZE', 500))
+        app.config['COMPRESS_CACHE_SIZE'] = int(os.getenv('COMPRESS_CACHE_SIZE', 256))
+
     # Initialize extensions with app
     db.init_app(app)
     jwt.init_app(app)
@@ -52,6 +151,19 @@ def create_app(config_name='default'):
     migrate.init_app(app, db)
     cors.init_app(app)
     
+    from app.services.serialization import init_json_provider
+    init_json_provider(app)
+    
+    # Registered before the other after_request handlers so it runs last
+    from app.services.compression import init_compression
+    init_compression(app)
+    
+    from app.services.metrics_service import init_metrics
+    init_metrics(app)
+    
+    from app.services.query_profiler import init_query_profiler
+    init_query_profiler(app)
+    
     # Initialize scheduler service (only in production or when explicitly enabled)
     enable_scheduler = os.getenv('ENABLE_SCHEDULER', 'true').lower() == 'true'
     if enable_scheduler:
@@ -124,6 +236,15 @@ def create_app(config_name='default'):
         
         return response
 
+    # Shed requests while the password hashing pool is saturated; routes let PasswordHasherBusy through
+    from app.services.password_service import PasswordHasherBusy
+    
+    @app.errorhandler(PasswordHasherBusy)
+    def password_hasher_busy(e):
+        response = jsonify({'error': 'Server is busy, please try again in a moment'})
+        response.headers['Retry-After'] = '2'
+        return response, 503
+
     # Health check endpoint
     @app.route('/health')
     def health_check():
@@ -146,42 +267,53 @@ def create_app(config_name='default'):
     # Metrics endpoint (admin only)
     @app.route('/metrics')
     def metrics():
-        """System metrics endpoint for monitoring"""
-        from flask_jwt_extended import jwt_required, get_jwt_identity
-        from app.models import User, BulletinItem, EmailLog
+        """System metrics in Prometheus text format (?format=json for the JSON summary)"""
+        from flask_jwt_extended import verify_jwt_in_request, get_jwt_identity
+        from app.services.admin_stats_service import get_admin_stats
+        from app.services.identity_service import current_user_is_admin
+        from app.services.metrics_service import metrics_available, render_metrics
+        from app.services.rate_governor import send_rate_governor
+        
+        try:
+            verify_jwt_in_request(optional=True)
+        except Exception:
+            return jsonify({'error': 'Invalid or expired token'}), 401
         
         try:
             # Check if user is admin (if JWT token provided)
-            current_user_id = get_jwt_identity()
-            if current_user_id:
-                user = User.query.get(current_user_id)
-                if not user or not user.is_admin:
+            if get_jwt_identity():
+                if not current_user_is_admin():
                     return jsonify({'error': 'Admin access required'}), 403
             else:
                 # Allow local access without authentication for monitoring tools
                 if not request.remote_addr in ['127.0.0.1', '::1', 'localhost']:
                     return jsonify({'error': 'Authentication required'}), 401
             
-            # Basic metrics
+            # Row counts come from the admin stats snapshot so scrapes don't query the DB
+            stats = get_admin_stats()
+            
+            if metrics_available() and request.args.get('format') != 'json':
+                body, content_type = render_metrics(stats)
+                return app.response_class(body, mimetype=None, content_type=content_type)
+            
             metrics = {
                 'timestamp': datetime.utcnow().isoformat(),
                 'users': {
-                    'total': User.query.count(),
-                    'active': User.query.filter_by(is_active=True).count(),
-                    'admins': User.query.filter_by(is_admin=True).count()
+                    'total': stats['users']['total'],
+                    'active': stats['users']['active'],
+                    'admins': stats['users']['admin']
                 },
                 'bulletins': {
-                    'total': BulletinItem.query.count(),
-                    'recent': BulletinItem.query.filter(
-                        BulletinItem.created_at >= datetime.utcnow() - timedelta(days=7)
-                    ).count()
+                    'total': stats['bulletin_items']['total'],
+                    'recent': stats['bulletin_items']['recent']
                 },
                 'emails': {
-                    'total': EmailLog.query.count(),
-                    'recent': EmailLog.query.filter(
-                        EmailLog.sent_at >= datetime.utcnow() - timedelta(days=7)
-                    ).count()
-                }
+                    'total': stats['emails']['total'],
+                    'recent': stats['emails']['recent_sent']
+                },
+                'outbox': stats['outbox'],
+                'smtp_rate': send_rate_governor.status(),
+                'stats_updated': stats['last_updated']
             }
             
             return jsonify(metrics)
@@ -231,4 +363,9 @@ def create_app(config_name='default'):
             print(f"Warning: Error during database initialization: {e}")
             # Continue anyway, as tables might already exist
     
+    # Background threads that send queued email. The web server starts them (gunicorn.conf.py, app.py)
+    # and `flask outbox-worker` runs them in a process of their own, so CLI commands and scripts don't
+    from app.services.outbox_service import init_outbox
+    init_outbox(app, start_workers=os.getenv('ENABLE_OUTBOX_WORKERS', 'false').lower() == 'true')
+    
     return app
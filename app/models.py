@@ -1,7 +1,11 @@
 from app import db
-from werkzeug.security import generate_password_hash, check_password_hash
+from app.services.password_service import hash_password, verify_password, needs_rehash
+from app.services.email_bodies import body_hash, compress, decompress
 from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, inspect, select, insert
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
 import json
 
 
@@ -22,6 +26,7 @@ class User(db.Model):
     year_group = db.Column(db.String(10), default='9')  # Year group preference
     preferences_set = db.Column(db.Boolean, default=False)  # Track if user has set preferences
     email_preferences = db.Column(db.Text, nullable=True)  # JSON string for email preferences
+    token_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # Bumped to invalidate access tokens
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     last_login = db.Column(db.DateTime)
     
@@ -31,10 +36,18 @@ class User(db.Model):
     email_logs = db.relationship('EmailLog', backref='user', lazy=True, cascade='all, delete-orphan')
     
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hash_password(password)
     
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return verify_password(self.password_hash, password)
+    
+    def password_needs_rehash(self):
+        """True when the stored hash uses outdated PASSWORD_HASH_METHOD parameters"""
+        return needs_rehash(self.password_hash)
+    
+    def bump_token_version(self):
+        """Invalidate every access token issued with the current claims"""
+        self.token_version = (self.token_version or 0) + 1
     
     def set_email_preferences(self, preferences_dict):
         """Set user email preferences as JSON"""
@@ -84,12 +97,17 @@ class User(db.Model):
 
 class EmailSubscription(db.Model):
     __tablename__ = 'email_subscriptions'
+    __table_args__ = (
+        # filter_by(user_id=..., is_active=True) on the dashboard and settings pages
+        db.Index('ix_email_subscriptions_user_id_is_active', 'user_id', 'is_active'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     frequency = db.Column(db.String(20), nullable=False)  # daily, weekly
     time_preference = db.Column(db.String(10), default='08:00')  # HH:MM format
     is_active = db.Column(db.Boolean, default=True)
+    last_digest_at = db.Column(db.DateTime, nullable=True)  # Set by the digest dispatcher
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     def to_dict(self):
@@ -99,12 +117,20 @@ class EmailSubscription(db.Model):
             'frequency': self.frequency,
             'time_preference': self.time_preference,
             'is_active': self.is_active,
+            'last_digest_at': self.last_digest_at.isoformat() if self.last_digest_at else None,
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
 
 
 class BulletinItem(db.Model):
     __tablename__ = 'bulletin_items'
+    __table_args__ = (
+        # Lists that exclude (or only show) feedback and donation items, newest first
+        db.Index('ix_bulletin_items_is_feedback_created_at', 'is_feedback', 'created_at'),
+        db.Index('ix_bulletin_items_is_donation_created_at', 'is_donation', 'created_at'),
+        # Saved filters by category, newest first; also covers the distinct category list
+        db.Index('ix_bulletin_items_category_created_at', 'category', 'created_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200))
@@ -119,8 +145,44 @@ class BulletinItem(db.Model):
     category = db.Column(db.String(50), default='general')  # Category field
     date = db.Column(db.String(20))  # Date string from bulletin
     year_groups = db.Column(db.String(50))  # Comma-separated year groups
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)  # Every list is newest first
     scraped_at = db.Column(db.DateTime, default=datetime.utcnow)
+    api_json = db.Column(db.Text)  # Pre-serialized to_dict(), refreshed on every insert/update
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # Bumped on every ORM update
+    
+    # API field name -> columns needed to produce it (for ?fields= sparse fieldsets)
+    API_FIELDS = {
+        'id': ['id'],
+        'title': ['title'],
+        'content': ['content'],
+        'ai_headline': ['ai_headline'],
+        'metadata': ['item_metadata'],
+        'attachments': ['attachments'],
+        'is_feedback': ['is_feedback'],
+        'is_donation': ['is_donation'],
+        'is_from_student': ['is_from_student'],
+        'is_year9': ['has_specific_targeting'],
+        'has_specific_targeting': ['has_specific_targeting'],
+        'category': ['category'],
+        'date': ['date'],
+        'year_groups': ['year_groups'],
+        'created_at': ['created_at'],
+        'scraped_at': ['scraped_at']
+    }
+    
+    @classmethod
+    def load_fields(cls, fields=None):
+        """Loader option that only reads the columns a response needs.
+
+        Without fields only the pre-serialized api_json is read, so the large
+        Text columns (content, item_metadata, attachments) stay in the database.
+        """
+        if not fields:
+            return db.load_only(cls.id, cls.api_json)
+        columns = set()
+        for field in fields:
+            columns.update(cls.API_FIELDS[field])
+        return db.load_only(*[getattr(cls, column) for column in sorted(columns | {'id'})])
     
     def set_attachments(self, attachments_list):
         self.attachments = json.dumps(attachments_list) if attachments_list else None
@@ -134,7 +196,9 @@ class BulletinItem(db.Model):
     def get_metadata(self):
         return json.loads(self.item_metadata) if self.item_metadata else {}
     
-    def to_dict(self):
+    def to_dict(self, fields=None):
+        if fields:
+            return {field: self.api_field(field) for field in fields}
         return {
             'id': self.id,
             'title': self.title,
@@ -153,11 +217,75 @@ class BulletinItem(db.Model):
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'scraped_at': self.scraped_at.isoformat() if self.scraped_at else None
         }
+    
+    def api_field(self, field):
+        """Single to_dict() value, touching only the columns it needs"""
+        if field == 'metadata':
+            return self.get_metadata()
+        if field == 'attachments':
+            return self.get_attachments()
+        if field == 'is_year9':
+            return self.has_specific_targeting
+        if field in ('created_at', 'scraped_at'):
+            value = getattr(self, field)
+            return value.isoformat() if value else None
+        return getattr(self, field)
+    
+    def serialize(self):
+        """Encode to_dict() the way it is stored in api_json"""
+        return json.dumps(self.to_dict(), separators=(',', ':'), sort_keys=True)
+    
+    def to_json(self):
+        """API representation as a JSON string, without re-encoding"""
+        type(self).load_missing_json([self])
+        return self.api_json or self.serialize()
+    
+    @classmethod
+    def load_missing_json(cls, items):
+        """Read in one query the columns serialize() needs for items without stored api_json.
+
+        Rows written before api_json existed (or by Core statements that skip the
+        ORM events) would otherwise load each deferred column separately, per row.
+        utils/rebuild_bulletin_json.py --missing fills them in for good.
+        """
+        missing = [item.id for item in items if item.api_json is None and inspect(item).unloaded]
+        if missing:
+            cls.query.filter(cls.id.in_(missing)).options(db.undefer('*')).populate_existing().all()
+
+
+def _store_bulletin_api_json(connection, target, bump_version):
+    """Serialize the item once, at write time, next to the row.
+
+    Updates also bump version, which keys the rendered email fragment cache.
+    """
+    values = {'api_json': target.serialize()}
+    if bump_version:
+        values['version'] = (target.version or 0) + 1
+    connection.execute(
+        BulletinItem.__table__.update()
+        .where(BulletinItem.__table__.c.id == target.id)
+        .values(**values)
+    )
+    for key, value in values.items():
+        set_committed_value(target, key, value)
+
+
+@event.listens_for(BulletinItem, 'after_insert')
+def _bulletin_inserted(mapper, connection, target):
+    _store_bulletin_api_json(connection, target, bump_version=False)
+
+
+@event.listens_for(BulletinItem, 'after_update')
+def _bulletin_updated(mapper, connection, target):
+    _store_bulletin_api_json(connection, target, bump_version=True)
 
 
 class BulletinFilter(db.Model):
     """User-defined filters for bulletins"""
     __tablename__ = 'bulletin_filters'
+    __table_args__ = (
+        db.Index('ix_bulletin_filters_user_id_created_at', 'user_id', 'created_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -214,13 +342,18 @@ class BulletinFilter(db.Model):
 class AdminAction(db.Model):
     """Log admin actions for audit trail"""
     __tablename__ = 'admin_actions'
+    __table_args__ = (
+        # The audit log filters by action type or admin, newest first
+        db.Index('ix_admin_actions_action_type_timestamp', 'action_type', 'timestamp'),
+        db.Index('ix_admin_actions_admin_user_id_timestamp', 'admin_user_id', 'timestamp'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     admin_user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    target_user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    target_user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True, index=True)
     action_type = db.Column(db.String(50), nullable=False)  # create_user, delete_user, update_user, etc.
     action_details = db.Column(db.Text)  # JSON details of the action
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     ip_address = db.Column(db.String(45))  # Support IPv6
     
     # Relationships
@@ -249,15 +382,61 @@ class AdminAction(db.Model):
 
 class EmailLog(db.Model):
     __tablename__ = 'email_logs'
+    __table_args__ = (
+        # Per-user counts and deletes, and the admin log lists filtered by status
+        db.Index('ix_email_logs_user_id_created_at', 'user_id', 'created_at'),
+        db.Index('ix_email_logs_status_created_at', 'status', 'created_at'),
+        db.Index('ix_email_logs_status_sent_at', 'status', 'sent_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     subject = db.Column(db.String(200), nullable=False)
-    content = db.Column(db.Text, nullable=False)
+    inline_content = db.deferred(db.Column('content', db.Text, nullable=True))  # Legacy inline HTML, see compact_legacy_bodies
+    body_hash = db.Column(db.String(64), db.ForeignKey('email_bodies.hash'), nullable=True, index=True)
     status = db.Column(db.String(20), default='pending')  # pending, sent, failed
     error_message = db.Column(db.Text)
-    sent_at = db.Column(db.DateTime)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime, index=True)  # Admin log lists are ordered by it
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)  # Live rollups read today's rows
+    
+    body = db.relationship('EmailBody', lazy='select')
+    
+    API_FIELDS = ('id', 'user_id', 'subject', 'status', 'error_message', 'sent_at', 'created_at')
+    
+    @property
+    def content(self):
+        """The HTML body, decompressed from email_bodies on first access"""
+        pending = self.__dict__.get('_pending_content')
+        if pending is not None:
+            return pending
+        if self.body_hash:
+            return self.body.text()
+        return self.inline_content
+    
+    @content.setter
+    def content(self, html):
+        # The EmailBody row is written by the before_flush hook below
+        self._pending_content = html
+        self.body_hash = body_hash(html) if html is not None else None
+        if self.inline_content is not None:
+            self.inline_content = None
+    
+    @classmethod
+    def insert_many(cls, session, rows):
+        """Insert log rows (dicts with 'content') in one statement, storing each distinct body once"""
+        bodies = {}
+        values = []
+        for row in rows:
+            row = dict(row)
+            html = row.pop('content', None)
+            row['body_hash'] = body_hash(html) if html is not None else None
+            if html is not None:
+                bodies.setdefault(row['body_hash'], html)
+            values.append(row)
+        if not values:
+            return
+        _write_email_bodies(session.connection(), bodies)
+        session.execute(insert(cls), values)
     
     def to_dict(self):
         return {
@@ -269,3 +448,334 @@ class EmailLog(db.Model):
             'sent_at': self.sent_at.isoformat() if self.sent_at else None,
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
+
+
+class EmailJob(db.Model):
+    """A batch of queued emails sharing one subject and body (see outbox_service)"""
+    __tablename__ = 'email_jobs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)  # bulk, bulletin, verification, digest
+    subject = db.Column(db.String(200), nullable=False)
+    content = db.deferred(db.Column(db.Text, nullable=False))  # Full HTML, shared by every message in the job
+    requested_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    total = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    completed_at = db.Column(db.DateTime, nullable=True)  # Set once every message is sent or dead
+    
+    messages = db.relationship('OutboxMessage', backref='job', lazy='dynamic')
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'subject': self.subject,
+            'requested_by': self.requested_by,
+            'total': self.total,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'completed_at': self.completed_at.isoformat() if self.completed_at else None
+        }
+
+
+class OutboxMessage(db.Model):
+    """One queued email for one recipient, drained by the outbox workers"""
+    __tablename__ = 'outbox_messages'
+    __table_args__ = (
+        db.Index('ix_outbox_messages_status_next_attempt_at', 'status', 'next_attempt_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.Integer, db.ForeignKey('email_jobs.id'), nullable=False, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    recipient = db.Column(db.String(120), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, sending, sent, dead
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    claimed_by = db.Column(db.String(32), nullable=True)  # Token of the worker batch that holds it
+    claimed_at = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text)
+    sent_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'job_id': self.job_id,
+            'user_id': self.user_id,
+            'recipient': self.recipient,
+            'status': self.status,
+            'attempts': self.attempts,
+            'next_attempt_at': self.next_attempt_at.isoformat() if self.next_attempt_at else None,
+            'last_error': self.last_error,
+            'sent_at': self.sent_at.isoformat() if self.sent_at else None,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+
+class EmailBody(db.Model):
+    """An email HTML body stored once, compressed, keyed by its SHA-256"""
+    __tablename__ = 'email_bodies'
+    
+    hash = db.Column(db.String(64), primary_key=True)
+    encoding = db.Column(db.String(10), nullable=False)  # zstd, zlib or none
+    size = db.Column(db.Integer, nullable=False)  # Uncompressed length in bytes
+    data = db.Column(db.LargeBinary, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def text(self):
+        return decompress(self.encoding, self.data)
+
+
+def _insert_ignoring_duplicates(connection, table):
+    """INSERT that skips rows whose key already exists (another writer may store the same body)"""
+    dialect = connection.dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        return dialect_insert(table).on_conflict_do_nothing()
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        return dialect_insert(table).on_conflict_do_nothing()
+    if dialect == 'mysql':
+        return insert(table).prefix_with('IGNORE')
+    return insert(table)
+
+
+@event.listens_for(Session, 'before_flush')
+def _store_email_bodies(session, flush_context, instances):
+    """Write the EmailBody rows that new or changed logs point to"""
+    bodies = {}
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, EmailLog):
+            html = obj.__dict__.pop('_pending_content', None)
+            if html is not None and obj.body_hash not in bodies:
+                bodies[obj.body_hash] = html
+    if bodies:
+        _write_email_bodies(session.connection(), bodies)
+
+
+def _write_email_bodies(connection, bodies):
+    """Insert the {hash: html} bodies that email_bodies does not hold yet"""
+    if not bodies:
+        return
+    table = EmailBody.__table__
+    existing = set(connection.execute(select(table.c.hash).where(table.c.hash.in_(list(bodies)))).scalars())
+    now = datetime.utcnow()
+    rows = []
+    for digest, html in bodies.items():
+        if digest in existing:
+            continue
+        encoding, data = compress(html)
+        rows.append({'hash': digest, 'encoding': encoding, 'size': len(html.encode('utf-8')),
+                     'data': data, 'created_at': now})
+    if rows:
+        connection.execute(_insert_ignoring_duplicates(connection, table), rows)
+
+
+class SendRateState(db.Model):
+    """SMTP send token buckets shared by every process (a single row), see rate_governor"""
+    __tablename__ = 'send_rate_state'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    second_tokens = db.Column(db.Float, nullable=False, default=0)
+    minute_tokens = db.Column(db.Float, nullable=False, default=0)
+    day_tokens = db.Column(db.Float, nullable=False, default=0)
+    refilled_at = db.Column(db.Float, nullable=False, default=0)  # Unix time of the last refill
+    factor = db.Column(db.Float, nullable=False, default=1.0)  # Share of the configured rate in use after throttling
+    paused_until = db.Column(db.Float, nullable=False, default=0)  # Unix time; no sends before it
+    last_throttle_at = db.Column(db.Float, nullable=False, default=0)
+    throttles = db.Column(db.Integer, nullable=False, default=0)
+
+
+class SchedulerLease(db.Model):
+    """Which process runs the scheduled jobs, see leader_lease"""
+    __tablename__ = 'scheduler_leases'
+    
+    name = db.Column(db.String(50), primary_key=True)
+    holder = db.Column(db.String(200), nullable=False)  # host:pid:random of the leader
+    acquired_at = db.Column(db.DateTime, nullable=False)
+    heartbeat_at = db.Column(db.DateTime, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)  # Another process may take the lease after this
+
+
+# APScheduler's SQLAlchemyJobStore table, declared here so migrations create it (see scheduler_service)
+scheduler_jobs_table = db.Table(
+    'apscheduler_jobs',
+    db.Column('id', db.Unicode(191), primary_key=True),
+    db.Column('next_run_time', db.Float(25), index=True),
+    db.Column('job_state', db.LargeBinary, nullable=False)
+)
+
+
+class JobRun(db.Model):
+    """One execution of a scheduled job, or a manual run queued by an admin"""
+    __tablename__ = 'job_runs'
+    __table_args__ = (
+        # Run history per job, newest first
+        db.Index('ix_job_runs_job_id_queued_at', 'job_id', 'queued_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.String(100), nullable=False)
+    trigger = db.Column(db.String(20), nullable=False, default='schedule')  # schedule, manual
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, success, failed
+    requested_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    host = db.Column(db.String(200))  # Leader process that ran it
+    queued_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    duration_ms = db.Column(db.Integer)
+    result = db.Column(db.Text)  # Short summary from the job
+    error = db.Column(db.Text)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'job_id': self.job_id,
+            'trigger': self.trigger,
+            'status': self.status,
+            'requested_by': self.requested_by,
+            'host': self.host,
+            'queued_at': self.queued_at.isoformat() if self.queued_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'duration_ms': self.duration_ms,
+            'result': self.result,
+            'error': self.error
+        }
+
+
+class ScrapeState(db.Model):
+    """What the last bulletin scrape saw, for conditional fetches (see bulletin_scraper.scrape_if_changed)"""
+    __tablename__ = 'scrape_state'
+    
+    name = db.Column(db.String(50), primary_key=True)  # e.g. 'bulletin'
+    etag = db.Column(db.String(200))  # Validators from the last fetched page
+    last_modified = db.Column(db.String(100))
+    fingerprint = db.Column(db.String(64))  # SHA-256 of the bulletin items as last scraped in full
+    checked_at = db.Column(db.DateTime)
+    changed_at = db.Column(db.DateTime)  # Last full scrape of a changed page
+    checks = db.Column(db.Integer, nullable=False, default=0)
+    full_scrapes = db.Column(db.Integer, nullable=False, default=0)
+    
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'checked_at': self.checked_at.isoformat() if self.checked_at else None,
+            'changed_at': self.changed_at.isoformat() if self.changed_at else None,
+            'checks': self.checks,
+            'full_scrapes': self.full_scrapes
+        }
+
+
+class DataVersion(db.Model):
+    """Monotonic version counters used to derive HTTP ETags"""
+    __tablename__ = 'data_versions'
+    
+    name = db.Column(db.String(100), primary_key=True)  # e.g. 'bulletins', 'user:42'
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'version': self.version,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
+
+class RevokedToken(db.Model):
+    """JWTs revoked before their natural expiry (logout); pruned once expired"""
+    __tablename__ = 'revoked_tokens'
+    
+    jti = db.Column(db.String(36), primary_key=True)
+    token_type = db.Column(db.String(10), nullable=False, default='access')
+    user_id = db.Column(db.Integer, nullable=True)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    revoked_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    
+    def to_dict(self):
+        return {
+            'jti': self.jti,
+            'token_type': self.token_type,
+            'user_id': self.user_id,
+            'expires_at': self.expires_at.isoformat() if self.expires_at else None,
+            'revoked_at': self.revoked_at.isoformat() if self.revoked_at else None
+        }
+
+
+class UserStats(db.Model):
+    """Per-user counters maintained by stats_service (one row per user)"""
+    __tablename__ = 'user_stats'
+    
+    user_id = db.Column(db.Integer, primary_key=True)
+    emails_received = db.Column(db.Integer, nullable=False, default=0)
+    is_subscribed = db.Column(db.Boolean, nullable=False, default=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'user_id': self.user_id,
+            'emails_received': self.emails_received,
+            'is_subscribed': self.is_subscribed,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
+
+class YearGroupStats(db.Model):
+    """Bulletin counts visible to a year group, maintained by stats_service"""
+    __tablename__ = 'year_group_stats'
+    
+    year_group = db.Column(db.String(10), primary_key=True)
+    total_bulletins = db.Column(db.Integer, nullable=False, default=0)
+    recent_bulletins = db.Column(db.Integer, nullable=False, default=0)  # created in the last 7 days
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'year_group': self.year_group,
+            'total_bulletins': self.total_bulletins,
+            'recent_bulletins': self.recent_bulletins,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
+
+class EmailLogDaily(db.Model):
+    """Email logs per day, status and recipient year group, rolled up by email_retention"""
+    __tablename__ = 'email_log_daily'
+    
+    day = db.Column(db.Date, primary_key=True)  # UTC day of EmailLog.created_at
+    status = db.Column(db.String(20), primary_key=True)
+    year_group = db.Column(db.String(10), primary_key=True)  # '' when the user is gone
+    count = db.Column(db.Integer, nullable=False, default=0)
+    
+    def to_dict(self):
+        return {
+            'day': self.day.isoformat(),
+            'status': self.status,
+            'year_group': self.year_group,
+            'count': self.count
+        }
+
+
+class ArchivedEmailLog(db.Model):
+    """An email log moved out of email_logs after EMAIL_LOG_RETENTION_DAYS"""
+    __tablename__ = 'email_logs_archive'
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)  # The original email_logs id
+    user_id = db.Column(db.Integer, nullable=False, index=True)
+    subject = db.Column(db.String(200), nullable=False)
+    content = db.deferred(db.Column(db.Text, nullable=True))  # Legacy inline HTML
+    body_hash = db.Column(db.String(64), nullable=True, index=True)
+    status = db.Column(db.String(20))
+    error_message = db.Column(db.Text)
+    sent_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class ArchivedEmailCount(db.Model):
+    """Email logs per user removed by retention, so user_stats counts survive a purge"""
+    __tablename__ = 'archived_email_counts'
+    
+    user_id = db.Column(db.Integer, primary_key=True)
+    emails = db.Column(db.Integer, nullable=False, default=0)
@@ -1,9 +1,15 @@
 from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from app import db
-from app.models import User, BulletinItem, EmailLog, EmailSubscription, BulletinFilter, AdminAction
-from datetime import datetime, timedelta
-from sqlalchemy import func, or_, and_
+from app.services.identity_service import current_user_is_admin, revoke_user_tokens
+from app.services.admin_stats_service import get_admin_stats
+from app.services.email_retention import daily_email_counts
+from app.models import User, BulletinItem, EmailLog, EmailSubscription, BulletinFilter, AdminAction, JobRun
+from app.services.scheduler_service import JOBS as SCHEDULED_JOBS
+from datetime import datetime
+from sqlalchemy import or_, and_
+from app.services.serialization import json_response, parse_fields, serialize_items
+from app.services.password_service import PasswordHasherBusy
 import json
 
 admin_bp = Blueprint('admin', __name__)
@@ -46,12 +52,10 @@ def can_delete_user(current_admin_id, target_user_id):
 def check_admin_access():
     """Check if user has admin access before processing any request to admin endpoints"""
     try:
-        from flask_jwt_extended import verify_jwt_in_request, get_jwt_identity
+        from flask_jwt_extended import verify_jwt_in_request
         verify_jwt_in_request()
-        current_user_id = get_jwt_identity()
-        user = User.query.get(current_user_id)
         
-        if not user or not user.is_admin:
+        if not current_user_is_admin():
             return jsonify({'error': 'Admin access required'}), 403
     except Exception:
         return jsonify({'error': 'Authentication required'}), 401
@@ -59,10 +63,7 @@ def check_admin_access():
 def admin_required(f):
     """Decorator to require admin access"""
     def decorated_function(*args, **kwargs):
-        current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
-        
-        if not user or not user.is_admin:
+        if not current_user_is_admin():
             return jsonify({'error': 'Admin access required'}), 403
         
         return f(*args, **kwargs)
@@ -128,8 +129,11 @@ def get_all_bulletin_items():
         per_page = min(request.args.get('per_page', 20, type=int), 100)
         search = request.args.get('search', '').strip()
         item_type = request.args.get('type', '')  # feedback, donation, normal
+        fields, error = parse_fields(BulletinItem.API_FIELDS)
+        if error:
+            return jsonify({'error': error}), 400
         
-        query = BulletinItem.query
+        query = BulletinItem.query.options(BulletinItem.load_fields(fields))
         
         # Apply search filter
         if search:
@@ -162,10 +166,8 @@ def get_all_bulletin_items():
             error_out=False
         )
         
-        items = [item.to_dict() for item in pagination.items]
-        
-        return jsonify({
-            'items': items,
+        return json_response({
+            'items': serialize_items(pagination.items, fields),
             'pagination': {
                 'page': page,
                 'per_page': per_page,
@@ -205,8 +207,12 @@ def get_email_logs():
         page = request.args.get('page', 1, type=int)
         per_page = min(request.args.get('per_page', 20, type=int), 100)
         status = request.args.get('status', '')  # sent, failed, pending
+        fields, error = parse_fields(EmailLog.API_FIELDS + ('user_email',))
+        if error:
+            return jsonify({'error': error}), 400
         
-        query = EmailLog.query
+        # Load each log's user in the same query instead of once per row
+        query = EmailLog.query.options(db.joinedload(EmailLog.user).load_only(User.id, User.email))
         
         # Apply status filter
         if status:
@@ -226,6 +232,8 @@ def get_email_logs():
         for log in pagination.items:
             log_dict = log.to_dict()
             log_dict['user_email'] = log.user.email if log.user else 'Unknown'
+            if fields:
+                log_dict = {field: log_dict[field] for field in fields}
             logs.append(log_dict)
         
         return jsonify({
@@ -243,66 +251,62 @@ def get_email_logs():
     except Exception as e:
         return jsonify({'error': 'Failed to get email logs', 'details': str(e)}), 500
 
-@admin_bp.route('/dashboard-stats', methods=['GET'])
+@admin_bp.route('/email-logs/<int:log_id>', methods=['GET'])
 @jwt_required()
 @admin_required
-def get_dashboard_stats():
+def get_email_log(log_id):
+    """One email log including its HTML body"""
     try:
-        # User statistics
-        total_users = User.query.count()
-        active_users = User.query.filter(User.is_active == True).count()
-        admin_users = User.query.filter(User.is_admin == True).count()
-        
-        # Users registered in the last 30 days
-        month_ago = datetime.utcnow() - timedelta(days=30)
-        new_users = User.query.filter(User.created_at >= month_ago).count()
-        
-        # Bulletin item statistics
-        total_items = BulletinItem.query.count()
-        feedback_items = BulletinItem.query.filter(BulletinItem.is_feedback == True).count()
-        donation_items = BulletinItem.query.filter(BulletinItem.is_donation == True).count()
-        
-        # Recent items (last 7 days)
-        week_ago = datetime.utcnow() - timedelta(days=7)
-        recent_items = BulletinItem.query.filter(BulletinItem.created_at >= week_ago).count()
+        log = EmailLog.query.get(log_id)
+        if not log:
+            return jsonify({'error': 'Email log not found'}), 404
         
-        # Email statistics
-        total_emails = EmailLog.query.count()
-        sent_emails = EmailLog.query.filter(EmailLog.status == 'sent').count()
-        failed_emails = EmailLog.query.filter(EmailLog.status == 'failed').count()
+        # The body is stored once per distinct email and only decompressed here
+        log_dict = log.to_dict()
+        log_dict['user_email'] = log.user.email if log.user else 'Unknown'
+        log_dict['content'] = log.content
+        return jsonify({'log': log_dict}), 200
         
-        # Recent emails (last 7 days)
-        recent_emails = EmailLog.query.filter(EmailLog.created_at >= week_ago).count()
-        
-        # Email frequency distribution
-        email_frequency_stats = db.session.query(
-            User.email_frequency,
-            func.count(User.id).label('count')
-        ).group_by(User.email_frequency).all()
+    except Exception as e:
+        return jsonify({'error': 'Failed to get email log', 'details': str(e)}), 500
+
+@admin_bp.route('/email-stats/daily', methods=['GET'])
+@jwt_required()
+@admin_required
+def get_daily_email_stats():
+    """Emails per day by status and year group, for the dashboard chart"""
+    try:
+        days = min(max(request.args.get('days', 30, type=int), 1), 366)
+        return jsonify({'days': daily_email_counts(days)}), 200
         
-        frequency_distribution = {freq: count for freq, count in email_frequency_stats}
+    except Exception as e:
+        return jsonify({'error': 'Failed to get daily email stats', 'details': str(e)}), 500
+
+@admin_bp.route('/dashboard-stats', methods=['GET'])
+@jwt_required()
+@admin_required
+def get_dashboard_stats():
+    try:
+        stats = get_admin_stats()
+        users = stats['users']
+        emails = stats['emails']
         
         return jsonify({
             'users': {
-                'total': total_users,
-                'active': active_users,
-                'admin': admin_users,
-                'new_this_month': new_users
-            },
-            'bulletin_items': {
-                'total': total_items,
-                'feedback': feedback_items,
-                'donation': donation_items,
-                'recent': recent_items
+                'total': users['total'],
+                'active': users['active'],
+                'admin': users['admin'],
+                'new_this_month': users['new_this_month']
             },
+            'bulletin_items': stats['bulletin_items'],
             'emails': {
-                'total': total_emails,
-                'sent': sent_emails,
-                'failed': failed_emails,
-                'recent': recent_emails
+                'total': emails['total'],
+                'sent': emails['sent'],
+                'failed': emails['failed'],
+                'recent': emails['recent']
             },
-            'email_frequency_distribution': frequency_distribution,
-            'last_updated': datetime.utcnow().isoformat()
+            'email_frequency_distribution': stats['email_frequency_distribution'],
+            'last_updated': stats['last_updated']
         }), 200
         
     except Exception as e:
@@ -374,8 +378,9 @@ def send_bulk_email():
         content = data['content']
         recipient_ids = data['recipient_ids']
         
-        # Get recipients
-        recipients = User.query.filter(User.id.in_(recipient_ids), User.is_active == True).all()
+        # Get recipients (just id and email; plain rows are not expired by the commits below)
+        recipients = User.query.filter(User.id.in_(recipient_ids), User.is_active == True) \
+            .with_entities(User.id, User.email).all()
         
         if not recipients:
             return jsonify({'error': 'No valid recipients found'}), 400
@@ -392,18 +397,17 @@ def send_bulk_email():
             }
         )
         
-        # Send emails using EmailService
+        # Queue the emails in the outbox
         from app.services.email_service import EmailService
         email_service = EmailService()
         
-        result = email_service.send_bulk_email(recipients, subject, content)
+        job = email_service.queue_bulk_email(recipients, subject, content, requested_by=current_user_id)
         
         return jsonify({
-            'message': f'Bulk email processed: {result["successful_sends"]} sent, {result["failed_sends"]} failed',
-            'successful_sends': result['successful_sends'],
-            'failed_sends': result['failed_sends'],
-            'total_recipients': result['total_recipients']
-        }), 200
+            'message': f'Bulk email queued for {len(recipients)} recipients',
+            'job_id': job.id,
+            'total_recipients': len(recipients)
+        }), 202
         
     except Exception as e:
         db.session.rollback()
@@ -415,18 +419,13 @@ def send_bulk_email():
 def admin_stats():
     """Get admin dashboard statistics"""
     try:
-        from app.models import User, BulletinItem, EmailLog, EmailSubscription
-        
-        total_users = User.query.count()
-        total_subscribers = EmailSubscription.query.filter_by(is_active=True).count()
-        total_bulletins = BulletinItem.query.count()
-        total_emails_sent = EmailLog.query.count()
+        stats = get_admin_stats()
         
         return jsonify({
-            'total_users': total_users,
-            'total_subscribers': total_subscribers,
-            'total_bulletins': total_bulletins,
-            'total_emails_sent': total_emails_sent
+            'total_users': stats['users']['total'],
+            'total_subscribers': stats['subscriptions']['active'],
+            'total_bulletins': stats['bulletin_items']['total'],
+            'total_emails_sent': stats['emails']['total']
         })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -437,17 +436,17 @@ def admin_stats():
 def get_all_users():
     """Get all users for admin management"""
     try:
-        users = User.query.all()
+        # One extra query for all subscriptions instead of one per user
+        users = User.query.options(db.selectinload(User.subscriptions)).all()
         users_data = []
         
         for user in users:
-            subscription = EmailSubscription.query.filter_by(user_id=user.id, is_active=True).first()
             users_data.append({
                 'id': user.id,
                 'name': user.name,
                 'email': user.email,
                 'is_admin': user.is_admin,
-                'subscribed': subscription is not None,
+                'subscribed': any(subscription.is_active for subscription in user.subscriptions),
                 'created_at': user.created_at.isoformat()
             })
         
@@ -501,6 +500,9 @@ def create_user():
         
         return jsonify({'message': 'User created successfully', 'id': user.id}), 201
         
+    except PasswordHasherBusy:
+        # Answered with a 503 by the app's error handler
+        raise
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
@@ -524,8 +526,9 @@ def admin_update_user(user_id):
                 return jsonify({'error': 'Email already taken'}), 400
             user.email = data['email']
         
-        if 'is_admin' in data:
+        if 'is_admin' in data and bool(data['is_admin']) != user.is_admin:
             user.is_admin = data['is_admin']
+            user.bump_token_version()
         
         if 'password' in data and data['password']:
             user.set_password(data['password'])
@@ -533,6 +536,9 @@ def admin_update_user(user_id):
         db.session.commit()
         return jsonify({'message': 'User updated successfully'})
         
+    except PasswordHasherBusy:
+        # Answered with a 503 by the app's error handler
+        raise
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
@@ -556,6 +562,7 @@ def admin_delete_user(user_id):
         EmailLog.query.filter_by(user_id=user_id).delete()
         BulletinFilter.query.filter_by(user_id=user_id).delete()
         
+        revoke_user_tokens(user)
         db.session.delete(user)
         db.session.commit()
         
@@ -597,7 +604,9 @@ def get_all_bulletins():
 def admin_get_email_logs():
     """Get email logs for admin monitoring"""
     try:
-        logs = EmailLog.query.order_by(EmailLog.sent_at.desc()).limit(100).all()
+        logs = EmailLog.query.options(
+            db.joinedload(EmailLog.user).load_only(User.id, User.email)
+        ).order_by(EmailLog.sent_at.desc()).limit(100).all()
         
         logs_data = []
         for log in logs:
@@ -637,26 +646,16 @@ def refresh_bulletins():
 @admin_required
 def admin_stats_api():
     try:
-        # Get total counts
-        total_users = User.query.count()
-        total_bulletins = BulletinItem.query.count()
-        total_emails = EmailLog.query.count()
-        active_subscriptions = EmailSubscription.query.filter_by(is_active=True).count()
-        
-        # Get recent activity (last 7 days)
-        week_ago = datetime.utcnow() - timedelta(days=7)
-        recent_users = User.query.filter(User.created_at >= week_ago).count()
-        recent_bulletins = BulletinItem.query.filter(BulletinItem.created_at >= week_ago).count()
-        recent_emails = EmailLog.query.filter(EmailLog.sent_at >= week_ago).count()
+        stats = get_admin_stats()
         
         return jsonify({
-            'total_users': total_users,
-            'total_bulletins': total_bulletins,
-            'total_emails': total_emails,
-            'active_subscriptions': active_subscriptions,
-            'recent_users': recent_users,
-            'recent_bulletins': recent_bulletins,
-            'recent_emails': recent_emails
+            'total_users': stats['users']['total'],
+            'total_bulletins': stats['bulletin_items']['total'],
+            'total_emails': stats['emails']['total'],
+            'active_subscriptions': stats['subscriptions']['active'],
+            'recent_users': stats['users']['new_this_week'],
+            'recent_bulletins': stats['bulletin_items']['recent'],
+            'recent_emails': stats['emails']['recent_sent']
         }), 200
         
     except Exception as e:
@@ -718,8 +717,11 @@ def admin_bulletins_api():
         per_page = min(request.args.get('per_page', 20, type=int), 100)
         search = request.args.get('search', '').strip()
         item_type = request.args.get('type', '')
+        fields, error = parse_fields(BulletinItem.API_FIELDS)
+        if error:
+            return jsonify({'error': error}), 400
         
-        query = BulletinItem.query
+        query = BulletinItem.query.options(BulletinItem.load_fields(fields))
         
         # Apply search filter
         if search:
@@ -752,10 +754,8 @@ def admin_bulletins_api():
             error_out=False
         )
         
-        bulletins = [bulletin.to_dict() for bulletin in pagination.items]
-        
-        return jsonify({
-            'bulletins': bulletins,
+        return json_response({
+            'bulletins': serialize_items(pagination.items, fields),
             'pagination': {
                 'page': page,
                 'per_page': per_page,
@@ -777,8 +777,12 @@ def admin_email_logs_api():
         page = request.args.get('page', 1, type=int)
         per_page = min(request.args.get('per_page', 20, type=int), 100)
         status = request.args.get('status', '')
+        fields, error = parse_fields(EmailLog.API_FIELDS + ('user_name', 'user_email'))
+        if error:
+            return jsonify({'error': error}), 400
         
-        query = EmailLog.query
+        # Load each log's user in the same query instead of once per row
+        query = EmailLog.query.options(db.joinedload(EmailLog.user).load_only(User.id, User.name, User.email))
         
         # Apply status filter
         if status:
@@ -801,6 +805,8 @@ def admin_email_logs_api():
             if log.user:
                 log_data['user_name'] = log.user.name
                 log_data['user_email'] = log.user.email
+            if fields:
+                log_data = {field: log_data.get(field) for field in fields}
             email_logs.append(log_data)
         
         return jsonify({
@@ -854,10 +860,12 @@ def admin_update_user_api(user_id):
             user.year_group = data['year_group']
         if 'email_frequency' in data:
             user.email_frequency = data['email_frequency']
-        if 'is_admin' in data:
+        if 'is_admin' in data and bool(data['is_admin']) != user.is_admin:
             user.is_admin = bool(data['is_admin'])
-        if 'is_active' in data:
+            user.bump_token_version()
+        if 'is_active' in data and bool(data['is_active']) != user.is_active:
             user.is_active = bool(data['is_active'])
+            user.bump_token_version()
         
         db.session.commit()
         
@@ -904,7 +912,8 @@ def admin_delete_user_api(user_id):
         BulletinFilter.query.filter_by(user_id=user_id).delete()
         AdminAction.query.filter_by(target_user_id=user_id).delete()
         
-        # Delete the user
+        # Delete the user and revoke their tokens
+        revoke_user_tokens(user)
         db.session.delete(user)
         db.session.commit()
         
@@ -925,7 +934,7 @@ def get_bulletin_filters():
         per_page = min(request.args.get('per_page', 20, type=int), 100)
         user_id = request.args.get('user_id', type=int)
         
-        query = BulletinFilter.query
+        query = BulletinFilter.query.options(db.joinedload(BulletinFilter.user).load_only(User.id, User.name))
         
         # Filter by user if specified
         if user_id:
@@ -1039,7 +1048,10 @@ def get_audit_logs():
         action_type = request.args.get('action_type', '')
         admin_user_id = request.args.get('admin_user_id', type=int)
         
-        query = AdminAction.query
+        query = AdminAction.query.options(
+            db.joinedload(AdminAction.admin_user).load_only(User.id, User.name),
+            db.joinedload(AdminAction.target_user).load_only(User.id, User.name)
+        )
         
         # Apply filters
         if action_type:
@@ -1099,6 +1111,7 @@ def toggle_user_admin(user_id):
         # Toggle admin status
         old_status = user.is_admin
         user.is_admin = not user.is_admin
+        user.bump_token_version()
         
         # Log the action
         log_admin_action(
@@ -1143,6 +1156,7 @@ def deactivate_user(user_id):
                 return jsonify({'error': 'Cannot deactivate the last active admin'}), 400
         
         user.is_active = False
+        user.bump_token_version()
         
         # Log the action
         log_admin_action(
@@ -1177,6 +1191,7 @@ def reactivate_user(user_id):
             return jsonify({'error': 'User not found'}), 404
         
         user.is_active = True
+        user.bump_token_version()
         
         # Log the action
         log_admin_action(
@@ -1209,6 +1224,8 @@ def get_scheduler_status():
             jobs = current_app.scheduler.get_jobs()
             return jsonify({
                 'scheduler_active': True,
+                'is_leader': current_app.scheduler.is_leader(),
+                'leader': current_app.scheduler.get_leader(),
                 'jobs': jobs
             }), 200
         else:
@@ -1223,19 +1240,84 @@ def get_scheduler_status():
 @jwt_required()
 @admin_required
 def trigger_bulletin_scraper():
-    """Manually trigger bulletin scraper"""
+    """Queue a bulletin scraper run"""
     try:
         if hasattr(current_app, 'scheduler'):
-            success = current_app.scheduler.trigger_bulletin_scraper_now()
-            if success:
-                return jsonify({'message': 'Bulletin scraper triggered successfully'}), 200
-            else:
-                return jsonify({'error': 'Failed to trigger bulletin scraper'}), 500
+            run = current_app.scheduler.trigger_job('bulletin_scraper', requested_by=int(get_jwt_identity()))
+            return jsonify({'message': 'Bulletin scraper run queued', 'run': run.to_dict()}), 202
         else:
             return jsonify({'error': 'Scheduler not available'}), 503
     except Exception as e:
+        db.session.rollback()
         return jsonify({'error': 'Failed to trigger scraper', 'details': str(e)}), 500
 
+@admin_bp.route('/scheduler/jobs/<job_id>/run', methods=['POST'])
+@jwt_required()
+@admin_required
+def trigger_scheduler_job(job_id):
+    """Queue a run of a scheduled job; the scheduler leader runs it"""
+    try:
+        if not hasattr(current_app, 'scheduler'):
+            return jsonify({'error': 'Scheduler not available'}), 503
+        if job_id not in SCHEDULED_JOBS:
+            return jsonify({'error': 'Job not found'}), 404
+        run = current_app.scheduler.trigger_job(job_id, requested_by=int(get_jwt_identity()))
+        return jsonify({'message': f'{SCHEDULED_JOBS[job_id][0]} run queued', 'run': run.to_dict()}), 202
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': 'Failed to trigger job', 'details': str(e)}), 500
+
+@admin_bp.route('/scheduler/runs', methods=['GET'])
+@jwt_required()
+@admin_required
+def get_scheduler_runs():
+    """Job run history, newest first"""
+    try:
+        page = request.args.get('page', 1, type=int)
+        per_page = min(request.args.get('per_page', 20, type=int), 100)
+        job_id = request.args.get('job_id', '').strip()
+        status = request.args.get('status', '').strip()
+        
+        query = JobRun.query
+        if job_id:
+            query = query.filter(JobRun.job_id == job_id)
+        if status:
+            query = query.filter(JobRun.status == status)
+        
+        pagination = query.order_by(JobRun.queued_at.desc()).paginate(
+            page=page,
+            per_page=per_page,
+            error_out=False
+        )
+        
+        return jsonify({
+            'runs': [run.to_dict() for run in pagination.items],
+            'pagination': {
+                'page': page,
+                'per_page': per_page,
+                'total': pagination.total,
+                'pages': pagination.pages,
+                'has_next': pagination.has_next,
+                'has_prev': pagination.has_prev
+            }
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': 'Failed to get job runs', 'details': str(e)}), 500
+
+@admin_bp.route('/scheduler/runs/<int:run_id>', methods=['GET'])
+@jwt_required()
+@admin_required
+def get_scheduler_run(run_id):
+    """A single job run"""
+    try:
+        run = db.session.get(JobRun, run_id)
+        if not run:
+            return jsonify({'error': 'Job run not found'}), 404
+        return jsonify({'run': run.to_dict()}), 200
+    except Exception as e:
+        return jsonify({'error': 'Failed to get job run', 'details': str(e)}), 500
+
 @admin_bp.route('/bulletins/clear-all', methods=['POST'])
 @jwt_required()
 @admin_required
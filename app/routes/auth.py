@@ -1,15 +1,16 @@
 from flask import Blueprint, request, jsonify
-from flask_jwt_extended import create_access_token, create_refresh_token, jwt_required, get_jwt_identity, get_jwt
+from flask_jwt_extended import create_refresh_token, jwt_required, get_jwt_identity, get_jwt
 from app import db
+from app.services.identity_service import get_current_user, create_user_access_token, revoke_user_tokens
+from app.services.revocation_service import revocation_store
+from app.services.password_service import PasswordHasherBusy
+from app.services.stats_service import get_user_stats
 from app.models import User, EmailSubscription, EmailLog, BulletinFilter
 from datetime import datetime, timedelta
 import re
 
 auth_bp = Blueprint('auth', __name__)
 
-# In-memory blacklist for revoked tokens (in production, use Redis)
-blacklisted_tokens = set()
-
 def is_valid_email(email):
     pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
     return re.match(pattern, email) is not None
@@ -57,21 +58,26 @@ def register():
         db.session.add(user)
         db.session.commit()
         
-        # Send verification email
+        # Queue verification email
+        email_job_id = None
         try:
             from app.services.email_service import EmailService
             email_service = EmailService()
-            email_service.send_verification_email(user, verification_code)
+            email_job_id = email_service.queue_verification_email(user, verification_code).id
         except Exception as e:
-            print(f"Failed to send verification email: {e}")
+            print(f"Failed to queue verification email: {e}")
         
         return jsonify({
             'message': 'User registered successfully. Please check your email for a 6-digit verification code.',
             'user': user.to_dict(),
             'email_verification_required': True,
-            'user_id': user.id  # Include user_id for verification process
+            'user_id': user.id,  # Include user_id for verification process
+            'email_job_id': email_job_id
         }), 201
         
+    except PasswordHasherBusy:
+        # Answered with a 503 by the app's error handler
+        raise
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': 'Registration failed', 'details': str(e)}), 500
@@ -104,6 +110,10 @@ def login():
                 'user_id': user.id
             }), 403
         
+        # Upgrade the stored hash if PASSWORD_HASH_METHOD has changed
+        if user.password_needs_rehash():
+            user.set_password(password)
+        
         # Update last login
         user.last_login = datetime.utcnow()
         db.session.commit()
@@ -112,10 +122,7 @@ def login():
         needs_preferences = not user.preferences_set and user.is_email_verified
         
         # Create tokens
-        access_token = create_access_token(
-            identity=str(user.id),
-            expires_delta=timedelta(hours=4)  # Increase from 1 hour to 4 hours
-        )
+        access_token = create_user_access_token(user)
         refresh_token = create_refresh_token(
             identity=str(user.id),
             expires_delta=timedelta(days=30)
@@ -129,6 +136,9 @@ def login():
             'preferences_setup_required': needs_preferences
         }), 200
         
+    except PasswordHasherBusy:
+        # Answered with a 503 by the app's error handler
+        raise
     except Exception as e:
         return jsonify({'error': 'Login failed', 'details': str(e)}), 500
 
@@ -136,17 +146,13 @@ def login():
 @jwt_required(refresh=True)
 def refresh():
     try:
-        current_user_id = get_jwt_identity()
-        user = User.query.get(current_user_id)
+        user = get_current_user()
         
         if not user or not user.is_active:
             return jsonify({'error': 'User not found or inactive'}), 404
         
-        # Create new access token
-        access_token = create_access_token(
-            identity=user.id,
-            expires_delta=timedelta(hours=4)  # Use 4 hours to match login
-        )
+        # Create new access token with the user's current claims
+        access_token = create_user_access_token(user)
         
         return jsonify({
             'access_token': access_token,
@@ -160,34 +166,44 @@ def refresh():
 @jwt_required()
 def logout():
     try:
-        jti = get_jwt()['jti']
-        blacklisted_tokens.add(jti)
+        revocation_store.revoke(get_jwt())
         return jsonify({'message': 'Successfully logged out'}), 200
     except Exception as e:
         return jsonify({'error': 'Logout failed', 'details': str(e)}), 500
 
+@auth_bp.route('/session', methods=['GET'])
+@jwt_required()
+def get_session():
+    """Validate the access token and return its claims without touching the users table"""
+    claims = get_jwt()
+    return jsonify({
+        'valid': True,
+        'user_id': claims['sub'],
+        'is_admin': claims.get('is_admin'),
+        'is_active': claims.get('is_active'),
+        'preferences_set': claims.get('preferences_set'),
+        'token_version': claims.get('token_version'),
+        'expires_at': datetime.utcfromtimestamp(claims['exp']).isoformat()
+    }), 200
+
 @auth_bp.route('/profile', methods=['GET'])
 @jwt_required()
 def get_profile():
     """Get current user's profile"""
     try:
-        user_id = get_jwt_identity()
-        user = User.query.get(user_id)
+        user = get_current_user()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
         
-        # Get subscription status
-        subscription = EmailSubscription.query.filter_by(user_id=user_id, is_active=True).first()
-        
-        # Get user stats
-        emails_received = EmailLog.query.filter_by(user_id=user_id).count()
+        # Subscription status and email count come from the maintained counters
+        stats = get_user_stats(user.id)
         
         return jsonify({
             'username': user.name,  # Use name instead of username
             'email': user.email,
             'role': 'admin' if user.is_admin else 'user',
-            'email_subscription': subscription is not None,
+            'email_subscription': stats.is_subscribed,
             'preferences': {
                 'sports': True,  # Default preferences
                 'academic': True,
@@ -195,7 +211,7 @@ def get_profile():
                 'general': True
             },
             'stats': {
-                'emails_received': emails_received,
+                'emails_received': stats.emails_received,
                 'bulletins_viewed': 0,  # Could be tracked separately
                 'last_login': user.created_at.isoformat(),
                 'member_since': user.created_at.isoformat()
@@ -210,7 +226,7 @@ def update_profile():
     """Update current user's profile"""
     try:
         user_id = get_jwt_identity()
-        user = User.query.get(user_id)
+        user = get_current_user()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
@@ -250,8 +266,7 @@ def update_profile():
 def change_password():
     """Change user password"""
     try:
-        user_id = get_jwt_identity()
-        user = User.query.get(user_id)
+        user = get_current_user()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
@@ -274,6 +289,9 @@ def change_password():
         
         return jsonify({'message': 'Password changed successfully'})
         
+    except PasswordHasherBusy:
+        # Answered with a 503 by the app's error handler
+        raise
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
@@ -284,7 +302,7 @@ def delete_account():
     """Delete user account"""
     try:
         user_id = get_jwt_identity()
-        user = User.query.get(user_id)
+        user = get_current_user()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
@@ -303,12 +321,16 @@ def delete_account():
         EmailLog.query.filter_by(user_id=user_id).delete()
         BulletinFilter.query.filter_by(user_id=user_id).delete()
         
-        # Delete user
+        # Delete user and revoke their tokens
+        revoke_user_tokens(user)
         db.session.delete(user)
         db.session.commit()
         
         return jsonify({'message': 'Account deleted successfully'})
         
+    except PasswordHasherBusy:
+        # Answered with a 503 by the app's error handler
+        raise
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
@@ -392,21 +414,19 @@ def resend_verification():
         verification_code = user.generate_verification_code()
         db.session.commit()
         
-        # Send verification email
+        # Queue verification email
         try:
             from app.services.email_service import EmailService
             email_service = EmailService()
-            success = email_service.send_verification_email(user, verification_code)
+            job = email_service.queue_verification_email(user, verification_code)
             
-            if success:
-                return jsonify({
-                    'message': 'Verification code sent successfully. Please check your email.'
-                }), 200
-            else:
-                return jsonify({'error': 'Failed to send verification email'}), 500
+            return jsonify({
+                'message': 'Verification code sent successfully. Please check your email.',
+                'job_id': job.id
+            }), 202
                 
         except Exception as e:
-            print(f"Failed to send verification email: {e}")
+            print(f"Failed to queue verification email: {e}")
             return jsonify({'error': 'Failed to send verification email'}), 500
         
     except Exception as e:
@@ -418,8 +438,7 @@ def resend_verification():
 def setup_preferences():
     """Set user preferences after email verification"""
     try:
-        user_id = get_jwt_identity()
-        user = User.query.get(user_id)
+        user = get_current_user()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
@@ -458,26 +477,11 @@ def setup_preferences():
         return jsonify({
             'message': 'Preferences set successfully! Welcome to KGV Bulletin Service.',
             'user': user.to_dict(),
-            'preferences': preferences
+            'preferences': preferences,
+            # preferences_set is a token claim, so hand out a refreshed token
+            'access_token': create_user_access_token(user)
         }), 200
         
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': 'Failed to set preferences', 'details': str(e)}), 500
-
-# Check if token is blacklisted
-@auth_bp.before_app_request
-def check_if_token_revoked():
-    try:
-        if request.endpoint and 'auth' in request.endpoint:
-            return
-        
-        from flask_jwt_extended import verify_jwt_in_request, get_jwt
-        verify_jwt_in_request(optional=True)
-        jti = get_jwt().get('jti') if get_jwt() else None
-        
-        if jti and jti in blacklisted_tokens:
-            return jsonify({'error': 'Token has been revoked'}), 401
-            
-    except Exception:
-        pass
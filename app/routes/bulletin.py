@@ -1,8 +1,11 @@
 from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask_jwt_extended import jwt_required
 from app import db
-from app.models import User, BulletinItem, EmailLog, EmailSubscription
+from app.services.identity_service import get_current_user
+from app.models import BulletinItem, EmailLog, EmailSubscription
 from app.services.bulletin_scraper import BulletinScraperService
+from app.services.cache_service import etag_cached, BULLETINS_VERSION
+from app.services.serialization import RawJSON, json_response, parse_fields, serialize_items
 from datetime import datetime, timedelta
 import json
 
@@ -10,25 +13,23 @@ bulletin_bp = Blueprint('bulletin', __name__)
 
 @bulletin_bp.route('/bulletins/<int:bulletin_id>', methods=['GET'])
 @jwt_required()
+@etag_cached(BULLETINS_VERSION)
 def get_bulletin_detail(bulletin_id):
     """Get details for a specific bulletin"""
     try:
-        current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_user()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
         
         # Get the bulletin
-        bulletin = BulletinItem.query.get(bulletin_id)
+        bulletin = BulletinItem.query.options(BulletinItem.load_fields()).get(bulletin_id)
         if not bulletin:
             return jsonify({'error': 'Bulletin not found'}), 404
             
-        # Convert to dict for response
-        bulletin_data = bulletin.to_dict()
-        
-        return jsonify({
-            'bulletin': bulletin_data
+        # Stored representation is spliced in as-is
+        return json_response({
+            'bulletin': RawJSON(bulletin.to_json())
         }), 200
         
     except Exception as e:
@@ -36,11 +37,11 @@ def get_bulletin_detail(bulletin_id):
 
 @bulletin_bp.route('/bulletins', methods=['GET'])
 @jwt_required()
+@etag_cached(BULLETINS_VERSION, per_user=True)
 def get_bulletins_for_user():
     """Get bulletins for the current user - matches /api/bulletins"""
     try:
-        current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_user()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
@@ -48,6 +49,9 @@ def get_bulletins_for_user():
         # Get query parameters
         page = request.args.get('page', 1, type=int)
         per_page = min(request.args.get('per_page', 10, type=int), 50)
+        fields, error = parse_fields(BulletinItem.API_FIELDS)
+        if error:
+            return jsonify({'error': error}), 400
         
         # Build query for user's year group
         query = BulletinItem.query.filter(
@@ -65,7 +69,7 @@ def get_bulletins_for_user():
                     BulletinItem.is_donation == False      # Filter out donations
                 )
             )
-        ).order_by(BulletinItem.created_at.desc())
+        ).order_by(BulletinItem.created_at.desc()).options(BulletinItem.load_fields(fields))
         
         # Paginate
         pagination = query.paginate(
@@ -74,13 +78,8 @@ def get_bulletins_for_user():
             error_out=False
         )
         
-        bulletins = []
-        for item in pagination.items:
-            bulletin_data = item.to_dict()
-            bulletins.append(bulletin_data)
-        
-        return jsonify({
-            'bulletins': bulletins,
+        return json_response({
+            'bulletins': serialize_items(pagination.items, fields),
             'pagination': {
                 'page': page,
                 'per_page': per_page,
@@ -122,8 +121,7 @@ def get_bulletins_for_user():
 @jwt_required()
 def scrape_bulletin():
     try:
-        current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_user()
         
         if not user or not user.is_admin:
             return jsonify({'error': 'Admin access required'}), 403
@@ -188,8 +186,7 @@ def scrape_bulletin():
 @jwt_required()
 def preview_email():
     try:
-        current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_user()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
@@ -238,8 +235,7 @@ def preview_email():
 @jwt_required()
 def send_test_email():
     try:
-        current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_user()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
@@ -266,16 +262,13 @@ def send_test_email():
         from app.services.email_service import EmailService
         email_service = EmailService()
         
-        success = email_service.send_bulletin_email(
+        job = email_service.queue_bulletin_email(
             user=user,
             items=items,
             is_test=True
         )
         
-        if success:
-            return jsonify({'message': 'Test email sent successfully'}), 200
-        else:
-            return jsonify({'error': 'Failed to send test email'}), 500
+        return jsonify({'message': 'Test email queued', 'job_id': job.id}), 202
         
     except Exception as e:
         return jsonify({'error': 'Failed to send test email', 'details': str(e)}), 500
@@ -284,8 +277,7 @@ def send_test_email():
 @jwt_required()
 def get_bulletin_stats():
     try:
-        current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_user()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
@@ -335,8 +327,7 @@ def get_bulletin_stats():
 def email_bulletin(bulletin_id):
     """Send specific bulletin via email"""
     try:
-        user_id = int(get_jwt_identity())
-        user = User.query.get(user_id)
+        user = get_current_user()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
@@ -349,13 +340,10 @@ def email_bulletin(bulletin_id):
         from app.services.email_service import EmailService
         email_service = EmailService()
         
-        # Send email - pass user object and list of bulletins
-        success = email_service.send_bulletin_email(user, [bulletin])
+        # Queue the email - pass user object and list of bulletins
+        job = email_service.queue_bulletin_email(user, [bulletin])
         
-        if success:
-            return jsonify({'message': 'Email sent successfully'}), 200
-        else:
-            return jsonify({'error': 'Failed to send email'}), 500
+        return jsonify({'message': 'Email queued', 'job_id': job.id}), 202
             
     except Exception as e:
         return jsonify({'error': 'Failed to send email', 'details': str(e)}), 500
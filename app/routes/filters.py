@@ -1,7 +1,10 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from app import db
-from app.models import User, BulletinItem, BulletinFilter
+from app.services.identity_service import get_current_user
+from app.models import BulletinItem, BulletinFilter
+from app.services.cache_service import etag_cached, BULLETINS_VERSION
+from app.services.serialization import json_response, parse_fields, serialize_items
 from datetime import datetime
 from sqlalchemy import or_, and_
 import json
@@ -184,7 +187,7 @@ def apply_filter(filter_id):
     """Apply a filter to get filtered bulletins"""
     try:
         current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_user()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
@@ -201,9 +204,12 @@ def apply_filter(filter_id):
         # Get query parameters
         page = request.args.get('page', 1, type=int)
         per_page = min(request.args.get('per_page', 10, type=int), 50)
+        fields, error = parse_fields(BulletinItem.API_FIELDS)
+        if error:
+            return jsonify({'error': error}), 400
         
         # Build base query
-        query = BulletinItem.query
+        query = BulletinItem.query.options(BulletinItem.load_fields(fields))
         
         # Apply user's year group filter (unless overridden by filter)
         filter_year_groups = filter_obj.get_year_groups()
@@ -253,10 +259,8 @@ def apply_filter(filter_id):
             error_out=False
         )
         
-        bulletins = [item.to_dict() for item in pagination.items]
-        
-        return jsonify({
-            'bulletins': bulletins,
+        return json_response({
+            'bulletins': serialize_items(pagination.items, fields),
             'filter': filter_obj.to_dict(),
             'pagination': {
                 'page': page,
@@ -273,6 +277,7 @@ def apply_filter(filter_id):
 
 @filters_bp.route('/filter-options', methods=['GET'])
 @jwt_required()
+@etag_cached(BULLETINS_VERSION)
 def get_filter_options():
     """Get available options for creating filters"""
     try:
@@ -1,8 +1,11 @@
 from flask import Blueprint, render_template, send_from_directory, request, jsonify, redirect, url_for
 from flask_jwt_extended import jwt_required, get_jwt_identity, verify_jwt_in_request
 from app import db
-from app.models import User, BulletinItem, EmailLog, EmailSubscription
-from datetime import datetime, timedelta
+from app.services.identity_service import get_current_user, current_user_is_admin
+from app.services.stats_service import get_dashboard_stats
+from app.services.password_service import PasswordHasherBusy
+from app.models import User, BulletinItem, EmailSubscription, EmailJob
+from datetime import datetime
 from sqlalchemy import func
 import os
 import psutil
@@ -17,10 +20,8 @@ def admin_required(f):
         try:
             # Try to verify JWT token - this will work for API requests with Authorization header
             verify_jwt_in_request()
-            current_user_id = get_jwt_identity()
-            user = User.query.get(current_user_id)
             
-            if not user or not user.is_admin:
+            if not current_user_is_admin():
                 return render_template('error.html', error="403 Forbidden", 
                                      message="You don't have permission to access this page."), 403
             
@@ -138,53 +139,38 @@ def health_check():
 @jwt_required()
 def dashboard_stats():
     try:
-        current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_user()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
         
-        # Get bulletin stats for user's year group
-        total_bulletins = BulletinItem.query.filter(
-            db.or_(
-                BulletinItem.year_groups.contains(user.year_group),
-                BulletinItem.year_groups.is_(None)
-            )
-        ).count()
-        
-        # Get bulletins from last 7 days
-        week_ago = datetime.utcnow() - timedelta(days=7)
-        recent_bulletins = BulletinItem.query.filter(
-            BulletinItem.created_at >= week_ago,
-            db.or_(
-                BulletinItem.year_groups.contains(user.year_group),
-                BulletinItem.year_groups.is_(None)
-            )
-        ).count()
-        
-        # Get email stats
-        emails_sent = EmailLog.query.filter_by(user_id=user.id).count()
-        
-        # Get subscription status
-        subscription = EmailSubscription.query.filter_by(user_id=user.id, is_active=True).first()
-        is_subscribed = subscription is not None
-        
-        return jsonify({
-            'total_bulletins': total_bulletins,
-            'recent_bulletins': recent_bulletins,
-            'emails_sent': emails_sent,
-            'is_subscribed': is_subscribed
-        }), 200
+        # Maintained counters: one query instead of four
+        return jsonify(get_dashboard_stats(user)), 200
         
     except Exception as e:
         return jsonify({'error': 'Failed to get stats', 'details': str(e)}), 500
 
+@main_bp.route('/api/email-jobs/<int:job_id>', methods=['GET'])
+@jwt_required()
+def email_job_status(job_id):
+    """Progress of a queued email job, for the user who queued it or an admin"""
+    try:
+        job = db.session.get(EmailJob, job_id)
+        
+        if not job or (job.requested_by != int(get_jwt_identity()) and not current_user_is_admin()):
+            return jsonify({'error': 'Email job not found'}), 404
+        
+        from app.services.outbox_service import job_status
+        return jsonify(job_status(job)), 200
+        
+    except Exception as e:
+        return jsonify({'error': 'Failed to get email job status', 'details': str(e)}), 500
+
 @main_bp.route('/api/subscription/status', methods=['GET'])
 @jwt_required()
 def subscription_status():
     try:
-        current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_user()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
@@ -204,8 +190,7 @@ def subscription_status():
 @jwt_required()
 def toggle_subscription():
     try:
-        current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_user()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
@@ -249,8 +234,7 @@ def toggle_subscription():
 @jwt_required()
 def get_profile():
     try:
-        current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_user()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
@@ -264,8 +248,7 @@ def get_profile():
 @jwt_required()
 def update_profile():
     try:
-        current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_user()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
@@ -295,8 +278,7 @@ def update_profile():
 @jwt_required()
 def update_password():
     try:
-        current_user_id = int(get_jwt_identity())
-        user = User.query.get(current_user_id)
+        user = get_current_user()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
@@ -320,6 +302,9 @@ def update_password():
         
         return jsonify({'message': 'Password updated successfully'}), 200
         
+    except PasswordHasherBusy:
+        # Answered with a 503 by the app's error handler
+        raise
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': 'Failed to update password', 'details': str(e)}), 500
@@ -0,0 +1,151 @@
+"""
+Admin statistics rollup.
+
+All admin counters come from one aggregate query per table, using
+conditional SUM(CASE ...) so each table is scanned once. SUM(CASE) is used
+rather than COUNT(*) FILTER because SQLite and PostgreSQL both support it.
+Email counters come from the email_log_daily rollups plus the days not yet
+rolled up (see email_retention), so they do not scan the whole log table.
+The result is kept as a process-local snapshot. Commits that touch users,
+bulletin items, email logs, subscriptions or the outbox mark the snapshot stale, and it
+also expires after ADMIN_STATS_TTL seconds. The admin stats routes and
+/metrics all read the snapshot, so polling them does not add load on the
+database.
+"""
+from flask import current_app
+from sqlalchemy import event, select, func, case
+from sqlalchemy.orm import Session
+from app import db
+from app.models import User, BulletinItem, EmailLog, EmailSubscription, OutboxMessage
+from app.services.email_retention import email_totals
+from datetime import datetime, timedelta
+import threading
+import time
+
+TRACKED_MODELS = (User, BulletinItem, EmailLog, EmailSubscription, OutboxMessage)
+
+_snapshot = None
+_snapshot_at = None
+_snapshot_dirty = False
+_snapshot_lock = threading.Lock()
+
+
+def _flag(condition):
+    return func.coalesce(func.sum(case((condition, 1), else_=0)), 0)
+
+
+def compute_admin_stats():
+    """Run the rollup queries and return the snapshot dict"""
+    now = datetime.utcnow()
+    week_ago = now - timedelta(days=7)
+    month_ago = now - timedelta(days=30)
+
+    # Users, grouped by email frequency so the distribution comes from the same scan
+    users = {'total': 0, 'active': 0, 'admin': 0, 'new_this_month': 0, 'new_this_week': 0}
+    frequency_distribution = {}
+    rows = db.session.execute(
+        select(
+            User.email_frequency,
+            func.count(User.id),
+            _flag(User.is_active == True),
+            _flag(User.is_admin == True),
+            _flag(User.created_at >= month_ago),
+            _flag(User.created_at >= week_ago)
+        ).group_by(User.email_frequency)
+    ).all()
+    for frequency, total, active, admin, new_month, new_week in rows:
+        frequency_distribution[frequency] = total
+        users['total'] += total
+        users['active'] += active
+        users['admin'] += admin
+        users['new_this_month'] += new_month
+        users['new_this_week'] += new_week
+
+    total, feedback, donation, recent = db.session.execute(
+        select(
+            func.count(BulletinItem.id),
+            _flag(BulletinItem.is_feedback == True),
+            _flag(BulletinItem.is_donation == True),
+            _flag(BulletinItem.created_at >= week_ago)
+        )
+    ).one()
+    bulletin_items = {'total': total, 'feedback': feedback, 'donation': donation, 'recent': recent}
+
+    emails = email_totals(now)
+
+    active_subscriptions = db.session.execute(
+        select(func.count(EmailSubscription.id)).where(EmailSubscription.is_active == True)
+    ).scalar()
+
+    # Covered by the (status, next_attempt_at) index
+    outbox = {'pending': 0, 'sending': 0, 'sent': 0, 'dead': 0}
+    outbox.update(db.session.execute(
+        select(OutboxMessage.status, func.count(OutboxMessage.id)).group_by(OutboxMessage.status)
+    ).all())
+
+    return {
+        'users': users,
+        'bulletin_items': bulletin_items,
+        'emails': emails,
+        'subscriptions': {'active': active_subscriptions},
+        'outbox': outbox,
+        'email_frequency_distribution': frequency_distribution,
+        'last_updated': now.isoformat()
+    }
+
+
+def get_admin_stats():
+    """The current snapshot, recomputed when stale or older than ADMIN_STATS_TTL"""
+    global _snapshot, _snapshot_at, _snapshot_dirty
+    ttl = current_app.config.get('ADMIN_STATS_TTL', 30)
+    # Bursts of writes (e.g. a bulk send) recompute at most this often
+    min_age = current_app.config.get('ADMIN_STATS_MIN_AGE', 2)
+
+    def fresh():
+        if _snapshot is None:
+            return False
+        age = time.monotonic() - _snapshot_at
+        return age < (min_age if _snapshot_dirty else ttl)
+
+    if fresh():
+        return _snapshot
+    with _snapshot_lock:
+        # Another thread may have refreshed it while we waited
+        if fresh():
+            return _snapshot
+        _snapshot_dirty = False
+        _snapshot = compute_admin_stats()
+        _snapshot_at = time.monotonic()
+        return _snapshot
+
+
+def invalidate_admin_stats():
+    global _snapshot_dirty
+    _snapshot_dirty = True
+
+
+@event.listens_for(Session, 'after_flush')
+def _note_tracked_writes(session, flush_context):
+    for obj in session.new | session.dirty | session.deleted:
+        if isinstance(obj, TRACKED_MODELS):
+            session.info['admin_stats_changed'] = True
+            return
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _note_bulk_writes(orm_execute_state):
+    if orm_execute_state.is_delete or orm_execute_state.is_update or orm_execute_state.is_insert:
+        mapper = orm_execute_state.bind_mapper
+        if mapper is not None and mapper.class_ in TRACKED_MODELS:
+            orm_execute_state.session.info['admin_stats_changed'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_on_commit(session):
+    if session.info.pop('admin_stats_changed', False):
+        invalidate_admin_stats()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_tracked_writes(session):
+    session.info.pop('admin_stats_changed', None)
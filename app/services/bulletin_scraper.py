@@ -7,8 +7,12 @@ import time
 import os
 import json
 import hashlib
+from app.services.metrics_service import AI_REQUEST_LATENCY, observe_latency, scraper_stage
 
 class BulletinScraperService:
+    # ScrapeState row for the bulletin page
+    SCRAPE_STATE = 'bulletin'
+    
     def __init__(self):
         self.bulletin_url = os.getenv('BULLETIN_URL', 'https://lionel2.kgv.edu.hk/local/mis/bulletin/bulletin.php')
         self.ai_api_url = os.getenv('AI_API_URL', 'https://ai.hackclub.com/chat/completions')
@@ -152,7 +156,8 @@ class BulletinScraperService:
                     "messages": [{"role": "user", "content": prompt}]
                 }
                 
-                response = requests.post(self.ai_api_url, headers=headers, json=data, timeout=15)
+                with observe_latency(AI_REQUEST_LATENCY, with_outcome=True):
+                    response = requests.post(self.ai_api_url, headers=headers, json=data, timeout=15)
                 
                 if response.status_code == 200:
                     result = response.json()
@@ -350,12 +355,24 @@ class BulletinScraperService:
         # Return True if specific year groups are mentioned, False if it's general
         return len(mentioned_years) > 0
     
-    def scrape_bulletin(self, max_items=20, generate_headlines=True, save_all_items=True):
-        """Scrape bulletin items from KGV website"""
-        try:
-            response = requests.get(self.bulletin_url, timeout=10)
+    def fetch_bulletin_page(self, etag=None, last_modified=None):
+        """GET the bulletin page, conditionally when validators are given; None on 304 Not Modified"""
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        with scraper_stage('fetch'):
+            response = requests.get(self.bulletin_url, headers=headers, timeout=10)
+            if response.status_code == 304:
+                return None
             response.raise_for_status()
-            soup = BeautifulSoup(response.content, "html.parser")
+        return response
+    
+    def parse_bulletin_items(self, page):
+        """The bulletin item elements on a page"""
+        with scraper_stage('parse'):
+            soup = BeautifulSoup(page, "html.parser")
             
             # Find the main bulletin content area
             main_content = soup.find("div", class_="studentbuletin")
@@ -364,20 +381,41 @@ class BulletinScraperService:
                 raise Exception("Could not find bulletin content on page")
             
             # Extract bulletin items
-            all_bulletin_items = main_content.find_all("div", class_="row-fluid")
+            return main_content.find_all("div", class_="row-fluid")
+    
+    def item_content(self, item):
+        """Normalized text of a bulletin item, '' if it has none"""
+        item_text = item.find("div", class_="itemtext")
+        if not item_text:
+            return ''
+        return re.sub(r'\n\s*\n', '\n\n', item_text.get_text()).strip()
+    
+    def page_fingerprint(self, items):
+        """SHA-256 of the bulletin item texts; the rest of the page (menus, tokens, clocks) is ignored"""
+        digest = hashlib.sha256()
+        for item in items:
+            digest.update(self.item_content(item).encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()
+    
+    def scrape_bulletin(self, max_items=20, generate_headlines=True, save_all_items=True, items=None,
+                        known_contents=None):
+        """Scrape bulletin items from KGV website
+        
+        items are already parsed bulletin items (fetched otherwise). Items whose content is in
+        known_contents are left out, so no headline is generated for what is already saved.
+        """
+        try:
+            if items is None:
+                items = self.parse_bulletin_items(self.fetch_bulletin_page().content)
             
             scraped_items = []
             
-            for item in all_bulletin_items[:max_items]:
+            for item in items[:max_items]:
                 # Extract text content
-                item_text = item.find("div", class_="itemtext")
-                if not item_text:
-                    continue
-                
-                content = item_text.get_text()
-                content = re.sub(r'\n\s*\n', '\n\n', content).strip()
+                content = self.item_content(item)
                 
-                if not content:
+                if not content or (known_contents and content in known_contents):
                     continue
                 
                 # Classify the item (but save ALL items regardless of classification)
@@ -394,7 +432,8 @@ class BulletinScraperService:
                 ai_headline = None
                 if generate_headlines:
                     try:
-                        ai_headline = self.generate_headline(content)
+                        with scraper_stage('headline'):
+                            ai_headline = self.generate_headline(content)
                     except Exception as e:
                         print(f"Failed to generate headline: {e}")
                         ai_headline = self.create_fallback_headline(content)
@@ -460,16 +499,31 @@ class BulletinScraperService:
         
         return norm1 == norm2
     
-    def scrape_and_save_bulletins(self, max_items=20, save_all_items=True):
-        """Scrape bulletins and save new ones to the database"""
+    def scrape_and_save_bulletins(self, max_items=20, save_all_items=True, response=None, items=None):
+        """Scrape bulletins and save new ones to the database
+        
+        response is the bulletin page and items its parsed bulletin items, if already fetched.
+        """
         try:
             from app import db
             from app.models import BulletinItem
             
+            if response is None:
+                response = self.fetch_bulletin_page()
+            if items is None:
+                items = self.parse_bulletin_items(response.content)
+            
+            # Items saved exactly as they are need no headline; the page lists fewer than this
+            known_contents = set(db.session.execute(
+                db.select(BulletinItem.content).order_by(BulletinItem.created_at.desc()).limit(200)
+            ).scalars())
+            
             # Scrape bulletin items (save all items by default)
-            scraped_items = self.scrape_bulletin(max_items=max_items, save_all_items=save_all_items)
+            with scraper_stage('scrape'):
+                scraped_items = self.scrape_bulletin(max_items=max_items, save_all_items=save_all_items,
+                                                     items=items, known_contents=known_contents)
             new_count = 0
-            skipped_duplicates = 0
+            skipped_duplicates = min(len(items), max_items) - len(scraped_items)
             
             for item_data in scraped_items:
                 # Check if item already exists by comparing content similarity
@@ -513,7 +567,10 @@ class BulletinScraperService:
                 else:
                     skipped_duplicates += 1
             
-            db.session.commit()
+            # Later polls compare against the page as saved here
+            self._record_scrape(response, self.page_fingerprint(items), full=True)
+            with scraper_stage('save'):
+                db.session.commit()
             print(f"Scraping completed: {new_count} new bulletins added, {skipped_duplicates} duplicates skipped")
             return new_count
             
@@ -522,6 +579,48 @@ class BulletinScraperService:
                 db.session.rollback()
             raise Exception(f"Failed to scrape and save bulletins: {str(e)}")
     
+    def scrape_if_changed(self, max_items=20):
+        """Run the full scrape only if the bulletin changed since the last one; None when unchanged
+        
+        The page is fetched with the last ETag/Last-Modified, so an unchanged page costs a 304.
+        Servers without validators send the page, and its bulletin items are compared by fingerprint.
+        """
+        from app import db
+        from app.models import ScrapeState
+        
+        state = db.session.get(ScrapeState, self.SCRAPE_STATE)
+        response = self.fetch_bulletin_page(etag=state.etag if state else None,
+                                            last_modified=state.last_modified if state else None)
+        fingerprint = state.fingerprint if state else None
+        if response is not None:
+            items = self.parse_bulletin_items(response.content)
+            if self.page_fingerprint(items) != fingerprint:
+                return self.scrape_and_save_bulletins(max_items=max_items, response=response, items=items)
+        
+        self._record_scrape(response, fingerprint, full=False)
+        db.session.commit()
+        return None
+    
+    def _record_scrape(self, response, fingerprint, full):
+        from app import db
+        from app.models import ScrapeState
+        
+        now = datetime.utcnow()
+        state = db.session.get(ScrapeState, self.SCRAPE_STATE)
+        if state is None:
+            state = ScrapeState(name=self.SCRAPE_STATE, checks=0, full_scrapes=0)
+            db.session.add(state)
+        if response is not None:
+            # A 304 keeps the validators it was asked with
+            state.etag = response.headers.get('ETag')
+            state.last_modified = response.headers.get('Last-Modified')
+        state.fingerprint = fingerprint
+        state.checked_at = now
+        state.checks += 1
+        if full:
+            state.changed_at = now
+            state.full_scrapes += 1
+    
     def find_and_remove_duplicates(self, dry_run=True):
         """Find and optionally remove duplicate bulletins from the database"""
         try:
@@ -0,0 +1,200 @@
+"""
+Data versioning and HTTP conditional request support.
+
+Writes that change what the bulletin API returns bump a named counter in the
+data_versions table (in the same transaction as the write). Routes decorated
+with etag_cached derive a strong ETag from those counters plus the request
+path and query string, so If-None-Match is answered before any ORM work.
+"""
+from flask import current_app, request, make_response
+from flask_jwt_extended import get_jwt_identity
+from sqlalchemy import event, select, update, insert, inspect
+from sqlalchemy.orm import Session
+from app import db
+from app.models import DataVersion, BulletinItem, User
+from app.services.compression import strip_encoding_suffix
+from datetime import datetime
+from functools import wraps
+import hashlib
+import threading
+import time
+
+BULLETINS_VERSION = 'bulletins'
+
+# Process-local copy of the counters: name -> (version, fetched_at)
+_local_versions = {}
+_local_lock = threading.Lock()
+
+
+def user_version_name(user_id):
+    """Version counter for data that only affects a single user's responses"""
+    return f'user:{user_id}'
+
+
+def get_data_versions(names):
+    """Return {name: version} for the given counters.
+
+    Counters are cached per process for DATA_VERSION_TTL seconds. Commits made
+    in this process invalidate the cache immediately; commits made by other
+    workers are picked up once the TTL expires.
+    """
+    ttl = current_app.config.get('DATA_VERSION_TTL', 5)
+    now = time.monotonic()
+    versions = {}
+    missing = []
+
+    with _local_lock:
+        for name in names:
+            cached = _local_versions.get(name)
+            if cached and now - cached[1] < ttl:
+                versions[name] = cached[0]
+            else:
+                missing.append(name)
+
+    if missing:
+        rows = db.session.execute(
+            select(DataVersion.name, DataVersion.version).where(DataVersion.name.in_(missing))
+        ).all()
+        found = dict(rows)
+        with _local_lock:
+            for name in missing:
+                versions[name] = found.get(name, 0)
+                _local_versions[name] = (versions[name], now)
+
+    return versions
+
+
+def bump_data_version(name, session=None):
+    """Increment a version counter inside the session's current transaction"""
+    session = session or db.session
+    _increment(session.connection(), name)
+    session.info.setdefault('committed_version_bumps', set()).add(name)
+
+
+def _increment(connection, name):
+    table = DataVersion.__table__
+    now = datetime.utcnow()
+    result = connection.execute(
+        update(table)
+        .where(table.c.name == name)
+        .values(version=table.c.version + 1, updated_at=now)
+    )
+    if result.rowcount == 0:
+        connection.execute(insert(table).values(name=name, version=1, updated_at=now))
+
+
+def _version_names_for(obj, deleted=False):
+    """Work out which counters a pending change to obj should bump"""
+    if isinstance(obj, BulletinItem):
+        return [BULLETINS_VERSION]
+    if isinstance(obj, User) and not deleted and obj.id is not None:
+        # Bulletin listings are filtered by year group
+        if inspect(obj).attrs.year_group.history.has_changes():
+            return [user_version_name(obj.id)]
+    return []
+
+
+@event.listens_for(Session, 'before_flush')
+def _collect_version_bumps(session, flush_context, instances):
+    names = set()
+    for obj in session.new:
+        names.update(_version_names_for(obj))
+    for obj in session.dirty:
+        if session.is_modified(obj):
+            names.update(_version_names_for(obj))
+    for obj in session.deleted:
+        names.update(_version_names_for(obj, deleted=True))
+    if names:
+        session.info.setdefault('pending_version_bumps', set()).update(names)
+
+
+@event.listens_for(Session, 'after_flush')
+def _apply_version_bumps(session, flush_context):
+    names = session.info.pop('pending_version_bumps', None)
+    if not names:
+        return
+    connection = session.connection()
+    for name in names:
+        _increment(connection, name)
+    session.info.setdefault('committed_version_bumps', set()).update(names)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _bump_on_bulk_write(orm_execute_state):
+    """Catch Query.delete()/update() on bulletin items, which skip the flush"""
+    if not (orm_execute_state.is_delete or orm_execute_state.is_update):
+        return
+    mapper = orm_execute_state.bind_mapper
+    if mapper is not None and mapper.class_ is BulletinItem:
+        bump_data_version(BULLETINS_VERSION, orm_execute_state.session)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_local_versions(session):
+    names = session.info.pop('committed_version_bumps', None)
+    if names:
+        with _local_lock:
+            for name in names:
+                _local_versions.pop(name, None)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_version_bumps(session):
+    session.info.pop('pending_version_bumps', None)
+    session.info.pop('committed_version_bumps', None)
+
+
+def compute_etag(versions, identity=None):
+    """Build a strong ETag from data versions, the request URL and the caller"""
+    parts = [request.path]
+    parts.extend(f'{key}={value}' for key, value in sorted(request.args.items(multi=True)))
+    parts.extend(f'{name}@{version}' for name, version in sorted(versions.items()))
+    if identity is not None:
+        parts.append(f'identity={identity}')
+    return hashlib.sha256('\n'.join(parts).encode('utf-8')).hexdigest()[:32]
+
+
+def client_has_etag(etag):
+    """Weak If-None-Match comparison that also accepts compressed variants"""
+    if_none_match = request.if_none_match
+    if if_none_match.star_tag:
+        return True
+    return any(strip_encoding_suffix(tag) == etag
+               for tag in if_none_match.as_set(include_weak=True))
+
+
+def etag_cached(*version_names, per_user=False):
+    """Answer If-None-Match from data versions before running the view.
+
+    Must be applied inside @jwt_required() when per_user is set, so the
+    identity is available. per_user adds the caller's own version counter and
+    identity to the ETag for responses that depend on the user's profile.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            names = list(version_names)
+            identity = None
+            if per_user:
+                identity = get_jwt_identity()
+                names.append(user_version_name(identity))
+
+            etag = compute_etag(get_data_versions(names), identity)
+
+            if client_has_etag(etag):
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = current_app.config.get(
+                'API_CACHE_CONTROL', 'private, no-cache'
+            )
+            if per_user:
+                response.vary.add('Authorization')
+            return response
+
+        return decorated_function
+    return decorator
@@ -0,0 +1,121 @@
+"""
+Response compression for JSON, HTML and other text responses.
+
+Picks brotli or gzip from Accept-Encoding, skips small, streamed and
+already-encoded responses, and keeps a small LRU cache of compressed bodies
+keyed by ETag so unchanged API responses are only compressed once.
+"""
+from flask import request
+from collections import OrderedDict
+import gzip
+import threading
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = {
+    'application/json',
+    'application/javascript',
+    'text/html',
+    'text/css',
+    'text/plain',
+    'text/javascript',
+    'image/svg+xml'
+}
+
+# Compressed representations get their own ETag (RFC 9110 8.8.3); the
+# suffix is stripped again when If-None-Match is checked.
+ETAG_SUFFIXES = {'br': '-br', 'gzip': '-gzip'}
+
+
+def strip_encoding_suffix(etag):
+    """Return the ETag of the uncompressed representation"""
+    for suffix in ETAG_SUFFIXES.values():
+        if etag.endswith(suffix):
+            return etag[:-len(suffix)]
+    return etag
+
+
+class CompressedBodyCache:
+    """Thread-safe LRU of compressed bodies keyed by (etag, encoding)"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            body = self._entries.get(key)
+            if body is not None:
+                self._entries.move_to_end(key)
+            return body
+
+    def set(self, key, body):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = body
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+def choose_encoding(app):
+    """Best encoding we support that the client accepts, or None"""
+    available = ['br', 'gzip'] if brotli and app.config.get('COMPRESS_BROTLI', True) else ['gzip']
+    return request.accept_encodings.best_match(available)
+
+
+def compress_body(data, encoding, app):
+    if encoding == 'br':
+        return brotli.compress(data, quality=app.config.get('COMPRESS_BROTLI_QUALITY', 4))
+    return gzip.compress(data, compresslevel=app.config.get('COMPRESS_LEVEL', 6), mtime=0)
+
+
+def init_compression(app):
+    """Register the compression after_request handler.
+
+    Call this before any other after_request handler is registered: Flask
+    runs them in reverse order, so this one sees the final response body.
+    """
+    app.config.setdefault('COMPRESS_ENABLED', True)
+    app.config.setdefault('COMPRESS_MIN_SIZE', 500)
+    cache = CompressedBodyCache(app.config.get('COMPRESS_CACHE_SIZE', 256))
+    app.extensions['compression_cache'] = cache
+
+    @app.after_request
+    def compress_response(response):
+        if not app.config['COMPRESS_ENABLED']:
+            return response
+
+        if (response.status_code < 200 or response.status_code in (204, 206, 304)
+                or response.direct_passthrough or response.is_streamed
+                or 'Content-Encoding' in response.headers
+                or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+            return response
+
+        response.vary.add('Accept-Encoding')
+
+        if (response.content_length or 0) < app.config['COMPRESS_MIN_SIZE']:
+            return response
+
+        encoding = choose_encoding(app)
+        if not encoding:
+            return response
+
+        etag, is_weak = response.get_etag()
+        cache_key = (etag, encoding) if etag else None
+        body = cache.get(cache_key) if cache_key else None
+        if body is None:
+            body = compress_body(response.get_data(), encoding, app)
+            if cache_key:
+                cache.set(cache_key, body)
+
+        response.set_data(body)
+        response.headers['Content-Encoding'] = encoding
+        if etag:
+            response.set_etag(etag + ETAG_SUFFIXES[encoding], weak=is_weak)
+        return response
@@ -0,0 +1,154 @@
+"""
+Scheduled bulletin digests.
+
+dispatch_due_digests() is run by the scheduler every few minutes. It
+selects every due subscriber in one query. A subscriber is due when their
+time_preference has passed today (in DIGEST_TIMEZONE) and they have not had
+a digest this day (daily) or in the last seven days (weekly). Subscribers
+are grouped by content signature: frequency, year group, category
+preferences and the feedback/donation opt-ins. Everyone in a cohort gets the
+same items, so each cohort's email is rendered once and queued in the
+outbox as one 'digest' job with a message per recipient. The outbox workers
+send them, with its retries, backoff and dead-lettering, and write the email
+logs.
+
+A cohort's last_digest_at is set in the transaction that queues its job, so
+each due subscriber is queued exactly once; a recipient whose message fails
+for good gets the next period's digest rather than a retry every run.
+"""
+from flask import current_app
+from sqlalchemy import select, update, or_
+from app import db
+from app.models import User, EmailSubscription, BulletinItem
+from app.services.email_service import EmailService
+from app.services.outbox_service import enqueue
+from app.services.stats_service import bulletin_visible_to
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+CATEGORY_PREFERENCES = ('sports', 'academic', 'events', 'general')
+
+# Items created within this window of the run go into the digest
+DIGEST_WINDOWS = {'daily': timedelta(days=1), 'weekly': timedelta(days=7)}
+
+
+def content_signature(user):
+    """Key shared by every user who should receive exactly the same digest"""
+    preferences = user.get_email_preferences()
+    categories = tuple(name for name in CATEGORY_PREFERENCES if preferences.get(name, True))
+    return (
+        user.email_frequency,
+        user.year_group or '',
+        categories,
+        bool(preferences.get('feedback_forms', False)),
+        bool(preferences.get('donations', False))
+    )
+
+
+def item_matches(item, signature):
+    """Whether a bulletin item belongs in the digest for this signature"""
+    _, year_group, categories, feedback, donations = signature
+    if not bulletin_visible_to(item.year_groups, year_group):
+        return False
+    if item.is_feedback:
+        return feedback
+    if item.is_donation:
+        return donations
+    # Categories without their own preference (clubs, food, ...) follow 'general'
+    category = item.category if item.category in CATEGORY_PREFERENCES else 'general'
+    return category in categories
+
+
+def _local_now():
+    tz = ZoneInfo(current_app.config.get('DIGEST_TIMEZONE', 'Asia/Hong_Kong'))
+    return datetime.now(tz)
+
+
+def due_subscribers(now_local=None):
+    """[(user, subscription)] for every subscriber due a digest, from one query"""
+    now_local = now_local or _local_now()
+    # Timestamps are stored in naive UTC
+    today_start = now_local.replace(hour=0, minute=0, second=0, microsecond=0) \
+        .astimezone(timezone.utc).replace(tzinfo=None)
+    week_start = today_start - timedelta(days=6)
+
+    return db.session.execute(
+        select(User, EmailSubscription)
+        .join(EmailSubscription, EmailSubscription.user_id == User.id)
+        .where(
+            EmailSubscription.is_active == True,
+            User.is_active == True,
+            User.is_email_verified == True,
+            # 'HH:MM' strings compare in time order
+            or_(EmailSubscription.time_preference.is_(None),
+                EmailSubscription.time_preference <= now_local.strftime('%H:%M')),
+            or_(
+                (User.email_frequency == 'daily') & or_(
+                    EmailSubscription.last_digest_at.is_(None),
+                    EmailSubscription.last_digest_at < today_start),
+                (User.email_frequency == 'weekly') & or_(
+                    EmailSubscription.last_digest_at.is_(None),
+                    EmailSubscription.last_digest_at < week_start)
+            )
+        )
+        .order_by(User.id)
+    ).all()
+
+
+def plan_digests(now):
+    """[(recipients, subject, html)] per cohort; html is None when the cohort has no new items.
+
+    recipients are plain (user_id, email, subscription_id) tuples, so nothing
+    here is reloaded after the per-cohort commits expire the session.
+    """
+    max_items = current_app.config.get('DIGEST_MAX_ITEMS', 50)
+    email_service = EmailService()
+
+    cohorts = defaultdict(list)
+    for user, subscription in due_subscribers():
+        cohorts[content_signature(user)].append((user, subscription))
+
+    # One item query per frequency; cohorts filter it in memory
+    candidates = {}
+    for frequency in {signature[0] for signature in cohorts}:
+        candidates[frequency] = BulletinItem.query.filter(
+            BulletinItem.created_at >= now - DIGEST_WINDOWS[frequency]
+        ).order_by(BulletinItem.created_at.desc()).all()
+
+    plan = []
+    for signature, members in cohorts.items():
+        recipients = [(user.id, user.email, subscription.id) for user, subscription in members]
+        items = [item for item in candidates[signature[0]] if item_matches(item, signature)][:max_items]
+        if items:
+            subject, html_content = email_service.generate_bulletin_email(members[0][0], items)
+        else:
+            subject = html_content = None
+        plan.append((recipients, subject, html_content))
+    return plan
+
+
+def dispatch_due_digests():
+    """Queue every due digest in the outbox. Returns a summary dict of counts."""
+    now = datetime.utcnow()
+    plan = plan_digests(now)
+
+    summary = {'cohorts': len(plan), 'due': 0, 'queued': 0, 'jobs': 0, 'empty': 0}
+    for recipients, subject, html_content in plan:
+        summary['due'] += len(recipients)
+        # Core UPDATE on the connection: last_digest_at feeds no counter, so the ORM hooks have nothing to do.
+        # It commits with the cohort's job, or on its own when there is nothing new to send
+        db.session.connection().execute(
+            update(EmailSubscription.__table__)
+            .where(EmailSubscription.__table__.c.id.in_([subscription_id for _, _, subscription_id in recipients]))
+            .values(last_digest_at=now)
+        )
+        if html_content is None:
+            summary['empty'] += len(recipients)
+            db.session.commit()
+            continue
+        enqueue('digest', [(user_id, email) for user_id, email, _ in recipients], subject, html_content)
+        summary['queued'] += len(recipients)
+        summary['jobs'] += 1
+
+    return summary
@@ -0,0 +1,94 @@
+"""
+Content-addressed storage for email bodies.
+
+EmailLog rows no longer hold their HTML. Each distinct body is stored once in
+email_bodies, keyed by the SHA-256 of the HTML and compressed with zstd when
+the zstandard package is installed, otherwise zlib. A bulk or digest send to
+thousands of users therefore writes one body plus small log rows. The
+EmailLog.content property hashes on assignment, and the body is written by a
+before_flush hook in models.py. On read the body is only loaded and
+decompressed when .content is accessed, for example when an admin opens one
+log.
+
+compact_legacy_bodies() moves bodies stored inline by older versions into
+email_bodies, one committed batch at a time.
+"""
+from flask import current_app, has_app_context
+import hashlib
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # zstandard is optional; zlib is always available
+    zstandard = None
+
+# One-entry memo: a bulk send assigns the same string object to every log
+_last_hashed = (None, None)
+
+
+def body_hash(html):
+    global _last_hashed
+    last_html, last_hash = _last_hashed
+    if html is last_html:
+        return last_hash
+    digest = hashlib.sha256(html.encode('utf-8')).hexdigest()
+    _last_hashed = (html, digest)
+    return digest
+
+
+def _method():
+    method = current_app.config.get('EMAIL_BODY_COMPRESSION', 'auto') if has_app_context() else 'auto'
+    if method == 'auto':
+        return 'zstd' if zstandard is not None else 'zlib'
+    if method == 'zstd' and zstandard is None:
+        return 'zlib'
+    return method
+
+
+def compress(html):
+    """(encoding, bytes) for an HTML body"""
+    raw = html.encode('utf-8')
+    method = _method()
+    if method == 'zstd':
+        return 'zstd', zstandard.ZstdCompressor(level=10).compress(raw)
+    if method == 'zlib':
+        return 'zlib', zlib.compress(raw, 9)
+    return 'none', raw
+
+
+def decompress(encoding, data):
+    if encoding == 'zstd':
+        if zstandard is None:
+            raise RuntimeError('Email body is zstd-compressed but zstandard is not installed')
+        return zstandard.ZstdDecompressor().decompress(data).decode('utf-8')
+    if encoding == 'zlib':
+        return zlib.decompress(data).decode('utf-8')
+    return data.decode('utf-8')
+
+
+def compact_legacy_bodies(batch_size=500, max_batches=None):
+    """Move inline EmailLog.content into email_bodies, committing each batch.
+
+    Returns the number of logs moved.
+    """
+    from app import db
+    from app.models import EmailLog
+
+    moved = 0
+    batches = 0
+    last_id = 0
+    while max_batches is None or batches < max_batches:
+        logs = EmailLog.query.options(db.undefer(EmailLog.inline_content)).filter(
+            EmailLog.id > last_id,
+            EmailLog.body_hash.is_(None),
+            EmailLog.inline_content.isnot(None)
+        ).order_by(EmailLog.id).limit(batch_size).all()
+        if not logs:
+            break
+        for log in logs:
+            log.content = log.inline_content
+        last_id = logs[-1].id
+        moved += len(logs)
+        batches += 1
+        db.session.commit()
+    return moved
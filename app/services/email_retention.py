@@ -0,0 +1,347 @@
+"""
+Email log retention and daily rollups.
+
+email_logs grows with every send, so reports do not read it directly.
+rollup_email_logs() aggregates each finished UTC day into email_log_daily,
+counted by status and by the recipient's year group. Admin stats and the
+daily chart read those rows, plus a live query over the days not yet rolled
+up (normally just today), which the created_at index keeps small.
+
+purge_email_logs() then removes detail rows older than
+EMAIL_LOG_RETENTION_DAYS, but never from a day that has not been rolled up.
+With EMAIL_LOG_RETENTION_MODE 'archive' the rows are first copied to
+email_logs_archive; with 'purge' they are only deleted. Either way the
+per-user totals go to archived_email_counts, so user_stats.emails_received
+does not drop. The work is done in batches of EMAIL_RETENTION_BATCH_SIZE,
+each committed on its own with a short pause in between, so concurrent
+writers never wait long for locks.
+
+The same run deletes email bodies that no log references any more, and
+outbox messages and jobs older than OUTBOX_RETENTION_DAYS.
+"""
+from flask import current_app, has_app_context
+from sqlalchemy import event, select, insert, update, delete, func, case, literal, bindparam, or_
+from sqlalchemy.orm import Session
+from app import db
+from app.models import (User, EmailLog, EmailLogDaily, ArchivedEmailLog, ArchivedEmailCount,
+                        EmailBody, EmailJob, OutboxMessage)
+from collections import defaultdict
+from datetime import datetime, date, timedelta
+import time
+
+DEFAULTS = {
+    'EMAIL_LOG_RETENTION_DAYS': 180,
+    'EMAIL_LOG_RETENTION_MODE': 'archive',
+    'EMAIL_RETENTION_BATCH_SIZE': 500,
+    'EMAIL_RETENTION_PAUSE': 0.05,
+    'OUTBOX_RETENTION_DAYS': 30
+}
+
+STATUSES = ('sent', 'failed', 'pending')
+
+logs_table = EmailLog.__table__
+daily_table = EmailLogDaily.__table__
+archive_table = ArchivedEmailLog.__table__
+archived_counts_table = ArchivedEmailCount.__table__
+bodies_table = EmailBody.__table__
+
+
+def _config(key):
+    if has_app_context():
+        return current_app.config.get(key, DEFAULTS[key])
+    return DEFAULTS[key]
+
+
+def _flag(condition):
+    return func.coalesce(func.sum(case((condition, 1), else_=0)), 0)
+
+
+def _day_start(day):
+    return datetime(day.year, day.month, day.day)
+
+
+def _as_date(value):
+    # func.date() returns a string on SQLite and a date on PostgreSQL
+    return value if isinstance(value, date) else date.fromisoformat(str(value)[:10])
+
+
+def rolled_through():
+    """The last day in email_log_daily, or None before the first rollup"""
+    return db.session.execute(select(func.max(EmailLogDaily.day))).scalar()
+
+
+def _live_start():
+    """Logs created from here on are not in the rollups yet"""
+    last = rolled_through()
+    return _day_start(last + timedelta(days=1)) if last else None
+
+
+def rollup_email_logs(through=None):
+    """Roll every finished day after the last rolled-up one into email_log_daily.
+
+    Returns the number of days rolled up.
+    """
+    through = through or datetime.utcnow().date() - timedelta(days=1)
+    last = rolled_through()
+    if last:
+        day = last + timedelta(days=1)
+    else:
+        first = db.session.execute(select(func.min(EmailLog.created_at))).scalar()
+        if first is None:
+            return 0
+        day = first.date()
+
+    days = 0
+    while day <= through:
+        start = _day_start(day)
+        rows = db.session.execute(
+            select(
+                func.coalesce(EmailLog.status, 'pending'),
+                func.coalesce(User.year_group, ''),
+                func.count(EmailLog.id)
+            )
+            .outerjoin(User, User.id == EmailLog.user_id)
+            .where(EmailLog.created_at >= start, EmailLog.created_at < start + timedelta(days=1))
+            .group_by(EmailLog.status, User.year_group)
+        ).all()
+        counts = defaultdict(int)
+        for status, year_group, count in rows:
+            counts[(status, year_group)] += count
+        # A day without email gets one zero row, so the next run starts after it
+        counts = counts or {('sent', ''): 0}
+        connection = db.session.connection()
+        connection.execute(delete(daily_table).where(daily_table.c.day == day))
+        connection.execute(insert(daily_table), [
+            {'day': day, 'status': status, 'year_group': year_group, 'count': count}
+            for (status, year_group), count in counts.items()
+        ])
+        db.session.commit()
+        days += 1
+        day += timedelta(days=1)
+    return days
+
+
+def daily_email_counts(days=30):
+    """[{date, sent, failed, pending, total, by_year_group}] for the last `days` days, oldest first"""
+    today = datetime.utcnow().date()
+    first = today - timedelta(days=days - 1)
+    series = {first + timedelta(days=i): {'by_status': defaultdict(int), 'by_year_group': defaultdict(int)}
+              for i in range(days)}
+
+    def add(day, status, year_group, count):
+        if count and day in series:
+            series[day]['by_status'][status or 'pending'] += count
+            series[day]['by_year_group'][year_group or ''] += count
+
+    for row in db.session.execute(
+        select(EmailLogDaily.day, EmailLogDaily.status, EmailLogDaily.year_group, EmailLogDaily.count)
+        .where(EmailLogDaily.day >= first)
+    ).all():
+        add(*row)
+
+    live_start = max(_live_start() or _day_start(first), _day_start(first))
+    day_column = func.date(EmailLog.created_at)
+    for day, status, year_group, count in db.session.execute(
+        select(day_column, EmailLog.status, User.year_group, func.count(EmailLog.id))
+        .outerjoin(User, User.id == EmailLog.user_id)
+        .where(EmailLog.created_at >= live_start)
+        .group_by(day_column, EmailLog.status, User.year_group)
+    ).all():
+        add(_as_date(day), status, year_group, count)
+
+    result = []
+    for day, counts in sorted(series.items()):
+        by_status = counts['by_status']
+        entry = {'date': day.isoformat(), 'total': sum(by_status.values())}
+        entry.update({status: by_status.get(status, 0) for status in STATUSES})
+        entry['by_year_group'] = dict(counts['by_year_group'])
+        result.append(entry)
+    return result
+
+
+def email_totals(now=None):
+    """Admin email counters from the rollups plus the live days.
+
+    'recent' covers the last 7 days at day granularity for rolled-up days, and
+    'recent_sent' counts sent logs by the day they were created.
+    """
+    now = now or datetime.utcnow()
+    week_ago = now - timedelta(days=7)
+    totals = {'total': 0, 'sent': 0, 'failed': 0, 'recent': 0, 'recent_sent': 0}
+
+    for day, status, count in db.session.execute(
+        select(EmailLogDaily.day, EmailLogDaily.status, func.sum(EmailLogDaily.count))
+        .group_by(EmailLogDaily.day, EmailLogDaily.status)
+    ).all():
+        totals['total'] += count
+        if status in ('sent', 'failed'):
+            totals[status] += count
+        if day > week_ago.date():
+            totals['recent'] += count
+            if status == 'sent':
+                totals['recent_sent'] += count
+
+    query = select(
+        func.count(EmailLog.id),
+        _flag(EmailLog.status == 'sent'),
+        _flag(EmailLog.status == 'failed'),
+        _flag(EmailLog.created_at >= week_ago),
+        _flag(EmailLog.sent_at >= week_ago)
+    )
+    live_start = _live_start()
+    if live_start is not None:
+        query = query.where(EmailLog.created_at >= live_start)
+    total, sent, failed, recent, recent_sent = db.session.execute(query).one()
+    totals['total'] += total
+    totals['sent'] += sent
+    totals['failed'] += failed
+    totals['recent'] += recent
+    totals['recent_sent'] += recent_sent
+    return totals
+
+
+def _add_archived_counts(connection, counts):
+    existing = set(connection.execute(
+        select(archived_counts_table.c.user_id).where(archived_counts_table.c.user_id.in_(list(counts)))
+    ).scalars())
+    updates = [{'uid': user_id, 'n': count} for user_id, count in counts.items() if user_id in existing]
+    if updates:
+        connection.execute(
+            update(archived_counts_table)
+            .where(archived_counts_table.c.user_id == bindparam('uid'))
+            .values(emails=archived_counts_table.c.emails + bindparam('n')),
+            updates
+        )
+    inserts = [{'user_id': user_id, 'emails': count} for user_id, count in counts.items() if user_id not in existing]
+    if inserts:
+        connection.execute(insert(archived_counts_table), inserts)
+
+
+def purge_email_logs(max_batches=None):
+    """Archive or delete email logs past retention from rolled-up days.
+
+    Returns the number of logs removed from email_logs.
+    """
+    cutoff = _day_start(datetime.utcnow().date() - timedelta(days=_config('EMAIL_LOG_RETENTION_DAYS')))
+    live_start = _live_start()
+    if live_start is None:
+        return 0
+    cutoff = min(cutoff, live_start)
+    archive = _config('EMAIL_LOG_RETENTION_MODE') == 'archive'
+    batch_size = _config('EMAIL_RETENTION_BATCH_SIZE')
+    pause = _config('EMAIL_RETENTION_PAUSE')
+
+    removed = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        # Oldest ids first, so the scan stops at the first batch_size old rows
+        ids = db.session.execute(
+            select(EmailLog.id).where(EmailLog.created_at < cutoff).order_by(EmailLog.id).limit(batch_size)
+        ).scalars().all()
+        if not ids:
+            break
+
+        connection = db.session.connection()
+        in_batch = logs_table.c.id.in_(ids)
+        if archive:
+            columns = ['id', 'user_id', 'subject', 'content', 'body_hash', 'status',
+                       'error_message', 'sent_at', 'created_at']
+            connection.execute(
+                insert(archive_table).from_select(
+                    columns + ['archived_at'],
+                    select(*[logs_table.c[name] for name in columns], literal(datetime.utcnow(), db.DateTime))
+                    .where(in_batch)
+                )
+            )
+        counts = dict(connection.execute(
+            select(logs_table.c.user_id, func.count()).where(in_batch).group_by(logs_table.c.user_id)
+        ).all())
+        _add_archived_counts(connection, counts)
+        # Core statements on the connection: the logs moved into archived_email_counts, so no counter changes
+        connection.execute(delete(logs_table).where(in_batch))
+        db.session.commit()
+
+        removed += len(ids)
+        batches += 1
+        if pause:
+            time.sleep(pause)
+    return removed
+
+
+def prune_email_bodies(max_batches=None):
+    """Delete email bodies that no live or archived log points to; returns the number deleted"""
+    batch_size = _config('EMAIL_RETENTION_BATCH_SIZE')
+    referenced = or_(
+        bodies_table.c.hash.in_(select(logs_table.c.body_hash).where(logs_table.c.body_hash.isnot(None))),
+        bodies_table.c.hash.in_(select(archive_table.c.body_hash).where(archive_table.c.body_hash.isnot(None)))
+    )
+    deleted = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        hashes = db.session.execute(
+            select(bodies_table.c.hash).where(~referenced).limit(batch_size)
+        ).scalars().all()
+        if not hashes:
+            break
+        db.session.connection().execute(delete(bodies_table).where(bodies_table.c.hash.in_(hashes)))
+        db.session.commit()
+        deleted += len(hashes)
+        batches += 1
+    return deleted
+
+
+def prune_outbox(max_batches=None):
+    """Delete delivered and dead outbox messages, then finished jobs, past OUTBOX_RETENTION_DAYS.
+
+    Returns (messages, jobs) deleted.
+    """
+    cutoff = datetime.utcnow() - timedelta(days=_config('OUTBOX_RETENTION_DAYS'))
+    batch_size = _config('EMAIL_RETENTION_BATCH_SIZE')
+    messages_table = OutboxMessage.__table__
+    jobs_table = EmailJob.__table__
+
+    messages = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        ids = db.session.execute(
+            select(OutboxMessage.id).where(
+                OutboxMessage.status.in_(('sent', 'dead')),
+                func.coalesce(OutboxMessage.sent_at, OutboxMessage.created_at) < cutoff
+            ).order_by(OutboxMessage.id).limit(batch_size)
+        ).scalars().all()
+        if not ids:
+            break
+        db.session.connection().execute(delete(messages_table).where(messages_table.c.id.in_(ids)))
+        db.session.commit()
+        messages += len(ids)
+        batches += 1
+
+    jobs = db.session.connection().execute(
+        delete(jobs_table).where(
+            jobs_table.c.completed_at < cutoff,
+            ~jobs_table.c.id.in_(select(messages_table.c.job_id))
+        )
+    ).rowcount
+    db.session.commit()
+    return messages, jobs
+
+
+def run_retention():
+    """Roll up, purge and prune; returns a summary dict"""
+    from app.services.admin_stats_service import invalidate_admin_stats
+
+    summary = {'days_rolled_up': rollup_email_logs()}
+    summary['logs_removed'] = purge_email_logs()
+    summary['bodies_deleted'] = prune_email_bodies()
+    summary['outbox_messages_deleted'], summary['outbox_jobs_deleted'] = prune_outbox()
+    # The deletes above bypass the ORM events that mark the admin snapshot stale
+    invalidate_admin_stats()
+    return summary
+
+
+@event.listens_for(Session, 'after_flush')
+def _delete_archived_logs_of_deleted_users(session, flush_context):
+    """Deleting a user removes their archived logs, as it does their live ones"""
+    user_ids = [obj.id for obj in session.deleted if isinstance(obj, User)]
+    if user_ids:
+        session.connection().execute(delete(archive_table).where(archive_table.c.user_id.in_(user_ids)))
@@ -1,7 +1,10 @@
 from flask import current_app
 from flask_mail import Message
-from app import mail, db
+from app import db
 from app.models import EmailLog
+from app.services.smtp_pool import smtp_pool
+from app.services.outbox_service import enqueue
+from app.services.email_templates import render_bulletin_email
 from datetime import datetime
 import os
 
@@ -19,205 +22,7 @@ class EmailService:
     def generate_bulletin_email(self, user, items):
         """Generate email content for bulletin items"""
         subject = f"KGV Bulletin - Year {user.year_group} Disapointments and Announcements"
-        
-        # Generate HTML content
-        html_content = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <meta charset="utf-8">
-            <meta name="viewport" content="width=device-width, initial-scale=1.0">
-            <title>{subject}</title>
-            <link rel="preconnect" href="https://fonts.googleapis.com">
-            <link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>
-            <link href="https://fonts.googleapis.com/css2?family=Red+Hat+Display:wght@300;400;500;600;700&family=Red+Hat+Text:wght@300;400;500;600&display=swap" rel="stylesheet">
-            <style>
-                body {{
-                    font-family: 'Red Hat Text', -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif;
-                    line-height: 1.6;
-                    color: #111827;
-                    max-width: 800px;
-                    margin: 0 auto;
-                    padding: 20px;
-                    background-color: #f9fafb;
-                }}
-                h1, h2, h3, h4, h5, h6 {{
-                    font-family: 'Red Hat Display', -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif;
-                    font-weight: 600;
-                }}
-                .header {{
-                    background: #1f2937;
-                    color: white;
-                    padding: 30px;
-                    border-radius: 8px;
-                    text-align: center;
-                    margin-bottom: 30px;
-                }}
-                .header h1 {{
-                    margin: 0;
-                    font-size: 28px;
-                    font-weight: 600;
-                }}
-                .header p {{
-                    margin: 10px 0 0 0;
-                    opacity: 0.9;
-                    color: #e5e7eb;
-                }}
-                .item {{
-                    background: white;
-                    border-radius: 6px;
-                    padding: 25px;
-                    margin-bottom: 25px;
-                    box-shadow: 0 1px 3px rgba(0,0,0,0.1);
-                    border-left: 4px solid #1f2937;
-                }}
-                .item-number {{
-                    background: #1f2937;
-                    color: white;
-                    padding: 6px 14px;
-                    border-radius: 16px;
-                    font-size: 14px;
-                    font-weight: 500;
-                    display: inline-block;
-                    margin-bottom: 15px;
-                }}
-                .headline {{
-                    background: #f3f4f6;
-                    border-left: 3px solid #374151;
-                    padding: 15px;
-                    margin-bottom: 20px;
-                    border-radius: 4px;
-                }}
-                .headline h3 {{
-                    margin: 0;
-                    color: #374151;
-                    font-size: 18px;
-                    font-weight: 600;
-                }}
-                .content {{
-                    font-size: 15px;
-                    line-height: 1.7;
-                    white-space: pre-line;
-                    color: #111827;
-                }}
-                .attachments {{
-                    background: #f3f4f6;
-                    padding: 15px;
-                    border-radius: 4px;
-                    margin-top: 15px;
-                }}
-                .attachments h4 {{
-                    margin: 0 0 10px 0;
-                    color: #374151;
-                    font-size: 14px;
-                    font-weight: 500;
-                }}
-                .attachment-link {{
-                    color: #1f2937;
-                    text-decoration: none;
-                    display: block;
-                    margin-bottom: 5px;
-                    font-weight: 500;
-                }}
-                .attachment-link:hover {{
-                    text-decoration: underline;
-                }}
-                .metadata {{
-                    font-size: 13px;
-                    color: #6b7280;
-                    margin-top: 15px;
-                    padding-top: 15px;
-                    border-top: 1px solid #e5e7eb;
-                }}
-                .footer {{
-                    text-align: center;
-                    padding: 30px;
-                    background: white;
-                    border-radius: 6px;
-                    margin-top: 30px;
-                    border: 1px solid #e5e7eb;
-                }}
-                .footer p {{
-                    margin: 5px 0;
-                    color: #6b7280;
-                    font-size: 14px;
-                }}
-                .unsubscribe {{
-                    color: #374151;
-                    text-decoration: none;
-                    font-size: 12px;
-                    font-weight: 500;
-                }}
-            </style>
-        </head>
-        <body>
-            <div class="header">
-                <h1>Student Bulletin</h1>
-                <p>Year {user.year_group} • {datetime.now().strftime('%B %d, %Y')}</p>
-            </div>
-        """
-        
-        if not items:
-            html_content += """
-            <div class="item">
-                <p>No new bulletin items found for your year group today.</p>
-                <p>Check back tomorrow for updates!</p>
-            </div>
-            """
-        else:
-            for i, item in enumerate(items, 1):
-                html_content += f"""
-                <div class="item">
-                    <div class="item-number">Item {i}</div>
-                """
-                
-                if item.ai_headline:
-                    html_content += f"""
-                    <div class="headline">
-                        <h3>{item.ai_headline}</h3>
-                    </div>
-                    """
-                
-                html_content += f"""
-                    <div class="content">{item.content}</div>
-                """
-                
-                # Add attachments if any
-                attachments = item.get_attachments()
-                if attachments:
-                    html_content += """
-                    <div class="attachments">
-                        <h4>Attachments:</h4>
-                    """
-                    for attachment in attachments:
-                        html_content += f"""
-                        <a href="{attachment.get('url', '#')}" class="attachment-link">
-                            {attachment.get('name', 'Attachment')}
-                        </a>
-                        """
-                    html_content += "</div>"
-                
-                # Add metadata
-                metadata = item.get_metadata()
-                if metadata.get('posted_info'):
-                    html_content += f"""
-                    <div class="metadata">
-                        {metadata['posted_info']}
-                    </div>
-                    """
-                
-                html_content += "</div>"
-        
-        html_content += f"""
-            <div class="footer">
-                <p><strong>Student Bulletin Email Service</strong></p>
-                <p>Got any questions? Email huais2@kgv.hk, or reply to this email!</p>
-            </div>
-        </body>
-        </html>
-        """
-        
-        return subject, html_content
+        return subject, render_bulletin_email(subject, user.year_group, items)
     
     def send_bulletin_email(self, user, items, is_test=False):
         """Send bulletin email to a user"""
@@ -236,7 +41,7 @@ class EmailService:
             )
             
             # Send email
-            mail.send(msg)
+            smtp_pool.send(msg, kind='bulletin')
             
             # Log the email
             email_log = EmailLog(
@@ -266,58 +71,61 @@ class EmailService:
             print(f"Failed to send email to {user.email}: {e}")
             return False
     
+    def wrap_custom_content(self, subject, content):
+        """Wrap custom HTML content in the standard email layout"""
+        return f"""
+        <!DOCTYPE html>
+        <html>
+        <head>
+            <meta charset="utf-8">
+            <meta name="viewport" content="width=device-width, initial-scale=1.0">
+            <title>{subject}</title>
+            <link rel="preconnect" href="https://fonts.googleapis.com">
+            <link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>
+            <link href="https://fonts.googleapis.com/css2?family=Red+Hat+Display:wght@300;400;500;600;700&family=Red+Hat+Text:wght@300;400;500;600&display=swap" rel="stylesheet">
+            <style>
+                body {{
+                    font-family: 'Red Hat Text', -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif;
+                    line-height: 1.6;
+                    color: #111827;
+                    max-width: 800px;
+                    margin: 0 auto;
+                    padding: 20px;
+                    background-color: #f9fafb;
+                }}
+                h1, h2, h3, h4, h5, h6 {{
+                    font-family: 'Red Hat Display', -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif;
+                    font-weight: 600;
+                }}
+                .content {{
+                    background: white;
+                    padding: 30px;
+                    border-radius: 6px;
+                    box-shadow: 0 1px 3px rgba(0,0,0,0.1);
+                }}
+                .footer {{
+                    text-align: center;
+                    padding: 20px;
+                    color: #6b7280;
+                    font-size: 14px;
+                }}
+            </style>
+        </head>
+        <body>
+            <div class="content">
+                {content}
+            </div>
+            <div class="footer">
+                <p>KGV School Bulletin Email Service</p>
+            </div>
+        </body>
+        </html>
+        """
+    
     def send_custom_email(self, user, subject, content):
         """Send a custom email to a user"""
         try:
-            # Create HTML wrapper for custom content
-            html_content = f"""
-            <!DOCTYPE html>
-            <html>
-            <head>
-                <meta charset="utf-8">
-                <meta name="viewport" content="width=device-width, initial-scale=1.0">
-                <title>{subject}</title>
-                <link rel="preconnect" href="https://fonts.googleapis.com">
-                <link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>
-                <link href="https://fonts.googleapis.com/css2?family=Red+Hat+Display:wght@300;400;500;600;700&family=Red+Hat+Text:wght@300;400;500;600&display=swap" rel="stylesheet">
-                <style>
-                    body {{
-                        font-family: 'Red Hat Text', -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif;
-                        line-height: 1.6;
-                        color: #111827;
-                        max-width: 800px;
-                        margin: 0 auto;
-                        padding: 20px;
-                        background-color: #f9fafb;
-                    }}
-                    h1, h2, h3, h4, h5, h6 {{
-                        font-family: 'Red Hat Display', -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif;
-                        font-weight: 600;
-                    }}
-                    .content {{
-                        background: white;
-                        padding: 30px;
-                        border-radius: 6px;
-                        box-shadow: 0 1px 3px rgba(0,0,0,0.1);
-                    }}
-                    .footer {{
-                        text-align: center;
-                        padding: 20px;
-                        color: #6b7280;
-                        font-size: 14px;
-                    }}
-                </style>
-            </head>
-            <body>
-                <div class="content">
-                    {content}
-                </div>
-                <div class="footer">
-                    <p>KGV School Bulletin Email Service</p>
-                </div>
-            </body>
-            </html>
-            """
+            html_content = self.wrap_custom_content(subject, content)
             
             # Create email message
             msg = Message(
@@ -328,7 +136,7 @@ class EmailService:
             )
             
             # Send email
-            mail.send(msg)
+            smtp_pool.send(msg, kind='custom')
             
             # Log the email
             email_log = EmailLog(
@@ -359,20 +167,27 @@ class EmailService:
             return False
     
     def send_bulk_email(self, users, subject, content):
-        """Send bulk email to multiple users"""
+        """Send the same email to many users: encoded once, sent in BCC batches, logged in one insert"""
+        html_content = self.wrap_custom_content(subject, content)
+        message = Message(subject=subject, html=html_content, sender=self.sender_email)
+        errors = smtp_pool.send_bulk(message, [user.email for user in users], kind='custom')
+        
         successful_sends = 0
         failed_sends = 0
-        
-        for user in users:
-            try:
-                success = self.send_custom_email(user, subject, content)
-                if success:
-                    successful_sends += 1
-                else:
-                    failed_sends += 1
-            except Exception as e:
-                print(f"Failed to send bulk email to {user.email}: {e}")
+        sent_at = datetime.utcnow()
+        logs = []
+        for user, error in zip(users, errors):
+            if error is None:
+                successful_sends += 1
+                logs.append({'user_id': user.id, 'subject': subject, 'content': html_content,
+                             'status': 'sent', 'error_message': None, 'sent_at': sent_at, 'created_at': sent_at})
+            else:
                 failed_sends += 1
+                print(f"Failed to send bulk email to {user.email}: {error}")
+                logs.append({'user_id': user.id, 'subject': subject, 'content': content,
+                             'status': 'failed', 'error_message': error, 'sent_at': None, 'created_at': sent_at})
+        EmailLog.insert_many(db.session, logs)
+        db.session.commit()
         
         return {
             'successful_sends': successful_sends,
@@ -380,8 +195,8 @@ class EmailService:
             'total_recipients': len(users)
         }
     
-    def send_verification_email(self, user, code):
-        """Send an email verification code to the user"""
+    def generate_verification_email(self, user, code):
+        """Generate the subject and HTML for an email verification code"""
         subject = "Verify your email address for Student Bulletin Service"
         html_content = f"""
         <!DOCTYPE html>
@@ -420,6 +235,11 @@ class EmailService:
         </body>
         </html>
         """
+        return subject, html_content
+    
+    def send_verification_email(self, user, code):
+        """Send an email verification code to the user"""
+        subject, html_content = self.generate_verification_email(user, code)
         try:
             msg = Message(
                 subject=subject,
@@ -427,7 +247,7 @@ class EmailService:
                 html=html_content,
                 sender=self.sender_email
             )
-            mail.send(msg)
+            smtp_pool.send(msg, kind='verification')
             # Log the email
             email_log = EmailLog(
                 user_id=user.id,
@@ -451,3 +271,21 @@ class EmailService:
             db.session.commit()
             print(f"Failed to send verification email to {user.email}: {e}")
             return False
+    
+    def queue_bulletin_email(self, user, items, is_test=False):
+        """Queue a bulletin email to a user in the outbox; returns the EmailJob"""
+        subject, html_content = self.generate_bulletin_email(user, items)
+        if is_test:
+            subject = f"[TEST] {subject}"
+        return enqueue('bulletin', [(user.id, user.email)], subject, html_content, requested_by=user.id)
+    
+    def queue_bulk_email(self, users, subject, content, requested_by=None):
+        """Queue the same custom email to many users in the outbox; returns the EmailJob"""
+        html_content = self.wrap_custom_content(subject, content)
+        return enqueue('bulk', [(user.id, user.email) for user in users], subject, html_content,
+                       requested_by=requested_by)
+    
+    def queue_verification_email(self, user, code):
+        """Queue an email verification code in the outbox; returns the EmailJob"""
+        subject, html_content = self.generate_verification_email(user, code)
+        return enqueue('verification', [(user.id, user.email)], subject, html_content, requested_by=user.id)
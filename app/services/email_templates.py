@@ -0,0 +1,114 @@
+"""
+Bulletin email rendering.
+
+The layout lives in templates/email/bulletin.html and each item's body in
+templates/email/bulletin_item.html. Flask's Jinja environment compiles each
+template once. The stylesheet (templates/email/bulletin.css) is minified
+once per process and embedded in the layout.
+
+Rendered item bodies are kept in an LRU cache keyed by (item id, version).
+BulletinItem.version is bumped on every ORM update, so an edited item is
+rendered again. A digest for many recipients therefore renders each item
+once, and every later email only joins cached fragments into the layout.
+The item number depends on position, so the layout adds it around each
+fragment.
+"""
+from flask import current_app
+from markupsafe import Markup
+from collections import OrderedDict
+from datetime import datetime
+import os
+import re
+import threading
+
+DEFAULT_CACHE_SIZE = 2000
+
+_css = None
+
+
+def minify_css(css):
+    css = re.sub(r'/\*.*?\*/', '', css, flags=re.S)
+    css = re.sub(r'\s+', ' ', css)
+    css = re.sub(r'\s*([{};:,>])\s*', r'\1', css)
+    return css.replace(';}', '}').strip()
+
+
+def bulletin_css():
+    """The minified email stylesheet, read once per process"""
+    global _css
+    if _css is None:
+        path = os.path.join(current_app.root_path, 'templates', 'email', 'bulletin.css')
+        with open(path) as f:
+            _css = Markup(minify_css(f.read()))
+    return _css
+
+
+class FragmentCache:
+    """Thread-safe LRU of rendered item fragments"""
+
+    def __init__(self, max_size=DEFAULT_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            fragment = self._entries.get(key)
+            if fragment is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return fragment
+
+    def put(self, key, fragment):
+        with self._lock:
+            self._entries[key] = fragment
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+fragment_cache = FragmentCache()
+
+
+def render_item_fragment(item, template=None):
+    """The item's email body, from the cache when this version was rendered before"""
+    # Unsaved items have no stable key
+    key = (item.id, item.version) if item.id is not None else None
+    if key is not None:
+        fragment = fragment_cache.get(key)
+        if fragment is not None:
+            return fragment
+
+    template = template or current_app.jinja_env.get_template('email/bulletin_item.html')
+    fragment = Markup(template.render(
+        item=item, attachments=item.get_attachments(), metadata=item.get_metadata()
+    ))
+    if key is not None:
+        fragment_cache.max_size = current_app.config.get('EMAIL_FRAGMENT_CACHE_SIZE', DEFAULT_CACHE_SIZE)
+        fragment_cache.put(key, fragment)
+    return fragment
+
+
+def render_bulletin_email(subject, year_group, items):
+    """Full HTML for a bulletin email"""
+    env = current_app.jinja_env
+    item_template = env.get_template('email/bulletin_item.html')
+    return env.get_template('email/bulletin.html').render(
+        subject=subject,
+        year_group=year_group,
+        date=datetime.now().strftime('%B %d, %Y'),
+        css=bulletin_css(),
+        fragments=[render_item_fragment(item, item_template) for item in items]
+    )
@@ -0,0 +1,186 @@
+"""
+Current-user resolution for JWT-authenticated requests.
+
+get_current_user() loads the user behind the request's JWT identity at most
+once per request (memoized on flask.g). Across requests, a snapshot of the
+users row is kept for IDENTITY_CACHE_TTL seconds and re-attached to the
+session without a SELECT. Commits that change a user drop their snapshot in
+this process; other workers pick the change up when the TTL expires.
+
+Access tokens also carry role and state claims (is_admin, is_active,
+preferences_set, token_version) so hot-path authorization needs no query at
+all. Bumping a user's token_version revokes access tokens issued before the
+bump; the current versions are kept in a per-process map that is reloaded
+with a single query every TOKEN_VERSION_TTL seconds. An identity with no
+users row is treated as revoked, and deleting a user also revokes their
+tokens in the revocation store, which other workers see within
+REVOCATION_SYNC_INTERVAL seconds.
+"""
+from flask import current_app, g
+from flask_jwt_extended import create_access_token, get_jwt, get_jwt_identity
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session, make_transient_to_detached
+from app import db, jwt
+from app.models import User
+from app.services.revocation_service import revocation_store
+from datetime import timedelta
+import threading
+import time
+
+# user_id -> (column snapshot, fetched_at)
+_user_cache = {}
+_user_cache_lock = threading.Lock()
+
+# user_id -> token_version, or None for a user that does not exist
+_token_versions = {}
+_token_versions_loaded_at = None
+_token_versions_lock = threading.Lock()
+
+
+def get_current_user():
+    """The User for this request's JWT identity, or None"""
+    if 'current_user' not in g:
+        identity = get_jwt_identity()
+        g.current_user = load_user(identity) if identity is not None else None
+    return g.current_user
+
+
+def load_user(user_id):
+    """Load a user by id, going through the short-TTL snapshot cache"""
+    try:
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        return None
+
+    ttl = current_app.config.get('IDENTITY_CACHE_TTL', 15)
+    if ttl > 0:
+        with _user_cache_lock:
+            cached = _user_cache.get(user_id)
+        if cached and time.monotonic() - cached[1] < ttl:
+            user = User(**cached[0])
+            make_transient_to_detached(user)
+            return db.session.merge(user, load=False)
+
+    user = db.session.get(User, user_id)
+    if user is not None and ttl > 0:
+        _store_snapshot(user)
+    return user
+
+
+def invalidate_cached_user(user_id):
+    with _user_cache_lock:
+        _user_cache.pop(int(user_id), None)
+
+
+def _store_snapshot(user):
+    snapshot = {column.key: getattr(user, column.key) for column in User.__table__.columns}
+    max_entries = current_app.config.get('IDENTITY_CACHE_SIZE', 2048)
+    with _user_cache_lock:
+        if len(_user_cache) >= max_entries:
+            # Drop the oldest snapshot; dicts keep insertion order
+            _user_cache.pop(next(iter(_user_cache)))
+        _user_cache[user.id] = (snapshot, time.monotonic())
+
+
+def user_claims(user):
+    """Role and state claims embedded in access tokens"""
+    return {
+        'is_admin': bool(user.is_admin),
+        'is_active': bool(user.is_active),
+        'preferences_set': bool(user.preferences_set),
+        'token_version': user.token_version or 0
+    }
+
+
+def create_user_access_token(user):
+    return create_access_token(
+        identity=str(user.id),
+        additional_claims=user_claims(user),
+        expires_delta=timedelta(hours=4)
+    )
+
+
+def current_user_is_admin():
+    """Admin check for the current request, answered from the token claims"""
+    claims = get_jwt()
+    if 'is_admin' in claims:
+        return bool(claims['is_admin'] and claims.get('is_active', True))
+    # Tokens issued before claims were added
+    user = get_current_user()
+    return bool(user and user.is_admin)
+
+
+def current_token_version(user_id):
+    """Latest token_version for a user, from the periodically reloaded map; None if the user is gone"""
+    global _token_versions_loaded_at
+    user_id = int(user_id)
+    ttl = current_app.config.get('TOKEN_VERSION_TTL', 30)
+    now = time.monotonic()
+    with _token_versions_lock:
+        stale = _token_versions_loaded_at is None or now - _token_versions_loaded_at >= ttl
+    if stale:
+        rows = db.session.execute(select(User.id, User.token_version)).all()
+        with _token_versions_lock:
+            _token_versions.clear()
+            _token_versions.update({row_id: version or 0 for row_id, version in rows})
+            _token_versions_loaded_at = now
+    with _token_versions_lock:
+        if user_id in _token_versions:
+            return _token_versions[user_id]
+    # Registered since the last reload, or never existed
+    version = db.session.execute(select(User.token_version).where(User.id == user_id)).first()
+    version = (version[0] or 0) if version is not None else None
+    with _token_versions_lock:
+        _token_versions[user_id] = version
+    return version
+
+
+def revoke_user_tokens(user):
+    """Revoke all of a user's tokens; call before committing the user's deletion"""
+    revocation_store.revoke_user(user.id)
+
+
+@jwt.token_in_blocklist_loader
+def _token_is_revoked(jwt_header, jwt_payload):
+    """Reject logged-out tokens, tokens of deleted users and access tokens
+    minted before the user's last token_version bump"""
+    if revocation_store.is_revoked(jwt_payload):
+        return True
+    if jwt_payload.get('type') != 'access':
+        return False
+    try:
+        version = current_token_version(jwt_payload['sub'])
+    except (KeyError, TypeError, ValueError):
+        return True
+    return version is None or jwt_payload.get('token_version', 0) < version
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changed_users(session, flush_context):
+    changed = session.info.setdefault('changed_user_ids', set())
+    for obj in session.dirty | session.deleted:
+        if isinstance(obj, User):
+            changed.add(obj.id)
+            if obj in session.deleted:
+                session.info.setdefault('changed_token_versions', {})[obj.id] = None
+            elif 'token_version' not in db.inspect(obj).unloaded and obj.token_version:
+                session.info.setdefault('changed_token_versions', {})[obj.id] = obj.token_version
+    for obj in session.new:
+        if isinstance(obj, User):
+            session.info.setdefault('changed_token_versions', {})[obj.id] = obj.token_version or 0
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_changed_users(session):
+    for user_id in session.info.pop('changed_user_ids', ()):
+        invalidate_cached_user(user_id)
+    versions = session.info.pop('changed_token_versions', None)
+    if versions:
+        with _token_versions_lock:
+            _token_versions.update(versions)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changed_users(session):
+    session.info.pop('changed_user_ids', None)
+    session.info.pop('changed_token_versions', None)
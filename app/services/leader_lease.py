@@ -0,0 +1,163 @@
+"""
+Leader election through the database.
+
+Every app process (gunicorn worker, node or utils/ script) that starts a
+scheduler competes for one named lease, and only the holder runs jobs.
+
+On PostgreSQL the lease is a session-level advisory lock held on a
+dedicated connection. If the leader process dies, its connection closes,
+the server releases the lock and another process takes it on its next try.
+Elsewhere (SQLite) the lease is the scheduler_leases row itself. The holder
+renews expires_at on every heartbeat, and any process may take the row once
+it has expired.
+
+Either way the holder records itself and a heartbeat in scheduler_leases,
+which is what the admin scheduler status shows.
+"""
+from sqlalchemy import select, insert, update, text
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models import SchedulerLease
+from datetime import datetime, timedelta
+import hashlib
+import os
+import socket
+import uuid
+
+lease_table = SchedulerLease.__table__
+
+
+def _advisory_key(name):
+    # pg_advisory_lock takes a signed 64-bit key
+    return int.from_bytes(hashlib.sha256(name.encode()).digest()[:8], 'big', signed=True)
+
+
+class LeaderLease:
+    """A named lease that at most one process holds at a time"""
+
+    def __init__(self, name, ttl=60):
+        self.name = name
+        self.ttl = ttl
+        self.holder = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self.held = False
+        self._lock_connection = None
+
+    def acquire(self):
+        """Try to become the leader; True if this process now holds the lease"""
+        if db.engine.dialect.name == 'postgresql' and not self._take_advisory_lock():
+            return False
+        now = datetime.utcnow()
+        try:
+            with db.engine.begin() as connection:
+                row = connection.execute(
+                    select(lease_table).where(lease_table.c.name == self.name).with_for_update()
+                ).mappings().first()
+                values = {'holder': self.holder, 'acquired_at': now, 'heartbeat_at': now,
+                          'expires_at': now + timedelta(seconds=self.ttl)}
+                if row is None:
+                    connection.execute(insert(lease_table).values(name=self.name, **values))
+                else:
+                    statement = update(lease_table).where(lease_table.c.name == self.name)
+                    if self._lock_connection is None:
+                        # Without the advisory lock, the row is the lease: take it only once it has lapsed
+                        statement = statement.where((lease_table.c.holder == self.holder) |
+                                                    (lease_table.c.expires_at < now))
+                    if connection.execute(statement.values(**values)).rowcount != 1:
+                        return False
+        except IntegrityError:
+            # Another process created the row first
+            self._release_advisory_lock()
+            return False
+        except Exception:
+            self._release_advisory_lock()
+            raise
+        self.held = True
+        return True
+
+    def renew(self):
+        """Extend the lease; False once it has been lost"""
+        if not self.held:
+            return False
+        now = datetime.utcnow()
+        try:
+            if self._lock_connection is not None:
+                # The lock lives as long as this connection does
+                self._lock_connection.execute(text('SELECT 1'))
+                self._lock_connection.commit()
+            with db.engine.begin() as connection:
+                renewed = connection.execute(
+                    update(lease_table)
+                    .where(lease_table.c.name == self.name, lease_table.c.holder == self.holder)
+                    .values(heartbeat_at=now, expires_at=now + timedelta(seconds=self.ttl))
+                ).rowcount == 1
+        except Exception as e:
+            print(f"Failed to renew the {self.name} lease: {e}")
+            renewed = False
+        if not renewed:
+            self.held = False
+            self._release_advisory_lock()
+        return renewed
+
+    def release(self):
+        """Give the lease up so another process can take over at once"""
+        if not self.held:
+            return
+        self.held = False
+        now = datetime.utcnow()
+        try:
+            with db.engine.begin() as connection:
+                connection.execute(
+                    update(lease_table)
+                    .where(lease_table.c.name == self.name, lease_table.c.holder == self.holder)
+                    .values(heartbeat_at=now, expires_at=now)
+                )
+        except Exception as e:
+            print(f"Failed to release the {self.name} lease: {e}")
+        self._release_advisory_lock()
+
+    def status(self):
+        """The current holder as recorded in scheduler_leases"""
+        row = db.session.execute(
+            select(lease_table).where(lease_table.c.name == self.name)
+        ).mappings().first()
+        if row is None:
+            return {'name': self.name, 'holder': None, 'is_this_process': False}
+        return {
+            'name': self.name,
+            'holder': row['holder'],
+            'is_this_process': row['holder'] == self.holder and self.held,
+            'acquired_at': row['acquired_at'].isoformat() if row['acquired_at'] else None,
+            'heartbeat_at': row['heartbeat_at'].isoformat() if row['heartbeat_at'] else None,
+            'expires_at': row['expires_at'].isoformat() if row['expires_at'] else None
+        }
+
+    def _take_advisory_lock(self):
+        if self._lock_connection is None:
+            connection = db.engine.connect()
+            try:
+                locked = connection.execute(
+                    text('SELECT pg_try_advisory_lock(:key)'), {'key': _advisory_key(self.name)}
+                ).scalar()
+                # Commit the implicit transaction so the idle connection holds only the lock
+                connection.commit()
+            except Exception:
+                connection.close()
+                raise
+            if not locked:
+                connection.close()
+                return False
+            self._lock_connection = connection
+        return True
+
+    def _release_advisory_lock(self):
+        connection, self._lock_connection = self._lock_connection, None
+        if connection is None:
+            return
+        try:
+            connection.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': _advisory_key(self.name)})
+            connection.commit()
+        except Exception:
+            pass
+        # Invalidate rather than return to the pool, in case the unlock did not go through
+        connection.invalidate()
+        connection.close()
@@ -0,0 +1,234 @@
+"""
+Prometheus instrumentation.
+
+The metrics are defined once here and updated from request hooks, SQLAlchemy
+engine events, the scraper and the email service. prometheus_client metrics
+are thread-safe. When PROMETHEUS_MULTIPROC_DIR is set before the app starts
+(gunicorn.conf.py does this), every worker writes its samples to that
+directory and /metrics aggregates all of them. Without prometheus_client
+installed, the instrumentation calls become no-ops and /metrics falls back
+to the JSON summary.
+"""
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from contextlib import contextmanager
+import os
+import time
+
+try:
+    from prometheus_client import (
+        CollectorRegistry, Counter, Gauge, Histogram, REGISTRY,
+        CONTENT_TYPE_LATEST, generate_latest, multiprocess
+    )
+    from prometheus_client.core import GaugeMetricFamily
+except ImportError:  # prometheus_client is optional
+    CollectorRegistry = None
+
+MULTIPROCESS = bool(os.getenv('PROMETHEUS_MULTIPROC_DIR'))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SLOW_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 15, 30, 60)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+
+
+class _NoopMetric:
+    """Stands in for a metric when prometheus_client is not installed"""
+
+    def labels(self, *args, **kwargs):
+        return self
+
+    def observe(self, value):
+        pass
+
+    def inc(self, amount=1):
+        pass
+
+    def dec(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+
+if CollectorRegistry is not None:
+    REQUEST_LATENCY = Histogram(
+        'http_request_duration_seconds', 'HTTP request latency',
+        ['method', 'endpoint', 'status'], buckets=LATENCY_BUCKETS
+    )
+    REQUESTS_IN_PROGRESS = Gauge(
+        'http_requests_in_progress', 'HTTP requests currently being served',
+        ['method', 'endpoint'], multiprocess_mode='livesum'
+    )
+    REQUEST_DB_QUERIES = Histogram(
+        'http_request_db_queries', 'SQL statements executed per request',
+        ['endpoint'], buckets=QUERY_COUNT_BUCKETS
+    )
+    REQUEST_DB_TIME = Histogram(
+        'http_request_db_seconds', 'Time spent in SQL statements per request',
+        ['endpoint'], buckets=LATENCY_BUCKETS
+    )
+    DB_QUERIES = Counter('db_queries_total', 'SQL statements executed')
+    SCRAPER_STAGE_LATENCY = Histogram(
+        'scraper_stage_duration_seconds', 'Bulletin scraper stage duration',
+        ['stage'], buckets=SLOW_BUCKETS
+    )
+    AI_REQUEST_LATENCY = Histogram(
+        'ai_request_duration_seconds', 'Headline generation API call latency',
+        ['outcome'], buckets=SLOW_BUCKETS
+    )
+    SMTP_SEND_LATENCY = Histogram(
+        'smtp_send_duration_seconds', 'Time to hand one email to the SMTP server',
+        ['kind', 'outcome'], buckets=SLOW_BUCKETS
+    )
+    SMTP_CONNECTIONS_OPENED = Counter('smtp_connections_opened_total', 'SMTP connections opened by the pool')
+    SMTP_RATE_LIMIT = Gauge(
+        'smtp_send_rate_limit', 'Messages per second the rate governor currently allows',
+        multiprocess_mode='max'
+    )
+    SMTP_RATE_FACTOR = Gauge(
+        'smtp_send_rate_factor', 'Share of the configured send rate in use after throttling',
+        multiprocess_mode='min'
+    )
+    SMTP_SEND_RATE = Gauge(
+        'smtp_send_rate', 'Messages per second sent over the last minute', multiprocess_mode='livesum'
+    )
+    SMTP_RATE_WAITING = Gauge(
+        'smtp_send_backlog', 'Messages waiting for a send token', multiprocess_mode='livesum'
+    )
+    SMTP_THROTTLED = Counter('smtp_throttled_total', 'Throttling replies from the SMTP server', ['code'])
+else:
+    REQUEST_LATENCY = REQUESTS_IN_PROGRESS = REQUEST_DB_QUERIES = REQUEST_DB_TIME = _NoopMetric()
+    DB_QUERIES = SCRAPER_STAGE_LATENCY = AI_REQUEST_LATENCY = SMTP_SEND_LATENCY = _NoopMetric()
+    SMTP_CONNECTIONS_OPENED = SMTP_RATE_LIMIT = SMTP_RATE_FACTOR = SMTP_SEND_RATE = _NoopMetric()
+    SMTP_RATE_WAITING = SMTP_THROTTLED = _NoopMetric()
+
+
+def metrics_available():
+    return CollectorRegistry is not None
+
+
+@contextmanager
+def observe_latency(histogram, with_outcome=False, **labels):
+    """Time a block into histogram, optionally labelled outcome='ok'/'error'"""
+    started = time.perf_counter()
+    outcome = 'ok'
+    try:
+        yield
+    except Exception:
+        outcome = 'error'
+        raise
+    finally:
+        if with_outcome:
+            labels['outcome'] = outcome
+        histogram.labels(**labels).observe(time.perf_counter() - started)
+
+
+def scraper_stage(stage):
+    return observe_latency(SCRAPER_STAGE_LATENCY, stage=stage)
+
+
+def _endpoint_label():
+    # The route rule, not the raw path, keeps label cardinality bounded
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+
+def init_metrics(app):
+    """Register the request hooks that feed the HTTP and per-request DB metrics"""
+
+    @app.before_request
+    def start_request_metrics():
+        g.metrics_started = time.perf_counter()
+        g.metrics_endpoint = _endpoint_label()
+        g.db_query_count = 0
+        g.db_query_time = 0.0
+        REQUESTS_IN_PROGRESS.labels(request.method, g.metrics_endpoint).inc()
+
+    @app.teardown_request
+    def finish_request_metrics(exc):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return
+        endpoint = g.pop('metrics_endpoint')
+        status = getattr(g, 'metrics_status', 500 if exc else 200)
+        REQUESTS_IN_PROGRESS.labels(request.method, endpoint).dec()
+        REQUEST_LATENCY.labels(request.method, endpoint, str(status)).observe(time.perf_counter() - started)
+        REQUEST_DB_QUERIES.labels(endpoint).observe(g.pop('db_query_count', 0))
+        REQUEST_DB_TIME.labels(endpoint).observe(g.pop('db_query_time', 0.0))
+
+    @app.after_request
+    def record_status(response):
+        g.metrics_status = response.status_code
+        return response
+
+
+def snapshot_gauges(stats):
+    families = []
+    for table, key in (('users', 'users'), ('bulletin_items', 'bulletin_items'), ('emails', 'emails'),
+                       ('outbox_messages', 'outbox')):
+        family = GaugeMetricFamily(f'app_{table}', f'Row counts for {table} from the admin stats snapshot',
+                                   labels=['kind'])
+        for kind, value in stats[key].items():
+            family.add_metric([kind], value)
+        families.append(family)
+    subscriptions = GaugeMetricFamily('app_active_subscriptions', 'Active email subscriptions')
+    subscriptions.add_metric([], stats['subscriptions']['active'])
+    families.append(subscriptions)
+    return families
+
+
+def render_metrics(stats=None):
+    """(body, content type) for the Prometheus text exposition.
+
+    In multiprocess mode the samples of every worker are aggregated from
+    PROMETHEUS_MULTIPROC_DIR. stats, if given, is appended as gauges.
+    """
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    body = generate_latest(registry)
+    if stats is not None:
+        extra = CollectorRegistry()
+        extra.register(_StaticCollector(snapshot_gauges(stats)))
+        body += generate_latest(extra)
+    return body, CONTENT_TYPE_LATEST
+
+
+class _StaticCollector:
+    def __init__(self, families):
+        self.families = families
+
+    def collect(self):
+        return self.families
+
+
+def mark_process_dead(pid):
+    """Call from gunicorn's child_exit hook so dead workers' live gauges are dropped"""
+    if metrics_available() and MULTIPROCESS:
+        multiprocess.mark_process_dead(pid)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _stop_query_timer(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('metrics_query_started')
+    if not started:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    DB_QUERIES.inc()
+    if has_request_context() and 'db_query_count' in g:
+        g.db_query_count += 1
+        g.db_query_time += elapsed
+
+
+@event.listens_for(Engine, 'handle_error')
+def _drop_query_timer(exception_context):
+    connection = exception_context.connection
+    if connection is not None and connection.info.get('metrics_query_started'):
+        connection.info['metrics_query_started'].pop()
@@ -0,0 +1,363 @@
+"""
+Durable email outbox.
+
+Routes no longer talk to SMTP. enqueue() stores an EmailJob, which holds the
+subject and HTML body once, and one OutboxMessage row per recipient. The
+rows are inserted in chunks of OUTBOX_ENQUEUE_CHUNK, each chunk in its own
+commit, the first one with the job. It returns the job at once, and GET /api/email-jobs/<id> reports
+progress.
+
+OUTBOX_WORKERS background threads drain the queue. Only the web server
+starts them (gunicorn.conf.py in each worker after it loads the app, app.py
+for the development server), or a separate `flask outbox-worker` process;
+create_app() alone does not, unless ENABLE_OUTBOX_WORKERS=true. At exit the
+workers finish the batch they hold, for up to OUTBOX_SHUTDOWN_TIMEOUT
+seconds. A worker claims up to OUTBOX_BATCH_SIZE due messages by stamping them with a
+claim token, so several threads and processes can share the table. It sends
+them through the SMTP pool and records the outcome. A failed message is
+retried after OUTBOX_RETRY_BASE * 2^(attempts - 1) seconds, capped at
+OUTBOX_RETRY_MAX and jittered. After OUTBOX_MAX_ATTEMPTS failures it is
+marked 'dead'. A claim older than OUTBOX_CLAIM_TIMEOUT seconds belongs to a
+worker that died, and the message is claimed again. A message held back by
+the send rate governor is put back for when the governor expects to have
+tokens again, without counting an attempt. The messages of one job share
+their body, so each job in a batch is encoded once and goes out through
+smtp_pool in BCC batches, and the batch's EmailLog rows are written with a
+single insert.
+"""
+from flask import current_app, has_app_context
+from flask.cli import with_appcontext
+from flask_mail import Message
+from sqlalchemy import select, update, insert, func, or_, and_
+from sqlalchemy.orm import selectinload, undefer
+from app import db
+from app.models import EmailJob, OutboxMessage, EmailLog
+from app.services.smtp_pool import smtp_pool
+from app.services.rate_governor import SendRateLimited
+from collections import defaultdict
+from datetime import datetime, timedelta
+import atexit
+import click
+import os
+import random
+import signal
+import threading
+import time
+import uuid
+
+DEFAULTS = {
+    'OUTBOX_WORKERS': 2,
+    'OUTBOX_BATCH_SIZE': 50,
+    'OUTBOX_ENQUEUE_CHUNK': 500,
+    'OUTBOX_MAX_ATTEMPTS': 5,
+    'OUTBOX_RETRY_BASE': 30,
+    'OUTBOX_RETRY_MAX': 3600,
+    'OUTBOX_CLAIM_TIMEOUT': 600,
+    'OUTBOX_POLL_INTERVAL': 5,
+    'OUTBOX_SHUTDOWN_TIMEOUT': 30
+}
+
+ACTIVE_STATUSES = ('pending', 'sending')
+
+
+def _config(key):
+    if has_app_context():
+        return current_app.config.get(key, DEFAULTS[key])
+    return DEFAULTS[key]
+
+
+def enqueue(kind, recipients, subject, content, requested_by=None):
+    """Queue one email to each (user_id, email) in recipients and return the EmailJob.
+
+    The job commits together with its first chunk of messages and with
+    anything else the caller has pending in the session.
+    """
+    job = EmailJob(kind=kind, subject=subject, content=content,
+                   requested_by=requested_by, total=len(recipients))
+    db.session.add(job)
+    db.session.flush()
+
+    chunk = _config('OUTBOX_ENQUEUE_CHUNK')
+    now = datetime.utcnow()
+    for start in range(0, len(recipients), chunk):
+        db.session.execute(insert(OutboxMessage), [
+            {'job_id': job.id, 'user_id': user_id, 'recipient': email, 'status': 'pending',
+             'attempts': 0, 'next_attempt_at': now, 'created_at': now}
+            for user_id, email in recipients[start:start + chunk]
+        ])
+        db.session.commit()
+    if not recipients:
+        db.session.commit()
+
+    outbox_worker.wake()
+    return job
+
+
+def job_status(job):
+    """The job's to_dict() plus per-status message counts and progress"""
+    counts = dict(db.session.execute(
+        select(OutboxMessage.status, func.count(OutboxMessage.id))
+        .where(OutboxMessage.job_id == job.id)
+        .group_by(OutboxMessage.status)
+    ).all())
+    status = job.to_dict()
+    status['counts'] = {name: counts.get(name, 0) for name in ('pending', 'sending', 'sent', 'dead')}
+    done = status['counts']['sent'] + status['counts']['dead']
+    status['progress'] = round(done / job.total, 3) if job.total else 1.0
+    status['state'] = 'completed' if job.completed_at else ('queued' if not done else 'sending')
+    return status
+
+
+def retry_delay(attempts):
+    """Seconds before the next attempt, after `attempts` failures"""
+    delay = min(_config('OUTBOX_RETRY_BASE') * 2 ** (attempts - 1), _config('OUTBOX_RETRY_MAX'))
+    return delay * random.uniform(0.8, 1.2)
+
+
+def claim_batch(limit=None):
+    """Claim up to limit due messages for this worker; returns them with their jobs loaded"""
+    limit = limit or _config('OUTBOX_BATCH_SIZE')
+    now = datetime.utcnow()
+    token = uuid.uuid4().hex
+    due = or_(
+        and_(OutboxMessage.status == 'pending', OutboxMessage.next_attempt_at <= now),
+        and_(OutboxMessage.status == 'sending',
+             OutboxMessage.claimed_at < now - timedelta(seconds=_config('OUTBOX_CLAIM_TIMEOUT')))
+    )
+
+    candidates = select(OutboxMessage.id).where(due).order_by(OutboxMessage.next_attempt_at).limit(limit)
+    if db.session.get_bind().dialect.name == 'postgresql':
+        candidates = candidates.with_for_update(skip_locked=True)
+    ids = db.session.execute(candidates).scalars().all()
+    if not ids:
+        db.session.rollback()
+        return []
+
+    # Re-checking `due` in the UPDATE means a row another worker claimed first is skipped
+    db.session.execute(
+        update(OutboxMessage)
+        .where(OutboxMessage.id.in_(ids), due)
+        .values(status='sending', claimed_by=token, claimed_at=now),
+        execution_options={'synchronize_session': False}
+    )
+    db.session.commit()
+
+    return db.session.execute(
+        select(OutboxMessage)
+        .where(OutboxMessage.claimed_by == token, OutboxMessage.status == 'sending')
+        .options(selectinload(OutboxMessage.job).options(undefer(EmailJob.content)))
+    ).scalars().all()
+
+
+def process_batch(messages):
+    """Send claimed messages and record each outcome. Returns (sent, retried, dead).
+
+    retried includes messages deferred by the rate governor.
+    """
+    from app.services.email_service import EmailService
+    sender = EmailService().sender_email
+
+    # Every message in a job has the same subject and body, so each job is encoded once
+    by_kind = defaultdict(lambda: defaultdict(list))
+    for message in messages:
+        by_kind[message.job.kind][message.job].append(message)
+    errors = {}
+    for kind, jobs in by_kind.items():
+        envelopes = []
+        ordered = []
+        for job, group in jobs.items():
+            envelopes += smtp_pool.envelopes(Message(subject=job.subject, html=job.content, sender=sender),
+                                             [message.recipient for message in group])
+            ordered += group
+        results = smtp_pool.send_envelopes(envelopes, kind=kind, raw_errors=True)
+        errors.update(zip((message.id for message in ordered), results))
+
+    now = datetime.utcnow()
+    max_attempts = _config('OUTBOX_MAX_ATTEMPTS')
+    sent = retried = dead = 0
+    logs = []
+    for message in messages:
+        error = errors[message.id]
+        message.claimed_by = None
+        message.claimed_at = None
+        if isinstance(error, SendRateLimited):
+            retried += 1
+            message.status = 'pending'
+            message.last_error = str(error)
+            message.next_attempt_at = now + timedelta(seconds=error.retry_after)
+            continue
+        message.attempts += 1
+        error = str(error) if error is not None else None
+        if error is None:
+            sent += 1
+            message.status = 'sent'
+            message.sent_at = now
+            message.last_error = None
+            logs.append({'user_id': message.user_id, 'subject': message.job.subject, 'content': message.job.content,
+                         'status': 'sent', 'error_message': None, 'sent_at': now, 'created_at': now})
+        elif message.attempts >= max_attempts:
+            dead += 1
+            message.status = 'dead'
+            message.last_error = error
+            logs.append({'user_id': message.user_id, 'subject': message.job.subject, 'content': message.job.content,
+                         'status': 'failed', 'error_message': error, 'sent_at': None, 'created_at': now})
+        else:
+            retried += 1
+            message.status = 'pending'
+            message.last_error = error
+            message.next_attempt_at = now + timedelta(seconds=retry_delay(message.attempts))
+    db.session.flush()
+    EmailLog.insert_many(db.session, logs)
+
+    _complete_jobs({message.job_id for message in messages}, now)
+    db.session.commit()
+    return sent, retried, dead
+
+
+def _complete_jobs(job_ids, now):
+    unfinished = set(db.session.execute(
+        select(OutboxMessage.job_id)
+        .where(OutboxMessage.job_id.in_(job_ids), OutboxMessage.status.in_(ACTIVE_STATUSES))
+        .distinct()
+    ).scalars())
+    finished = job_ids - unfinished
+    if finished:
+        db.session.execute(
+            update(EmailJob)
+            .where(EmailJob.id.in_(finished), EmailJob.completed_at.is_(None))
+            .values(completed_at=now),
+            execution_options={'synchronize_session': False}
+        )
+
+
+def drain_outbox(max_batches=None):
+    """Process due batches until none are left; returns (sent, retried, dead)"""
+    totals = [0, 0, 0]
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        messages = claim_batch()
+        if not messages:
+            break
+        for i, count in enumerate(process_batch(messages)):
+            totals[i] += count
+        batches += 1
+    return tuple(totals)
+
+
+class OutboxWorker:
+    """Background threads that drain the outbox in an app process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._threads = []
+        self._pid = None
+        self._app = None
+        self._exit_registered = False
+
+    def init_app(self, app):
+        """Remember the app that start() runs the workers for"""
+        self._app = app
+
+    def start(self, app=None, workers=None):
+        """Start this process's workers, unless they already run"""
+        app = app or self._app
+        if workers is None:
+            workers = app.config.get('OUTBOX_WORKERS', DEFAULTS['OUTBOX_WORKERS'])
+        with self._lock:
+            # Threads do not survive a fork, so _pid tells a forked child to start its own
+            if self._pid == os.getpid() or not workers:
+                return
+            self._pid = os.getpid()
+            self._app = app
+            self._stopping.clear()
+            # Daemon threads so a blocked SMTP call cannot hang the interpreter; stop() lets them finish at exit
+            self._threads = [
+                threading.Thread(target=self._run, name=f'outbox-{i}', daemon=True)
+                for i in range(workers)
+            ]
+            for thread in self._threads:
+                thread.start()
+            if not self._exit_registered:
+                atexit.register(self.stop)
+                self._exit_registered = True
+        app.logger.info(f"Outbox started with {workers} workers")
+
+    def stop(self, timeout=None):
+        """Let the workers finish the batch they hold and stop; True if all of them did"""
+        if self._pid != os.getpid() or not self._threads:
+            return True
+        app = self._app
+        if timeout is None:
+            timeout = app.config.get('OUTBOX_SHUTDOWN_TIMEOUT', DEFAULTS['OUTBOX_SHUTDOWN_TIMEOUT'])
+        self._stopping.set()
+        self._wakeup.set()
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        busy = [thread.name for thread in self._threads if thread.is_alive()]
+        if busy:
+            # Their claimed messages are sent again once OUTBOX_CLAIM_TIMEOUT has passed
+            app.logger.warning(f"Outbox workers still sending at exit: {', '.join(busy)}")
+            return False
+        self._threads = []
+        self._pid = None
+        return True
+
+    def wake(self):
+        """Let idle workers pick up newly queued messages now rather than at the next poll"""
+        self._wakeup.set()
+
+    def _run(self):
+        app = self._app
+        while not self._stopping.is_set():
+            try:
+                with app.app_context():
+                    messages = claim_batch()
+                    if messages:
+                        sent, retried, dead = process_batch(messages)
+                        if retried or dead:
+                            app.logger.warning(f"Outbox batch: {sent} sent, {retried} to retry, {dead} dead")
+                        continue
+            except Exception as e:
+                app.logger.error(f"Outbox worker error: {e}")
+            self._wakeup.wait(app.config.get('OUTBOX_POLL_INTERVAL', DEFAULTS['OUTBOX_POLL_INTERVAL']))
+            # Leave stop()'s wakeup set for the other workers
+            if not self._stopping.is_set():
+                self._wakeup.clear()
+
+
+outbox_worker = OutboxWorker()
+
+
+@click.command('outbox-worker')
+@click.option('--workers', type=int, default=None, help='Sender threads (default OUTBOX_WORKERS)')
+@with_appcontext
+def outbox_worker_command(workers):
+    """Send queued email until interrupted (Ctrl-C or SIGTERM)."""
+    app = current_app._get_current_object()
+    if workers is None:
+        workers = app.config.get('OUTBOX_WORKERS', DEFAULTS['OUTBOX_WORKERS'])
+    if not workers:
+        raise click.UsageError('OUTBOX_WORKERS is 0')
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    # Restart any workers ENABLE_OUTBOX_WORKERS already started, with the requested count
+    outbox_worker.stop()
+    outbox_worker.start(app, workers)
+    try:
+        while not stop.wait(1):
+            pass
+    except KeyboardInterrupt:
+        pass
+    click.echo('Stopping; finishing claimed batches...')
+    outbox_worker.stop()
+
+
+def init_outbox(app, start_workers=False):
+    """Register the outbox-worker command, and start this process's workers if asked"""
+    app.cli.add_command(outbox_worker_command)
+    outbox_worker.init_app(app)
+    if start_workers:
+        outbox_worker.start(app)
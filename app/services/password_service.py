@@ -0,0 +1,130 @@
+"""
+Password hashing off the request threads.
+
+PBKDF2/scrypt hashing holds the GIL for the whole computation, so doing it
+inline in a threaded worker stalls every other request that worker is
+serving. hash_password/verify_password run the Werkzeug functions in a small
+process pool instead. The number of queued and running jobs is capped at
+PASSWORD_HASH_QUEUE_LIMIT. When the cap is reached, PasswordHasherBusy is
+raised at once so the route can shed the request with a 503 instead of
+piling up work.
+
+PASSWORD_HASH_METHOD selects the Werkzeug hash method (for example
+'pbkdf2:sha256:600000' or 'scrypt'). needs_rehash() tells login to re-hash
+a stored password that was made with different parameters.
+"""
+from flask import current_app, has_app_context
+from werkzeug.security import generate_password_hash, check_password_hash
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+import multiprocessing
+import os
+import threading
+
+DEFAULTS = {
+    'PASSWORD_HASH_METHOD': 'pbkdf2',
+    'PASSWORD_HASH_SALT_LENGTH': 16,
+    'PASSWORD_HASH_WORKERS': os.cpu_count() or 2,
+    'PASSWORD_HASH_QUEUE_LIMIT': None,  # defaults to 8 jobs per worker
+    'PASSWORD_HASH_TIMEOUT': 10,
+    'PASSWORD_HASH_START_METHOD': 'forkserver'
+}
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when the hashing pool is saturated; callers should answer 503"""
+
+
+def _config(key):
+    if has_app_context():
+        return current_app.config.get(key, DEFAULTS[key])
+    return DEFAULTS[key]
+
+
+class PasswordHasher:
+    """Bounded process pool for password hashing and verification"""
+
+    def __init__(self):
+        self._executor = None
+        self._slots = None
+        self._lock = threading.Lock()
+        self._canonical_methods = {}
+
+    def hash(self, password):
+        return self._run(
+            generate_password_hash, password,
+            _config('PASSWORD_HASH_METHOD'), _config('PASSWORD_HASH_SALT_LENGTH')
+        )
+
+    def verify(self, password_hash, password):
+        if not password_hash:
+            return False
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """True when password_hash was not made with the configured method"""
+        if not password_hash or '$' not in password_hash:
+            return False
+        return password_hash.split('$', 1)[0] != self._canonical_method(_config('PASSWORD_HASH_METHOD'))
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _canonical_method(self, method):
+        # Werkzeug fills in defaults ('pbkdf2' -> 'pbkdf2:sha256:600000'), so
+        # hash an empty string once to learn the full method string
+        if method not in self._canonical_methods:
+            self._canonical_methods[method] = generate_password_hash('', method, 1).split('$', 1)[0]
+        return self._canonical_methods[method]
+
+    def _run(self, func, *args):
+        workers = _config('PASSWORD_HASH_WORKERS')
+        if not workers:
+            return func(*args)
+
+        executor, slots = self._get_pool(workers)
+        if not slots.acquire(blocking=False):
+            raise PasswordHasherBusy('Password hashing queue is full')
+        try:
+            future = executor.submit(func, *args)
+        except Exception:
+            slots.release()
+            raise
+        future.add_done_callback(lambda _: slots.release())
+
+        try:
+            return future.result(timeout=_config('PASSWORD_HASH_TIMEOUT'))
+        except FutureTimeoutError:
+            raise PasswordHasherBusy('Password hashing timed out')
+
+    def _get_pool(self, workers):
+        with self._lock:
+            if self._executor is None:
+                queue_limit = _config('PASSWORD_HASH_QUEUE_LIMIT') or workers * 8
+                start_method = _config('PASSWORD_HASH_START_METHOD')
+                if start_method not in multiprocessing.get_all_start_methods():
+                    start_method = 'spawn'
+                # Not fork: forking a threaded server can copy held locks
+                self._executor = ProcessPoolExecutor(
+                    max_workers=workers,
+                    mp_context=multiprocessing.get_context(start_method)
+                )
+                self._slots = threading.BoundedSemaphore(queue_limit)
+            return self._executor, self._slots
+
+
+password_hasher = PasswordHasher()
+
+
+def hash_password(password):
+    return password_hasher.hash(password)
+
+
+def verify_password(password_hash, password):
+    return password_hasher.verify(password_hash, password)
+
+
+def needs_rehash(password_hash):
+    return password_hasher.needs_rehash(password_hash)
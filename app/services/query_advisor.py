@@ -0,0 +1,165 @@
+"""
+EXPLAIN for the application's hot queries.
+
+HOT_QUERIES registers the statements behind the busiest routes and jobs,
+each built the same way the route builds it. explain_hot_queries() runs
+EXPLAIN (EXPLAIN QUERY PLAN on SQLite) for each one and reports full table
+scans and sorts that no index satisfies. A new list or filter should be
+registered here with the index that serves it, so utils/explain_queries.py
+keeps checking it.
+"""
+from sqlalchemy import select, func, or_, and_
+from app.models import BulletinItem, EmailLog, EmailSubscription, BulletinFilter, AdminAction, JobRun
+from datetime import datetime, timedelta
+import re
+
+
+def default_params():
+    now = datetime.utcnow()
+    return {
+        'user_id': 1,
+        'admin_user_id': 1,
+        'year_group': '9',
+        'categories': ['sports', 'music'],
+        'status': 'failed',
+        'action_type': 'update_user',
+        'job_id': 'bulletin_poll',
+        'week_ago': now - timedelta(days=7),
+        'day_ago': now - timedelta(days=1),
+        'today': datetime(now.year, now.month, now.day)
+    }
+
+
+def _visible_to(year_group):
+    return or_(BulletinItem.year_groups.contains(year_group), BulletinItem.year_groups.is_(None))
+
+
+def _not_feedback_or_donation():
+    return and_(BulletinItem.is_feedback == False, BulletinItem.is_donation == False)
+
+
+# name -> (where it runs, statement builder)
+HOT_QUERIES = {
+    'bulletins_for_year_group': ('GET /api/bulletins', lambda p: (
+        select(BulletinItem.id).where(
+            _visible_to(p['year_group']),
+            or_(BulletinItem.is_from_student == False,
+                and_(BulletinItem.is_from_student == True, _not_feedback_or_donation()))
+        ).order_by(BulletinItem.created_at.desc()).limit(10)
+    )),
+    'bulletins_email_preview': ('POST /api/bulletins/preview-email', lambda p: (
+        select(BulletinItem.id).where(_visible_to(p['year_group']), _not_feedback_or_donation())
+        .order_by(BulletinItem.created_at.desc()).limit(5)
+    )),
+    'admin_bulletins_feedback': ('GET /api/admin/bulletin-items?type=feedback', lambda p: (
+        select(BulletinItem.id).where(BulletinItem.is_feedback == True)
+        .order_by(BulletinItem.created_at.desc()).limit(20)
+    )),
+    'admin_bulletins_donation': ('GET /api/admin/bulletin-items?type=donation', lambda p: (
+        select(BulletinItem.id).where(BulletinItem.is_donation == True)
+        .order_by(BulletinItem.created_at.desc()).limit(20)
+    )),
+    'bulletins_recent_count': ('GET /api/bulletins/stats', lambda p: (
+        select(func.count(BulletinItem.id)).where(BulletinItem.created_at >= p['week_ago'])
+    )),
+    'bulletins_by_category': ('GET /api/filters/<id>/apply', lambda p: (
+        select(BulletinItem.id).where(BulletinItem.category.in_(p['categories']))
+        .order_by(BulletinItem.created_at.desc()).limit(20)
+    )),
+    'bulletin_categories': ('GET /api/filters/filter-options', lambda p: (
+        select(BulletinItem.category).where(BulletinItem.category.isnot(None)).distinct()
+    )),
+    'digest_candidates': ('digest dispatch job', lambda p: (
+        select(BulletinItem.id).where(BulletinItem.created_at >= p['day_ago'])
+        .order_by(BulletinItem.created_at.desc())
+    )),
+    'email_logs_by_status': ('GET /api/admin/email-logs?status=', lambda p: (
+        select(EmailLog.id).where(EmailLog.status == p['status'])
+        .order_by(EmailLog.created_at.desc()).limit(20)
+    )),
+    'email_logs_latest_sent': ('GET /api/admin/email-logs (monitor)', lambda p: (
+        select(EmailLog.id).order_by(EmailLog.sent_at.desc()).limit(100)
+    )),
+    'email_logs_by_status_sent': ('GET /api/admin/email-logs?status= (paged)', lambda p: (
+        select(EmailLog.id).where(EmailLog.status == p['status'])
+        .order_by(EmailLog.sent_at.desc()).limit(20)
+    )),
+    'email_logs_user_count': ('user_stats counters', lambda p: (
+        select(func.count(EmailLog.id)).where(EmailLog.user_id == p['user_id'])
+    )),
+    'email_logs_live_totals': ('admin stats (days not rolled up)', lambda p: (
+        select(func.count(EmailLog.id)).where(EmailLog.created_at >= p['today'])
+    )),
+    'active_subscription': ('GET /api/subscription/status', lambda p: (
+        select(EmailSubscription.id).where(EmailSubscription.user_id == p['user_id'],
+                                           EmailSubscription.is_active == True).limit(1)
+    )),
+    'user_filters': ('GET /api/filters', lambda p: (
+        select(BulletinFilter.id).where(BulletinFilter.user_id == p['user_id'])
+        .order_by(BulletinFilter.created_at.desc())
+    )),
+    'admin_actions_recent': ('GET /api/admin/audit-logs', lambda p: (
+        select(AdminAction.id).order_by(AdminAction.timestamp.desc()).limit(20)
+    )),
+    'admin_actions_by_type': ('GET /api/admin/audit-logs?action_type=', lambda p: (
+        select(AdminAction.id).where(AdminAction.action_type == p['action_type'])
+        .order_by(AdminAction.timestamp.desc()).limit(20)
+    )),
+    'admin_actions_by_admin': ('GET /api/admin/audit-logs?admin_user_id=', lambda p: (
+        select(AdminAction.id).where(AdminAction.admin_user_id == p['admin_user_id'])
+        .order_by(AdminAction.timestamp.desc()).limit(20)
+    )),
+    'job_runs_recent': ('GET /api/admin/scheduler/runs', lambda p: (
+        select(JobRun.id).order_by(JobRun.queued_at.desc()).limit(20)
+    )),
+    'job_runs_by_job': ('GET /api/admin/scheduler/runs?job_id=', lambda p: (
+        select(JobRun.id).where(JobRun.job_id == p['job_id'])
+        .order_by(JobRun.queued_at.desc()).limit(20)
+    )),
+    'job_runs_finished': ('GET /api/admin/scheduler/status (last runs)', lambda p: (
+        select(JobRun.id).where(JobRun.status.in_(('success', 'failed')))
+        .order_by(JobRun.queued_at.desc()).limit(200)
+    )),
+}
+
+# SQLite: "SCAN bulletin_items" without "USING ... INDEX"; PostgreSQL: "Seq Scan on bulletin_items"
+_SQLITE_SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)(?!.*USING)')
+_POSTGRES_SCAN = re.compile(r'Seq Scan on (\w+)')
+_SQLITE_SORT = re.compile(r'USE TEMP B-TREE FOR (ORDER BY|DISTINCT|GROUP BY)')
+_POSTGRES_SORT = re.compile(r'^\s*(?:->\s*)?Sort\b')
+
+
+def explain(connection, statement):
+    """The query plan lines for a statement"""
+    dialect = connection.dialect
+    compiled = statement.compile(dialect=dialect, compile_kwargs={'render_postcompile': True})
+    sql = str(compiled)
+    params = compiled.params
+    if compiled.positiontup is not None:
+        # Positional paramstyles (SQLite's "?") go to the driver as a tuple
+        params = tuple(compiled.params[name] for name in compiled.positiontup)
+    if dialect.name == 'sqlite':
+        rows = connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + sql, params).all()
+        return [row[-1] for row in rows]
+    return [row[0] for row in connection.exec_driver_sql('EXPLAIN ' + sql, params).all()]
+
+
+def plan_problems(plan, dialect_name):
+    """(tables scanned in full, sorts not served by an index) in a plan"""
+    scan, sort = (_SQLITE_SCAN, _SQLITE_SORT) if dialect_name == 'sqlite' else (_POSTGRES_SCAN, _POSTGRES_SORT)
+    scans = [match.group(1) for match in map(scan.search, plan) if match]
+    sorts = [line.strip() for line in plan if sort.search(line)]
+    return scans, sorts
+
+
+def explain_hot_queries(connection, params=None, names=None):
+    """[{name, route, plan, full_scans, sorts}] for the registered hot queries"""
+    params = {**default_params(), **(params or {})}
+    report = []
+    for name, (route, build) in HOT_QUERIES.items():
+        if names and name not in names:
+            continue
+        plan = explain(connection, build(params))
+        scans, sorts = plan_problems(plan, connection.dialect.name)
+        report.append({'name': name, 'route': route, 'plan': plan, 'full_scans': scans, 'sorts': sorts})
+    return report
@@ -0,0 +1,152 @@
+"""
+SQL statement profiling and N+1 detection.
+
+profile_queries() records every statement executed by the current thread
+while it is active: the count, the total time, and how often each statement
+shape repeats. The shape is the SQL text with whitespace and IN lists
+collapsed. init_query_profiler() wraps every request in a profile and logs a
+warning when one shape runs more than QUERY_REPEAT_WARN_THRESHOLD times,
+which is the signature of an N+1 loop.
+
+query_budget() asserts a budget around a block of code.
+utils/report_query_counts.py --check runs the hot endpoints under it:
+
+    with query_budget(3):
+        client.get('/api/admin/users', headers=headers)
+"""
+from flask import g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from collections import Counter
+from contextlib import contextmanager
+import re
+import threading
+import time
+
+_active = threading.local()
+
+_WHITESPACE = re.compile(r'\s+')
+_IN_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)|\(\s*%\(\w+\)s(?:\s*,\s*%\(\w+\)s)+\s*\)')
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Raised by query_budget when a block runs more statements than allowed"""
+
+
+def statement_shape(statement):
+    """Normalize SQL text so the same query with different IN-list sizes compares equal"""
+    return _IN_LIST.sub('(?)', _WHITESPACE.sub(' ', statement).strip())
+
+
+class QueryProfile:
+    """Statements seen while the profile is active"""
+
+    def __init__(self):
+        self.count = 0
+        self.total_time = 0.0
+        self.shapes = Counter()
+        self.shape_time = Counter()
+
+    def record(self, statement, elapsed):
+        shape = statement_shape(statement)
+        self.count += 1
+        self.total_time += elapsed
+        self.shapes[shape] += 1
+        self.shape_time[shape] += elapsed
+
+    def repeated(self, threshold):
+        """[(shape, count)] for shapes that ran more than threshold times, most frequent first"""
+        return [(shape, count) for shape, count in self.shapes.most_common() if count > threshold]
+
+    def summary(self, top=5):
+        lines = [f'{self.count} statements in {self.total_time * 1000:.1f} ms']
+        for shape, count in self.shapes.most_common(top):
+            lines.append(f'  {count:4d}x {self.shape_time[shape] * 1000:8.1f} ms  {shape[:200]}')
+        return '\n'.join(lines)
+
+
+def _profiles():
+    if not hasattr(_active, 'profiles'):
+        _active.profiles = []
+    return _active.profiles
+
+
+@contextmanager
+def profile_queries():
+    """Profile the statements this thread runs inside the block"""
+    profile = QueryProfile()
+    profiles = _profiles()
+    profiles.append(profile)
+    try:
+        yield profile
+    finally:
+        profiles.remove(profile)
+
+
+@contextmanager
+def query_budget(max_queries, max_repeats=None):
+    """Fail if the block runs more than max_queries statements, or any one shape more than max_repeats times"""
+    with profile_queries() as profile:
+        yield profile
+    problems = []
+    if profile.count > max_queries:
+        problems.append(f'{profile.count} statements, budget is {max_queries}')
+    if max_repeats is not None:
+        for shape, count in profile.repeated(max_repeats):
+            problems.append(f'{count}x (limit {max_repeats}): {shape[:200]}')
+    if problems:
+        raise QueryBudgetExceeded('Query budget exceeded: ' + '; '.join(problems) + '\n' + profile.summary())
+
+
+def init_query_profiler(app):
+    """Profile every request and log likely N+1 patterns"""
+    app.config.setdefault('QUERY_PROFILER_ENABLED', True)
+    app.config.setdefault('QUERY_REPEAT_WARN_THRESHOLD', 10)
+    if not app.config['QUERY_PROFILER_ENABLED']:
+        return
+
+    @app.before_request
+    def start_query_profile():
+        context = profile_queries()
+        g.query_profile = context.__enter__()
+        g.query_profile_context = context
+
+    @app.teardown_request
+    def finish_query_profile(exc):
+        context = g.pop('query_profile_context', None)
+        if context is None:
+            return
+        context.__exit__(None, None, None)
+        profile = g.pop('query_profile')
+        threshold = app.config['QUERY_REPEAT_WARN_THRESHOLD']
+        repeated = profile.repeated(threshold)
+        if repeated:
+            app.logger.warning(
+                f"Possible N+1 in {request.method} {request.path}: "
+                + '; '.join(f'{count}x {shape[:160]}' for shape, count in repeated)
+                + f" ({profile.count} statements, {profile.total_time * 1000:.1f} ms)"
+            )
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _start_statement(conn, cursor, statement, parameters, context, executemany):
+    if getattr(_active, 'profiles', None):
+        conn.info.setdefault('profiler_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _finish_statement(conn, cursor, statement, parameters, context, executemany):
+    profiles = getattr(_active, 'profiles', None)
+    started = conn.info.get('profiler_started')
+    if not profiles or not started:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    for profile in profiles:
+        profile.record(statement, elapsed)
+
+
+@event.listens_for(Engine, 'handle_error')
+def _drop_statement(exception_context):
+    connection = exception_context.connection
+    if connection is not None and connection.info.get('profiler_started'):
+        connection.info['profiler_started'].pop()
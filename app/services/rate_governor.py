@@ -0,0 +1,360 @@
+"""
+SMTP send rate governor.
+
+SMTP providers limit how fast an account may send (Gmail and Google
+Workspace per minute and per day). Going over the limit earns 421/45x
+replies, and an unthrottled bulk send turns into a run of failures.
+Every message sent through smtp_pool first takes a token from up to three
+token buckets. The buckets refill continuously at SMTP_RATE_PER_SECOND,
+SMTP_RATE_PER_MINUTE / 60 and SMTP_RATE_PER_DAY / 86400 tokens per second,
+and hold at most one second's, one minute's and one day's worth. 0 disables
+a bucket.
+
+The buckets live in the send_rate_state row, so all processes share one
+budget. A process leases up to SMTP_RATE_LEASE tokens per transaction and
+hands them to its sender threads. Unused leased tokens expire after a
+second, so an idle process never holds on to a burst. On SQLite the
+transaction starts with BEGIN IMMEDIATE, as SQLite has no row locks, and a
+locked database is retried with backoff. With an in-memory
+SQLite database, or SMTP_RATE_SHARED off, the state is kept per process.
+
+A throttling reply (421, 450, 451 or 452) halves the rate and pauses every
+sender for SMTP_THROTTLE_PAUSE seconds. Once no throttling has been seen
+for that long, the rate climbs back linearly over SMTP_RATE_RECOVERY
+seconds. This is additive-increase/multiplicative-decrease, so the
+governor settles just under what the provider accepts.
+
+A sender that would wait longer than SMTP_RATE_MAX_WAIT seconds for a
+token gets SendRateLimited instead. The outbox reschedules such messages
+without counting an attempt.
+"""
+from flask import current_app, has_app_context
+from sqlalchemy import event, select, insert, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError, OperationalError
+from app import db
+from app.models import SendRateState
+from app.services.metrics_service import (SMTP_RATE_LIMIT, SMTP_RATE_FACTOR, SMTP_SEND_RATE,
+                                          SMTP_RATE_WAITING, SMTP_THROTTLED)
+from collections import deque
+import os
+import random
+import smtplib
+import threading
+import time
+
+DEFAULTS = {
+    'SMTP_RATE_PER_SECOND': 5,
+    'SMTP_RATE_PER_MINUTE': 100,
+    'SMTP_RATE_PER_DAY': 2000,
+    'SMTP_RATE_LEASE': 5,
+    'SMTP_RATE_MAX_WAIT': 30,
+    'SMTP_RATE_SHARED': True,
+    'SMTP_THROTTLE_PAUSE': 30,
+    'SMTP_THROTTLE_RETRIES': 2,
+    'SMTP_RATE_RECOVERY': 300,
+    'SMTP_RATE_MIN_FACTOR': 0.05
+}
+
+THROTTLE_CODES = {421, 450, 451, 452}
+
+# Leased tokens not used within this many seconds are dropped
+LEASE_TTL = 1.0
+
+# Attempts at the state transaction while the database is locked, and the first backoff
+LOCKED_ATTEMPTS = 5
+LOCKED_BACKOFF = 0.05
+
+state_table = SendRateState.__table__
+
+
+class SendRateLimited(Exception):
+    """No send token within SMTP_RATE_MAX_WAIT, or the server kept throttling"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _config(key):
+    if has_app_context():
+        return current_app.config.get(key, DEFAULTS[key])
+    return DEFAULTS[key]
+
+
+def throttle_code(error):
+    """The SMTP reply code if error is the server asking us to slow down, else None"""
+    if isinstance(error, smtplib.SMTPResponseException) and error.smtp_code in THROTTLE_CODES:
+        return error.smtp_code
+    if isinstance(error, smtplib.SMTPRecipientsRefused) and error.recipients:
+        codes = [code for code, _ in error.recipients.values()]
+        if all(code in THROTTLE_CODES for code in codes):
+            return codes[0]
+    return None
+
+
+def bucket_limits():
+    """[(bucket, tokens per second, capacity)] for the enabled buckets"""
+    limits = []
+    for bucket, key, seconds in (('second', 'SMTP_RATE_PER_SECOND', 1),
+                                 ('minute', 'SMTP_RATE_PER_MINUTE', 60),
+                                 ('day', 'SMTP_RATE_PER_DAY', 86400)):
+        capacity = _config(key)
+        if capacity:
+            limits.append((bucket, capacity / seconds, capacity))
+    return limits
+
+
+def _scale(bucket, state):
+    # Throttling slows the short buckets; the daily quota is fixed by the provider
+    return 1.0 if bucket == 'day' else state['factor']
+
+
+def refill(state, limits, now):
+    """Add the tokens earned since the last refill, and recover from throttling"""
+    elapsed = max(0.0, now - state['refilled_at'])
+    if state['factor'] < 1.0 and now - state['last_throttle_at'] > _config('SMTP_THROTTLE_PAUSE'):
+        state['factor'] = min(1.0, state['factor'] + elapsed / _config('SMTP_RATE_RECOVERY'))
+    for bucket, rate, capacity in limits:
+        scale = _scale(bucket, state)
+        key = f'{bucket}_tokens'
+        state[key] = min(max(1.0, capacity * scale), state[key] + elapsed * rate * scale)
+    state['refilled_at'] = now
+
+
+def take(state, limits, want, now):
+    """(tokens granted, seconds until one is available when none are)"""
+    if now < state['paused_until']:
+        return 0, state['paused_until'] - now
+    available = min(state[f'{bucket}_tokens'] for bucket, _, _ in limits)
+    granted = min(want, int(available))
+    if granted:
+        for bucket, _, _ in limits:
+            state[f'{bucket}_tokens'] -= granted
+        return granted, 0.0
+    wait = max((1.0 - state[f'{bucket}_tokens']) / (rate * _scale(bucket, state))
+               for bucket, rate, _ in limits if state[f'{bucket}_tokens'] < 1.0)
+    return 0, wait
+
+
+def throttle(state, now):
+    """Halve the rate and pause, unless this reply belongs to a pause already in force"""
+    if now >= state['paused_until']:
+        state['factor'] = max(_config('SMTP_RATE_MIN_FACTOR'), state['factor'] / 2)
+        state['paused_until'] = now + _config('SMTP_THROTTLE_PAUSE')
+        state['throttles'] += 1
+    state['last_throttle_at'] = now
+
+
+def _initial_state(limits, now):
+    state = {'second_tokens': 0.0, 'minute_tokens': 0.0, 'day_tokens': 0.0, 'refilled_at': now,
+             'factor': 1.0, 'paused_until': 0.0, 'last_throttle_at': 0.0, 'throttles': 0}
+    for bucket, _, capacity in limits:
+        state[f'{bucket}_tokens'] = float(capacity)
+    return state
+
+
+class _LocalState:
+    """Bucket state for this process only"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = None
+
+    def transact(self, limits, change):
+        with self._lock:
+            if self._state is None:
+                self._state = _initial_state(limits, time.time())
+            return change(self._state), dict(self._state)
+
+
+class _DatabaseState:
+    """Bucket state in the send_rate_state row, changed under a row lock"""
+
+    def transact(self, limits, change):
+        # SQLite ignores FOR UPDATE; BEGIN IMMEDIATE takes its write lock before the read instead
+        engine = db.engine.execution_options(sqlite_begin_immediate=True)
+        created = False
+        for attempt in range(LOCKED_ATTEMPTS):
+            try:
+                with engine.begin() as connection:
+                    row = connection.execute(
+                        select(state_table).where(state_table.c.id == 1).with_for_update()
+                    ).mappings().first()
+                    if row is None:
+                        state = _initial_state(limits, time.time())
+                        result = change(state)
+                        connection.execute(insert(state_table).values(id=1, **state))
+                    else:
+                        state = {key: value for key, value in row.items() if key != 'id'}
+                        result = change(state)
+                        connection.execute(update(state_table).where(state_table.c.id == 1).values(**state))
+                    return result, state
+            except IntegrityError:
+                # Another process created the row first
+                if created:
+                    raise
+                created = True
+            except OperationalError as e:
+                # "database is locked" once the driver's busy timeout runs out
+                if attempt == LOCKED_ATTEMPTS - 1:
+                    raise
+                delay = LOCKED_BACKOFF * 2 ** attempt * random.uniform(0.5, 1.5)
+                print(f"Send rate state busy ({e.orig}), retrying in {delay:.2f}s")
+                time.sleep(delay)
+
+
+@event.listens_for(Engine, 'begin')
+def _begin_immediate(connection):
+    # pysqlite only opens a transaction at the first write, so the state would be read unlocked
+    if connection.dialect.name == 'sqlite' and connection.get_execution_options().get('sqlite_begin_immediate'):
+        connection.exec_driver_sql('BEGIN IMMEDIATE')
+
+
+def _shared():
+    if not _config('SMTP_RATE_SHARED'):
+        return False
+    url = db.engine.url
+    # An in-memory SQLite database is private to this process anyway
+    return not (url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'))
+
+
+class SendRateGovernor:
+    """Hands out send tokens to this process's sender threads"""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._local = _LocalState()
+        self._database = _DatabaseState()
+        self._pid = None
+        self._tokens = 0
+        self._tokens_expire = 0.0
+        self._leasing = False
+        self._retry_at = 0.0
+        self._waiting = 0
+        self._sent = deque()
+        self._last_state = None
+
+    def acquire(self):
+        """Block until a send token is available; raises SendRateLimited past SMTP_RATE_MAX_WAIT"""
+        limits = bucket_limits()
+        if not limits:
+            return
+        deadline = time.monotonic() + _config('SMTP_RATE_MAX_WAIT')
+        with self._cond:
+            self._check_pid()
+            self._waiting += 1
+        SMTP_RATE_WAITING.inc()
+        try:
+            self._acquire(limits, deadline)
+        finally:
+            with self._cond:
+                self._waiting -= 1
+            SMTP_RATE_WAITING.dec()
+
+    def _acquire(self, limits, deadline):
+        while True:
+            with self._cond:
+                now = time.monotonic()
+                if self._tokens and now < self._tokens_expire:
+                    self._tokens -= 1
+                    self._record_send(now)
+                    return
+                if self._leasing or now < self._retry_at:
+                    if self._retry_at > deadline:
+                        raise SendRateLimited(f'Send rate limit reached; next token in '
+                                              f'{self._retry_at - now:.0f}s', self._retry_at - now)
+                    self._cond.wait(min(0.5, max(0.01, self._retry_at - now)))
+                    continue
+                self._leasing = True
+                want = min(_config('SMTP_RATE_LEASE'), max(1, self._waiting))
+
+            granted, wait = 0, 0.0
+            try:
+                granted, wait = self._lease(limits, want)
+            finally:
+                with self._cond:
+                    self._leasing = False
+                    now = time.monotonic()
+                    if granted:
+                        self._tokens = granted
+                        self._tokens_expire = now + LEASE_TTL
+                    else:
+                        self._retry_at = now + wait
+                    self._cond.notify_all()
+
+    def _lease(self, limits, want):
+        backend = self._database if _shared() else self._local
+
+        def change(state):
+            now = time.time()
+            refill(state, limits, now)
+            return take(state, limits, want, now)
+
+        (granted, wait), state = backend.transact(limits, change)
+        self._publish(limits, state)
+        return granted, wait
+
+    def throttled(self, code):
+        """Record a throttling reply from the server"""
+        SMTP_THROTTLED.labels(str(code)).inc()
+        limits = bucket_limits()
+        with self._cond:
+            self._tokens = 0
+            self._retry_at = time.monotonic() + _config('SMTP_THROTTLE_PAUSE')
+        if not limits:
+            return
+        backend = self._database if _shared() else self._local
+        _, state = backend.transact(limits, lambda state: throttle(state, time.time()))
+        self._publish(limits, state)
+        print(f"SMTP server throttled sending ({code}); rate factor now {state['factor']:.2f}")
+
+    def status(self):
+        """The governor as this process last saw it, for /metrics"""
+        limits = bucket_limits()
+        with self._cond:
+            now = time.monotonic()
+            self._trim(now)
+            state = self._last_state
+            status = {
+                'limits': {bucket: capacity for bucket, _, capacity in limits},
+                'waiting': self._waiting,
+                'sent_last_minute': len(self._sent),
+                'rate_per_second': round(len(self._sent) / 60, 2)
+            }
+        if state is not None:
+            status['factor'] = round(state['factor'], 3)
+            status['allowed_per_second'] = round(self._allowed_rate(limits, state), 3)
+            status['paused_for'] = round(max(0.0, state['paused_until'] - time.time()), 1)
+            status['throttles'] = state['throttles']
+        return status
+
+    def _allowed_rate(self, limits, state):
+        return min((rate * _scale(bucket, state) for bucket, rate, _ in limits), default=0.0)
+
+    def _publish(self, limits, state):
+        self._last_state = state
+        SMTP_RATE_FACTOR.set(state['factor'])
+        SMTP_RATE_LIMIT.set(self._allowed_rate(limits, state))
+
+    def _record_send(self, now):
+        self._sent.append(now)
+        self._trim(now)
+        SMTP_SEND_RATE.set(len(self._sent) / 60)
+
+    def _trim(self, now):
+        while self._sent and now - self._sent[0] > 60:
+            self._sent.popleft()
+
+    def _check_pid(self):
+        # Leased tokens and local state are not carried across a fork
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._local = _LocalState()
+            self._tokens = 0
+            self._retry_at = 0.0
+            self._waiting = 0
+            self._sent.clear()
+
+
+send_rate_governor = SendRateGovernor()
@@ -0,0 +1,210 @@
+"""
+Token revocation shared across workers and nodes.
+
+Revoked JWT ids are stored in the revoked_tokens table, which every worker
+shares. Each process keeps a Bloom filter of the revoked ids, so checking a
+token that was never revoked (almost every request) costs no query. Only
+filter hits are confirmed against the table. The filter picks up new
+revocations every REVOCATION_SYNC_INTERVAL seconds and is rebuilt every
+REVOCATION_REBUILD_INTERVAL seconds. Rows whose JWT has expired are deleted
+during the rebuild, because an expired token is rejected anyway.
+
+revoke_user() revokes every token of a user at once (when the account is
+deleted): its row is keyed 'user:<id>' and rejects tokens for that identity
+issued up to its revoked_at, so a later account that reuses the id is not
+affected.
+"""
+from flask import current_app
+from sqlalchemy import select, delete
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models import RevokedToken
+from datetime import datetime, timedelta
+import hashlib
+import math
+import threading
+import time
+
+# Revocations committed by other workers are picked up by re-reading this far
+# back from the last sync, which covers transactions that commit late.
+SYNC_OVERLAP = timedelta(seconds=60)
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings"""
+
+    def __init__(self, capacity, error_rate=0.001):
+        self.capacity = capacity = max(capacity, 1)
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, key):
+        added = False
+        for position in self._positions(key):
+            mask = 1 << (position & 7)
+            if not self.bits[position >> 3] & mask:
+                self.bits[position >> 3] |= mask
+                added = True
+        # Approximate number of distinct keys; re-adding a key is free
+        self.count += added
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class RevocationStore:
+    """Process-local Bloom filter front for the revoked_tokens table"""
+
+    def __init__(self):
+        self._bloom = None
+        self._lock = threading.Lock()
+        self._synced_at = None       # monotonic time of the last sync
+        self._synced_until = None    # wall-clock revoked_at covered by the filter
+        self._rebuilt_at = None
+
+    def revoke(self, jwt_payload):
+        """Record a decoded JWT as revoked until it expires"""
+        jti = jwt_payload['jti']
+        record = RevokedToken(
+            jti=jti,
+            token_type=jwt_payload.get('type', 'access'),
+            user_id=_int_or_none(jwt_payload.get('sub')),
+            expires_at=datetime.utcfromtimestamp(jwt_payload['exp']) if jwt_payload.get('exp')
+            else datetime.utcnow() + current_app.config['JWT_REFRESH_TOKEN_EXPIRES']
+        )
+        try:
+            db.session.add(record)
+            db.session.commit()
+        except IntegrityError:
+            # Already revoked (e.g. logout sent twice)
+            db.session.rollback()
+
+        with self._lock:
+            if self._bloom is not None:
+                self._bloom.add(jti)
+
+    def revoke_user(self, user_id):
+        """Revoke every token issued to user_id so far; committed with the caller's transaction"""
+        key = _user_key(user_id)
+        record = db.session.get(RevokedToken, key)
+        if record is None:
+            record = RevokedToken(jti=key, token_type='user', user_id=int(user_id))
+            db.session.add(record)
+        record.revoked_at = datetime.utcnow()
+        # Outlives the longest-lived token the user can hold
+        record.expires_at = record.revoked_at + current_app.config['JWT_REFRESH_TOKEN_EXPIRES']
+
+        # A rolled-back revocation only costs a false positive, confirmed against the table
+        with self._lock:
+            if self._bloom is not None:
+                self._bloom.add(key)
+
+    def is_revoked(self, jwt_payload):
+        keys = [key for key in (jwt_payload.get('jti'), _user_key(jwt_payload.get('sub'))) if key]
+        if not keys:
+            return False
+        self._sync()
+        with self._lock:
+            # No filter yet while another request is building the first one
+            candidates = keys if self._bloom is None else [key for key in keys if key in self._bloom]
+        if not candidates:
+            return False
+        # Bloom filters give false positives, never false negatives
+        rows = db.session.execute(
+            select(RevokedToken.jti, RevokedToken.revoked_at).where(RevokedToken.jti.in_(candidates))
+        ).all()
+        for key, revoked_at in rows:
+            if key == jwt_payload.get('jti'):
+                return True
+            issued_at = datetime.utcfromtimestamp(jwt_payload.get('iat', 0))
+            if issued_at <= revoked_at:
+                return True
+        return False
+
+    def prune_expired(self):
+        """Delete revocations whose token has expired; returns the number removed"""
+        with db.engine.begin() as connection:
+            result = connection.execute(
+                delete(RevokedToken).where(RevokedToken.expires_at < datetime.utcnow())
+            )
+        return result.rowcount
+
+    def _sync(self):
+        config = current_app.config
+        now = time.monotonic()
+        with self._lock:
+            if self._synced_at is not None and now - self._synced_at < config.get('REVOCATION_SYNC_INTERVAL', 5):
+                return
+            rebuild = self._rebuilt_at is None or now - self._rebuilt_at >= config.get('REVOCATION_REBUILD_INTERVAL', 3600)
+            since = self._synced_until
+            # Claim this sync so concurrent requests keep using the current filter
+            self._synced_at = now
+
+        try:
+            self._refresh(rebuild, since, now)
+        except Exception:
+            with self._lock:
+                self._synced_at = None
+            raise
+
+    def _refresh(self, rebuild, since, now):
+        wall_now = datetime.utcnow()
+        if rebuild:
+            self._rebuild(now, wall_now)
+            return
+
+        rows = db.session.execute(
+            select(RevokedToken.jti).where(RevokedToken.revoked_at >= since - SYNC_OVERLAP)
+        ).scalars().all()
+        with self._lock:
+            for jti in rows:
+                self._bloom.add(jti)
+            self._synced_until = wall_now
+            if self._bloom.count > self._bloom.capacity:
+                # Too full to keep the false positive rate down; rebuild next time
+                self._rebuilt_at = None
+
+    def _rebuild(self, now, wall_now):
+        try:
+            pruned = self.prune_expired()
+            if pruned:
+                print(f"Pruned {pruned} expired revoked tokens")
+        except Exception as e:
+            print(f"Error pruning revoked tokens: {e}")
+
+        jtis = db.session.execute(
+            select(RevokedToken.jti).where(RevokedToken.expires_at >= wall_now)
+        ).scalars().all()
+        bloom = BloomFilter(max(self._bloom_capacity(), len(jtis) * 2))
+        for jti in jtis:
+            bloom.add(jti)
+        with self._lock:
+            self._bloom = bloom
+            self._synced_until = wall_now
+            self._rebuilt_at = now
+
+    def _bloom_capacity(self):
+        return current_app.config.get('REVOCATION_BLOOM_CAPACITY', 100000)
+
+
+def _user_key(user_id):
+    user_id = _int_or_none(user_id)
+    return f'user:{user_id}' if user_id is not None else None
+
+
+def _int_or_none(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+revocation_store = RevocationStore()
@@ -1,113 +1,371 @@
 """
 Scheduler service for running background tasks
+
+Every process that creates the app starts a scheduler, but paused. A
+background thread competes for the 'scheduler' leader lease (see
+leader_lease.py) every SCHEDULER_HEARTBEAT seconds. Only the holder
+resumes its scheduler, so each job runs once across all workers and
+nodes. When the leader stops heartbeating for SCHEDULER_LEASE_TTL seconds
+(or exits and releases the lease), another process takes over.
+
+Jobs live in the database (APScheduler's SQLAlchemyJobStore, table
+apscheduler_jobs), so next run times survive restarts and a new leader
+carries on where the old one stopped. A run missed while no process was
+up still runs if the scheduler is back within SCHEDULER_MISFIRE_GRACE
+seconds, once however many runs were missed.
+
+Every execution goes through run_job(), which records a JobRun with its
+start, duration, outcome and error. trigger_job() queues a manual run in
+the job store, where the leader picks it up within a heartbeat.
+
+The bulletin is polled on an adaptive schedule (see scrape_schedule.py),
+and the full scrape only runs when the page has changed.
 """
 from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.schedulers.base import STATE_STOPPED
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
 from apscheduler.executors.pool import ThreadPoolExecutor
-from apscheduler.jobstores.memory import MemoryJobStore
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+from apscheduler.jobstores.base import JobLookupError
+from sqlalchemy import update, delete
+from app import db
+from app.models import JobRun
+from app.services.leader_lease import LeaderLease
+from app.services.scrape_schedule import AdaptivePollTrigger
 import logging
 import atexit
-from datetime import datetime
+import threading
+import time
+from datetime import datetime, timedelta
+
+# Scheduled job id -> (name, SchedulerService method that runs it)
+JOBS = {
+    'bulletin_poll': ('Bulletin Poll', 'poll_bulletins_job'),
+    'bulletin_scraper': ('Bulletin Scraper', 'scrape_bulletins_job'),  # Full scrape, run on request only
+    'stats_reconcile': ('Dashboard Stats Reconciliation', 'reconcile_stats_job'),
+    'digest_dispatch': ('Digest Dispatch', 'dispatch_digests_job'),
+    'email_retention': ('Email Log Retention', 'email_retention_job'),
+}
+
+# The service of this process; the job store refers to run_job by name, not to a bound method
+_service = None
+
+
+def run_job(job_id, run_id=None):
+    """Entry point for every stored job"""
+    if _service is not None:
+        _service.run_job(job_id, run_id)
+
+
+class _BackgroundScheduler(BackgroundScheduler):
+    def _process_jobs(self):
+        # shutdown() wakes the scheduler thread once more. Processing then would advance due jobs in the
+        # shared store (and delete queued manual runs) although the executors no longer run anything.
+        if self.state == STATE_STOPPED:
+            return None
+        return super()._process_jobs()
+
 
 class SchedulerService:
     def __init__(self, app=None):
         self.scheduler = None
         self.app = app
+        self.lease = None
+        self._stopping = threading.Event()
         if app:
             self.init_app(app)
-    
+
     def init_app(self, app):
         """Initialize the scheduler with the Flask app"""
+        global _service
         self.app = app
-        
+        _service = self
+
         # Configure scheduler
-        jobstores = {
-            'default': MemoryJobStore()
-        }
-        
+        with app.app_context():
+            jobstores = {
+                'default': SQLAlchemyJobStore(engine=db.engine, tablename='apscheduler_jobs')
+            }
+
         executors = {
             'default': ThreadPoolExecutor(max_workers=3)
         }
-        
+
         job_defaults = {
-            'coalesce': False,
+            'coalesce': True,  # Several missed runs of a job run once
             'max_instances': 1,
-            'misfire_grace_time': 300  # 5 minutes
+            'misfire_grace_time': app.config.get('SCHEDULER_MISFIRE_GRACE', 3600)
         }
-        
-        self.scheduler = BackgroundScheduler(
+
+        self.scheduler = _BackgroundScheduler(
             jobstores=jobstores,
             executors=executors,
             job_defaults=job_defaults,
             timezone='Asia/Hong_Kong'  # KGV is in Hong Kong
         )
-        
+
         # Set up logging
         logging.getLogger('apscheduler').setLevel(logging.INFO)
-        
-        # Start scheduler
-        self.scheduler.start()
-        
-        # Add bulletin scraping job
+
+        # Start paused; jobs only run while this process holds the leader lease
+        self.scheduler.start(paused=True)
+
+        # Poll the bulletin, more often in school hours
         self.add_bulletin_scraper_job()
-        
-        # Shutdown scheduler when app closes
-        atexit.register(lambda: self.scheduler.shutdown())
-        
-        app.logger.info("Scheduler service initialized and started")
-    
+
+        # Periodically recompute the denormalized dashboard counters
+        self.add_stats_reconcile_job()
+
+        # Send daily and weekly digests as subscribers become due
+        self.add_digest_job()
+
+        # Roll up old email logs and archive or purge them
+        self.add_email_retention_job()
+
+        self.lease = LeaderLease('scheduler', ttl=app.config.get('SCHEDULER_LEASE_TTL', 60))
+        threading.Thread(target=self._run_election, name='scheduler-lease', daemon=True).start()
+
+        # Shutdown scheduler when app closes, and let another process take over at once
+        atexit.register(self.shutdown)
+
+        app.logger.info("Scheduler service initialized; waiting for the leader lease")
+
+    def shutdown(self):
+        """Stop the scheduler and give up the leader lease"""
+        self._stopping.set()
+        if self.scheduler.running:
+            self.scheduler.shutdown(wait=False)
+        with self.app.app_context():
+            self.lease.release()
+
+    def is_leader(self):
+        return self.lease is not None and self.lease.held
+
+    def _run_election(self):
+        heartbeat = self.app.config.get('SCHEDULER_HEARTBEAT', 15)
+        # The first try waits one heartbeat, so create_app has created the tables by then
+        while not self._stopping.wait(heartbeat):
+            try:
+                with self.app.app_context():
+                    if self.lease.held:
+                        if self.lease.renew():
+                            # Pick up manual runs that other processes put in the job store
+                            self.scheduler.wakeup()
+                        else:
+                            self.scheduler.pause()
+                            self.app.logger.warning("Lost the scheduler lease; jobs paused in this process")
+                    elif self.lease.acquire():
+                        self._take_over()
+            except Exception as e:
+                self.app.logger.error(f"Scheduler lease error: {e}")
+
+    def _take_over(self):
+        """Resume the stored jobs and close out runs the previous leader left unfinished"""
+        now = datetime.utcnow()
+        interrupted = db.session.execute(
+            update(JobRun)
+            .where(JobRun.status == 'running', JobRun.host != self.lease.holder)
+            .values(status='failed', finished_at=now, error='Interrupted: the leader stopped during the run'),
+            execution_options={'synchronize_session': False}
+        ).rowcount
+        db.session.commit()
+        self.scheduler.resume()
+        self.app.logger.info(f"This process ({self.lease.holder}) is now the scheduler leader"
+                             + (f"; {interrupted} interrupted runs marked failed" if interrupted else ""))
+
+    def _schedule(self, job_id, trigger):
+        """Store a job, keeping the stored next run time unless its trigger changed"""
+        try:
+            job = self.scheduler.get_job(job_id)
+        except Exception:
+            job = None
+        # str() of a trigger leaves out its timezone
+        if job is not None and str(job.trigger) == str(trigger) \
+                and str(getattr(job.trigger, 'timezone', None)) == str(getattr(trigger, 'timezone', None)):
+            return
+        self.scheduler.add_job(
+            func=run_job,
+            trigger=trigger,
+            args=[job_id],
+            id=job_id,
+            name=JOBS[job_id][0],
+            replace_existing=True
+        )
+
+    def run_job(self, job_id, run_id=None):
+        """Run a job and record it in job_runs"""
+        with self.app.app_context():
+            now = datetime.utcnow()
+            run = db.session.get(JobRun, run_id) if run_id else None
+            if run is None:
+                run = JobRun(job_id=job_id, trigger='schedule', queued_at=now)
+                db.session.add(run)
+            run.status = 'running'
+            run.started_at = now
+            run.host = self.lease.holder if self.lease else None
+            db.session.commit()
+
+            started = time.perf_counter()
+            try:
+                result = getattr(self, JOBS[job_id][1])()
+                run.status = 'success'
+                run.result = result
+            except Exception as e:
+                db.session.rollback()
+                run.status = 'failed'
+                run.error = str(e)
+                self.app.logger.error(f"Job {job_id} failed: {e}")
+            run.finished_at = datetime.utcnow()
+            run.duration_ms = int((time.perf_counter() - started) * 1000)
+            db.session.commit()
+
+    def trigger_job(self, job_id, requested_by=None):
+        """Queue a manual run of a job for the leader; returns the queued JobRun"""
+        if job_id not in JOBS:
+            raise KeyError(job_id)
+        run = JobRun(job_id=job_id, trigger='manual', status='queued', requested_by=requested_by)
+        db.session.add(run)
+        db.session.commit()
+        # Runs however late the leader gets to it
+        self.scheduler.add_job(
+            func=run_job,
+            trigger='date',
+            args=[job_id, run.id],
+            id=f'{job_id}:run:{run.id}',
+            name=f'{JOBS[job_id][0]} (manual)',
+            misfire_grace_time=None
+        )
+        return run
+
     def add_bulletin_scraper_job(self):
-        """Add the daily bulletin scraper job"""
+        """Add the adaptive bulletin poll job"""
         try:
-            # Remove existing job if it exists
+            # Replaced by bulletin_poll; drop it from job stores that still hold it
             try:
                 self.scheduler.remove_job('daily_bulletin_scraper')
-            except Exception:
+            except JobLookupError:
                 pass
-            
-            # Add new job to run every day at 4 PM (16:00)
-            self.scheduler.add_job(
-                func=self.scrape_bulletins_job,
-                trigger=CronTrigger(hour=16, minute=0),  # 4 PM daily
-                id='daily_bulletin_scraper',
-                name='Daily Bulletin Scraper',
-                replace_existing=True
-            )
-            
-            self.app.logger.info("Daily bulletin scraper job scheduled for 4:00 PM every day")
-            
+
+            trigger = AdaptivePollTrigger.from_config(self.app.config, self.scheduler.timezone)
+            self._schedule('bulletin_poll', trigger)
+
+            self.app.logger.info(f"Bulletin poll job scheduled: {trigger}")
+
         except Exception as e:
-            self.app.logger.error(f"Failed to schedule bulletin scraper job: {e}")
-    
-    def scrape_bulletins_job(self):
-        """Job function to scrape bulletins"""
+            self.app.logger.error(f"Failed to schedule bulletin poll job: {e}")
+
+    def add_stats_reconcile_job(self):
+        """Add the dashboard counter reconciliation job"""
+        try:
+            minutes = self.app.config.get('STATS_RECONCILE_MINUTES', 60)
+            self._schedule('stats_reconcile', IntervalTrigger(minutes=minutes, timezone=self.scheduler.timezone))
+
+            self.app.logger.info(f"Stats reconciliation job scheduled every {minutes} minutes")
+
+        except Exception as e:
+            self.app.logger.error(f"Failed to schedule stats reconciliation job: {e}")
+
+    def reconcile_stats_job(self):
+        """Job function to recompute user and year group counters"""
+        from app.services.stats_service import reconcile_stats
+
+        users, groups = reconcile_stats()
+        self.app.logger.info(f"Stats reconciled: {users} users, {groups} year groups")
+        return f"{users} users, {groups} year groups"
+
+    def add_digest_job(self):
+        """Add the digest dispatch job"""
+        try:
+            minutes = self.app.config.get('DIGEST_INTERVAL_MINUTES', 15)
+            self._schedule('digest_dispatch', IntervalTrigger(minutes=minutes, timezone=self.scheduler.timezone))
+
+            self.app.logger.info(f"Digest dispatch job scheduled every {minutes} minutes")
+
+        except Exception as e:
+            self.app.logger.error(f"Failed to schedule digest dispatch job: {e}")
+
+    def dispatch_digests_job(self):
+        """Job function to queue due digests"""
+        from app.services.digest_service import dispatch_due_digests
+
+        summary = dispatch_due_digests()
+        message = (f"{summary['queued']} queued in {summary['jobs']} outbox jobs, "
+                   f"{summary['empty']} with no new items, {summary['cohorts']} cohorts")
+        if summary['due']:
+            self.app.logger.info(f"Digests dispatched: {message}")
+        return message
+
+    def add_email_retention_job(self):
+        """Add the nightly email log rollup and retention job"""
         try:
-            with self.app.app_context():
-                from app.services.bulletin_scraper import BulletinScraperService
-                
-                self.app.logger.info("Starting scheduled bulletin scraping...")
-                
-                scraper = BulletinScraperService()
-                new_count = scraper.scrape_and_save_bulletins(max_items=50)
-                
-                self.app.logger.info(f"Scheduled bulletin scraping completed: {new_count} new items added")
-                
-                # Optionally send notification email to admin about the scraping results
-                self.send_scraping_notification(new_count)
-                
+            # 3:30 AM in the scheduler timezone (Hong Kong), outside sending hours
+            self._schedule('email_retention', CronTrigger(hour=3, minute=30, timezone=self.scheduler.timezone))
+
+            self.app.logger.info("Email retention job scheduled for 3:30 AM every day")
+
         except Exception as e:
-            self.app.logger.error(f"Error in scheduled bulletin scraping: {e}")
-    
+            self.app.logger.error(f"Failed to schedule email retention job: {e}")
+
+    def email_retention_job(self):
+        """Job function to roll up, archive and prune email records, and prune old job runs"""
+        from app.services.email_retention import run_retention
+
+        summary = run_retention()
+        runs_deleted = self.prune_job_runs()
+        message = (f"{summary['days_rolled_up']} days rolled up, "
+                   f"{summary['logs_removed']} logs archived or purged, {summary['bodies_deleted']} bodies, "
+                   f"{summary['outbox_messages_deleted']} outbox messages and {runs_deleted} job runs deleted")
+        self.app.logger.info(f"Email retention: {message}")
+        return message
+
+    def prune_job_runs(self):
+        """Delete finished job runs older than JOB_RUN_RETENTION_DAYS; returns the count"""
+        cutoff = datetime.utcnow() - timedelta(days=self.app.config.get('JOB_RUN_RETENTION_DAYS', 90))
+        deleted = db.session.execute(
+            delete(JobRun).where(JobRun.queued_at < cutoff, JobRun.status.in_(('success', 'failed'))),
+            execution_options={'synchronize_session': False}
+        ).rowcount
+        db.session.commit()
+        return deleted
+
+    def poll_bulletins_job(self):
+        """Job function to scrape bulletins if the page changed since the last scrape"""
+        from app.services.bulletin_scraper import BulletinScraperService
+
+        new_count = BulletinScraperService().scrape_if_changed(max_items=50)
+        if new_count is None:
+            return "Unchanged"
+
+        self.app.logger.info(f"Bulletin changed: {new_count} new items added")
+        self.send_scraping_notification(new_count)
+        return f"Changed, {new_count} new items"
+
+    def scrape_bulletins_job(self):
+        """Job function to scrape bulletins"""
+        from app.services.bulletin_scraper import BulletinScraperService
+
+        self.app.logger.info("Starting bulletin scraping...")
+
+        scraper = BulletinScraperService()
+        new_count = scraper.scrape_and_save_bulletins(max_items=50)
+
+        self.app.logger.info(f"Bulletin scraping completed: {new_count} new items added")
+
+        # Optionally send notification email to admin about the scraping results
+        self.send_scraping_notification(new_count)
+        return f"{new_count} new items"
+
     def send_scraping_notification(self, new_count):
         """Send notification email to admin about scraping results"""
         try:
             if new_count > 0:
                 from app.services.email_service import EmailService
                 from app.models import User
-                
+
                 # Get admin users
                 admin_users = User.query.filter_by(is_admin=True, is_active=True).all()
-                
+
                 if admin_users:
                     email_service = EmailService()
                     subject = f"KGV Bulletin Scraper: {new_count} new items found"
@@ -121,41 +379,45 @@ class SchedulerService:
                     </ul>
                     <p>You can view the new items in the admin dashboard.</p>
                     """
-                    
+
                     # Send to first admin (you can modify this to send to all admins)
                     email_service.send_custom_email(
                         user=admin_users[0],
                         subject=subject,
                         content=content
                     )
-                    
+
                     self.app.logger.info(f"Scraping notification sent to {admin_users[0].email}")
-                    
+
         except Exception as e:
             self.app.logger.warning(f"Failed to send scraping notification: {e}")
-    
+
+    def get_leader(self):
+        """The process holding the scheduler lease"""
+        if not self.lease:
+            return None
+        return self.lease.status()
+
     def get_jobs(self):
-        """Get information about scheduled jobs"""
+        """Get information about scheduled jobs, with each job's latest run"""
         if not self.scheduler:
             return []
-        
+
+        latest = {}
+        for run in JobRun.query.filter(JobRun.status.in_(('success', 'failed'))) \
+                .order_by(JobRun.queued_at.desc()).limit(200):
+            latest.setdefault(run.job_id, run)
+
         jobs = []
         for job in self.scheduler.get_jobs():
+            job_id = job.args[0] if job.args else job.id
+            last_run = latest.get(job_id)
             jobs.append({
                 'id': job.id,
                 'name': job.name,
                 'next_run_time': job.next_run_time.isoformat() if job.next_run_time else None,
-                'trigger': str(job.trigger)
+                'trigger': str(job.trigger),
+                'last_run': last_run.to_dict() if last_run else None
             })
-        
+
         return jobs
-    
-    def trigger_bulletin_scraper_now(self):
-        """Manually trigger the bulletin scraper job"""
-        try:
-            with self.app.app_context():
-                self.scrape_bulletins_job()
-            return True
-        except Exception as e:
-            self.app.logger.error(f"Failed to manually trigger bulletin scraper: {e}")
-            return False
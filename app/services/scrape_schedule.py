@@ -0,0 +1,111 @@
+"""
+Adaptive polling schedule for the bulletin scraper.
+
+Notices are posted during the school day, so the bulletin is polled every
+SCRAPE_POLL_SCHOOL_MINUTES within SCRAPE_SCHOOL_HOURS on school days, every
+SCRAPE_POLL_EVENING_MINUTES from then until SCRAPE_EVENING_END, and every
+SCRAPE_POLL_OFF_MINUTES at night, at weekends and in SCRAPE_HOLIDAYS. A
+long off-hours interval is cut short when the school day starts, so the
+first poll of the day is on time.
+
+Each poll is a conditional fetch (BulletinScraperService.scrape_if_changed),
+and the full scrape with its AI headline calls only runs when the page has
+changed.
+"""
+from apscheduler.triggers.base import BaseTrigger
+from apscheduler.util import astimezone, localize
+from datetime import datetime, date, timedelta
+
+DEFAULTS = {
+    'SCRAPE_SCHOOL_HOURS': '07:00-17:30',
+    'SCRAPE_EVENING_END': '22:00',
+    'SCRAPE_POLL_SCHOOL_MINUTES': 10,
+    'SCRAPE_POLL_EVENING_MINUTES': 30,
+    'SCRAPE_POLL_OFF_MINUTES': 180,
+    'SCRAPE_HOLIDAYS': ''
+}
+
+
+def _parse_time(value):
+    return datetime.strptime(value.strip(), '%H:%M').time()
+
+
+def parse_holidays(value):
+    """'2026-12-19:2027-01-03,2027-02-15' -> ((first day, last day), ...)"""
+    ranges = []
+    for part in filter(None, (part.strip() for part in (value or '').split(','))):
+        first, _, last = part.partition(':')
+        first = date.fromisoformat(first.strip())
+        ranges.append((first, date.fromisoformat(last.strip()) if last else first))
+    return tuple(sorted(ranges))
+
+
+class AdaptivePollTrigger(BaseTrigger):
+    """Fires at the poll interval of the slot (school, evening, off) the last run fell in"""
+
+    def __init__(self, school_hours='07:00-17:30', evening_end='22:00', school_minutes=10,
+                 evening_minutes=30, off_minutes=180, holidays=(), timezone=None):
+        start, _, end = school_hours.partition('-')
+        self.school_start = _parse_time(start)
+        self.school_end = _parse_time(end)
+        self.evening_end = max(_parse_time(evening_end), self.school_end)
+        self.intervals = {
+            'school': timedelta(minutes=school_minutes),
+            'evening': timedelta(minutes=evening_minutes),
+            'off': timedelta(minutes=off_minutes)
+        }
+        self.holidays = tuple(holidays)
+        self.timezone = astimezone(timezone)
+
+    @classmethod
+    def from_config(cls, config, timezone):
+        def setting(key):
+            return config.get(key, DEFAULTS[key])
+        return cls(school_hours=setting('SCRAPE_SCHOOL_HOURS'), evening_end=setting('SCRAPE_EVENING_END'),
+                   school_minutes=setting('SCRAPE_POLL_SCHOOL_MINUTES'),
+                   evening_minutes=setting('SCRAPE_POLL_EVENING_MINUTES'),
+                   off_minutes=setting('SCRAPE_POLL_OFF_MINUTES'),
+                   holidays=parse_holidays(setting('SCRAPE_HOLIDAYS')), timezone=timezone)
+
+    def is_school_day(self, day):
+        return day.weekday() < 5 and not any(first <= day <= last for first, last in self.holidays)
+
+    def _at(self, day, at):
+        return localize(datetime.combine(day, at), self.timezone)
+
+    def slot(self, moment):
+        """(slot name, poll interval, when the slot ends) for an aware datetime"""
+        moment = moment.astimezone(self.timezone)
+        day = moment.date()
+        if self.is_school_day(day):
+            if self._at(day, self.school_start) <= moment < self._at(day, self.school_end):
+                return 'school', self.intervals['school'], self._at(day, self.school_end)
+            if self._at(day, self.school_end) <= moment < self._at(day, self.evening_end):
+                return 'evening', self.intervals['evening'], self._at(day, self.evening_end)
+        return 'off', self.intervals['off'], self._next_school_start(moment)
+
+    def _next_school_start(self, moment):
+        day = moment.date()
+        # Holidays longer than a year are not a schedule worth polling for
+        for _ in range(366):
+            if self.is_school_day(day) and self._at(day, self.school_start) > moment:
+                return self._at(day, self.school_start)
+            day += timedelta(days=1)
+        return moment + self.intervals['off']
+
+    def get_next_fire_time(self, previous_fire_time, now):
+        if previous_fire_time is None:
+            return now
+        _, interval, slot_end = self.slot(previous_fire_time)
+        return min(previous_fire_time + interval, slot_end)
+
+    def __str__(self):
+        minutes = {name: int(interval.total_seconds() // 60) for name, interval in self.intervals.items()}
+        holidays = ','.join(first.isoformat() if first == last else f'{first.isoformat()}:{last.isoformat()}'
+                            for first, last in self.holidays)
+        return (f"adaptive[school {self.school_start:%H:%M}-{self.school_end:%H:%M} every {minutes['school']}m, "
+                f"evening to {self.evening_end:%H:%M} every {minutes['evening']}m, "
+                f"otherwise every {minutes['off']}m, holidays {holidays or 'none'}]")
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} ({self})>'
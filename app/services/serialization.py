@@ -0,0 +1,108 @@
+"""
+JSON encoding helpers for API responses.
+
+RawJSON marks strings that are already valid JSON (for example
+BulletinItem.api_json) so json_response can splice them into the body
+instead of decoding and re-encoding them. parse_fields/serialize_items
+implement ?fields= sparse fieldsets for list endpoints. OrjsonProvider is an
+optional drop-in replacement for Flask's stdlib-based JSON provider.
+"""
+from flask import current_app, request
+from flask.json.provider import DefaultJSONProvider
+
+
+class RawJSON(str):
+    """A string that is already encoded JSON"""
+
+    @classmethod
+    def array(cls, fragments):
+        """Join already-encoded JSON values into a JSON array"""
+        return cls('[' + ','.join(fragments) + ']')
+
+
+def json_response(payload, status=200):
+    """Like jsonify(payload), but RawJSON values are written out verbatim"""
+    dumps = current_app.json.dumps
+    members = []
+    for key, value in payload.items():
+        encoded = value if isinstance(value, RawJSON) else dumps(value)
+        members.append(f'{dumps(key)}:{encoded}')
+    body = '{' + ','.join(members) + '}\n'
+    return current_app.response_class(body, status=status, mimetype=current_app.json.mimetype)
+
+
+def parse_fields(allowed):
+    """Parse a ?fields=a,b,c sparse fieldset from the query string.
+
+    Returns (fields, error): fields is None when the parameter is absent, and
+    error names any field not in allowed.
+    """
+    raw = request.args.get('fields', '').strip()
+    if not raw:
+        return None, None
+    fields = []
+    for field in raw.split(','):
+        field = field.strip()
+        if field and field not in fields:
+            fields.append(field)
+    unknown = [field for field in fields if field not in allowed]
+    if unknown:
+        return None, f"Unknown fields: {', '.join(unknown)}"
+    return fields or None, None
+
+
+def serialize_items(items, fields=None):
+    """Encode model instances for a list response.
+
+    The full representation comes from each item's stored JSON (to_json);
+    a sparse fieldset is built from to_dict(fields) instead. Items without
+    stored JSON are loaded in full first, with one query for the page.
+    """
+    if fields:
+        return [item.to_dict(fields) for item in items]
+    items = list(items)
+    if items:
+        type(items[0]).load_missing_json(items)
+    return RawJSON.array(item.to_json() for item in items)
+
+
+try:
+    import orjson
+except ImportError:  # orjson is optional
+    orjson = None
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson.
+
+    Dates and other non-native types are still passed through
+    DefaultJSONProvider.default so responses look the same as with the
+    stdlib provider.
+    """
+
+    def dumps(self, obj, **kwargs):
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if kwargs.get('sort_keys', self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        if kwargs.get('indent'):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=self.default, option=option).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
+def init_json_provider(app):
+    """Install the JSON provider selected by the JSON_PROVIDER setting.
+
+    'auto' (the default) uses orjson when it is installed, 'orjson' requires
+    it, and 'default' keeps Flask's stdlib provider.
+    """
+    choice = app.config.get('JSON_PROVIDER', 'auto')
+    if choice == 'default':
+        return
+    if orjson is None:
+        if choice == 'orjson':
+            app.logger.warning("JSON_PROVIDER=orjson but orjson is not installed, using the stdlib provider")
+        return
+    app.json = OrjsonProvider(app)
@@ -0,0 +1,342 @@
+"""
+Pooled SMTP delivery.
+
+Flask-Mail's mail.send() opens a new connection for every message, which
+means a TCP connect, STARTTLS handshake and login per recipient. SMTPPool
+keeps up to SMTP_POOL_SIZE authenticated connections open and hands them
+out per message. A connection is closed and replaced after
+SMTP_POOL_MAX_MESSAGES messages or when it has sat idle for more than
+SMTP_POOL_IDLE_TIMEOUT seconds, because servers drop idle sessions. If a
+reused connection turns out to be dead, the message is retried once on a
+fresh connection.
+
+send_many() sends a list of messages from SMTP_SEND_WORKERS threads that
+share the pool. The pool is created lazily in each process, so gunicorn
+workers never share sockets inherited across a fork.
+
+Every message first takes a token from the send rate governor
+(rate_governor.py). A throttling reply (421/45x) is reported to the governor
+and the message is tried again, up to SMTP_THROTTLE_RETRIES times, once the
+governor allows.
+
+send_bulk() sends one message to many recipients. The MIME message is built
+and encoded once (PreparedMessage). It then goes out in BCC batches of up to
+SMTP_BCC_BATCH_SIZE recipients per SMTP transaction, or, with a batch size
+of 1, as one copy per recipient with only the To and Message-ID headers
+swapped in. Each recipient takes its own send token.
+"""
+from flask import current_app, has_app_context
+from flask_mail import Connection, BadHeaderError, sanitize_address
+from email.utils import make_msgid
+from app.services.metrics_service import SMTP_SEND_LATENCY, SMTP_CONNECTIONS_OPENED, observe_latency
+from app.services.rate_governor import send_rate_governor, throttle_code, SendRateLimited
+from concurrent.futures import ThreadPoolExecutor
+import atexit
+import os
+import smtplib
+import threading
+import time
+
+DEFAULTS = {
+    'SMTP_POOL_SIZE': 4,
+    'SMTP_SEND_WORKERS': 4,
+    'SMTP_POOL_MAX_MESSAGES': 100,
+    'SMTP_POOL_IDLE_TIMEOUT': 30,
+    'SMTP_POOL_ACQUIRE_TIMEOUT': 60,
+    'SMTP_BCC_BATCH_SIZE': 50
+}
+
+# The server refused this message but the session is still usable
+MESSAGE_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError)
+
+
+class SMTPPoolExhausted(Exception):
+    """Raised when no connection became free within SMTP_POOL_ACQUIRE_TIMEOUT"""
+
+
+def _config(key):
+    if has_app_context():
+        return current_app.config.get(key, DEFAULTS[key])
+    return DEFAULTS[key]
+
+
+def _address(recipient):
+    # The address goes into a header and an SMTP command, so a line break would inject either
+    if '\r' in recipient or '\n' in recipient:
+        raise BadHeaderError
+    return sanitize_address(recipient)
+
+
+class Envelope:
+    """Encoded message bytes plus the SMTP envelope they are sent with"""
+
+    def __init__(self, sender, recipients, data):
+        self.sender = sender
+        self.recipients = recipients
+        self.data = data
+
+
+class PreparedMessage:
+    """A Flask-Mail message encoded once, then addressed to any number of recipients"""
+
+    _TO = 'recipient@prepared.invalid'
+    _MESSAGE_ID = '<message-id@prepared.invalid>'
+
+    def __init__(self, message):
+        assert message.sender, 'The message does not specify a sender'
+        if message.has_bad_headers():
+            raise BadHeaderError
+        message.recipients = [self._TO]
+        message.cc = message.bcc = []
+        message.msgId = self._MESSAGE_ID
+        if message.date is None:
+            message.date = time.time()
+        self.sender = sanitize_address(message.sender)
+        self.data = message.as_bytes()
+        self.size = len(self.data)
+
+    def addressed_to(self, recipient):
+        """An envelope for one recipient, named in the To header"""
+        address = _address(recipient)
+        return Envelope(self.sender, [address], self._with_headers(address))
+
+    def bcc(self, recipients):
+        """One envelope for all recipients, none of them named in the headers"""
+        addresses = [_address(recipient) for recipient in recipients]
+        return Envelope(self.sender, addresses, self._with_headers('undisclosed-recipients:;'))
+
+    def _with_headers(self, to):
+        return (self.data.replace(self._TO.encode(), to.encode('utf-8'), 1)
+                .replace(self._MESSAGE_ID.encode(), make_msgid().encode(), 1))
+
+
+class _PooledConnection:
+    def __init__(self, state):
+        self.connection = Connection(state)
+        # Opens the socket, STARTTLS and login (nothing when MAIL_SUPPRESS_SEND)
+        self.connection.__enter__()
+        SMTP_CONNECTIONS_OPENED.inc()
+        self.sent = 0
+        self.last_used = time.monotonic()
+
+    def expired(self, max_messages, idle_timeout):
+        return self.sent >= max_messages or time.monotonic() - self.last_used > idle_timeout
+
+    def send(self, message):
+        """Returns {recipient: (code, reply)} for recipients the server refused"""
+        refused = {}
+        if isinstance(message, Envelope):
+            host = self.connection.host
+            if host is not None:
+                refused = host.sendmail(message.sender, message.recipients, message.data)
+        else:
+            self.connection.send(message)
+        self.sent += 1
+        self.last_used = time.monotonic()
+        return refused
+
+    def reset(self):
+        host = self.connection.host
+        if host is not None:
+            host.rset()
+
+    def close(self):
+        host = self.connection.host
+        if host is None:
+            return
+        try:
+            host.quit()
+        except Exception:
+            host.close()
+
+
+class SMTPPool:
+    """Bounded pool of persistent SMTP connections plus a sender thread pool"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._idle = []
+        self._slots = None
+        self._executor = None
+        self._pid = None
+
+    def send(self, message, kind='custom'):
+        """Send a message or Envelope on a pooled connection, within the send rate limits.
+
+        Returns {recipient: (code, reply)} for recipients the server refused
+        while accepting the others.
+        """
+        retries = current_app.config.get('SMTP_THROTTLE_RETRIES', 2)
+        tokens = len(message.recipients) if isinstance(message, Envelope) else 1
+        for attempt in range(retries + 1):
+            for _ in range(tokens):
+                send_rate_governor.acquire()
+            try:
+                with observe_latency(SMTP_SEND_LATENCY, with_outcome=True, kind=kind):
+                    return self._send(message)
+            except Exception as e:
+                code = throttle_code(e)
+                if code is None:
+                    raise
+                send_rate_governor.throttled(code)
+                if attempt == retries:
+                    raise SendRateLimited(f'SMTP server is throttling sends ({code})',
+                                          current_app.config.get('SMTP_THROTTLE_PAUSE', 30)) from e
+
+    def send_many(self, messages, kind='bulk', raw_errors=False):
+        """Send messages in parallel; returns [None or error string] in the same order.
+
+        With raw_errors the exceptions themselves are returned instead of strings.
+        """
+        errors = [result if isinstance(result, Exception) else None
+                  for result in self._send_parallel(messages, kind)]
+        if raw_errors:
+            return errors
+        return [str(error) if error is not None else None for error in errors]
+
+    def send_bulk(self, message, recipients, kind='bulk', raw_errors=False):
+        """Send the same message to every recipient; returns [None or error] per recipient"""
+        return self.send_envelopes(self.envelopes(message, recipients), kind, raw_errors)
+
+    def envelopes(self, message, recipients):
+        """Encode message once and split recipients into envelopes of SMTP_BCC_BATCH_SIZE"""
+        prepared = PreparedMessage(message)
+        batch_size = max(1, _config('SMTP_BCC_BATCH_SIZE'))
+        if batch_size == 1:
+            return [prepared.addressed_to(recipient) for recipient in recipients]
+        return [prepared.bcc(recipients[start:start + batch_size])
+                for start in range(0, len(recipients), batch_size)]
+
+    def send_envelopes(self, envelopes, kind='bulk', raw_errors=False):
+        """Send envelopes in parallel; returns [None or error] per recipient, in envelope order"""
+        errors = []
+        for envelope, result in zip(envelopes, self._send_parallel(envelopes, kind)):
+            for recipient in envelope.recipients:
+                if isinstance(result, Exception):
+                    error = result
+                elif recipient in result:
+                    error = smtplib.SMTPRecipientsRefused({recipient: result[recipient]})
+                else:
+                    errors.append(None)
+                    continue
+                errors.append(error if raw_errors else str(error))
+        return errors
+
+    def _send_parallel(self, messages, kind):
+        """[refused recipients dict or exception] per message"""
+        if not messages:
+            return []
+        app = current_app._get_current_object()
+
+        def send_one(message):
+            with app.app_context():
+                try:
+                    return self.send(message, kind)
+                except Exception as e:
+                    return e
+
+        if len(messages) == 1:
+            return [send_one(messages[0])]
+        return list(self._get_executor().map(send_one, messages))
+
+    def close(self):
+        """Close idle connections and stop the sender threads"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+            executor, self._executor = self._executor, None
+        for pooled in idle:
+            pooled.close()
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def _send(self, message):
+        pooled, reused = self._acquire()
+        try:
+            refused = pooled.send(message)
+        except MESSAGE_ERRORS:
+            self._release(self._reset(pooled))
+            raise
+        except (smtplib.SMTPServerDisconnected, smtplib.SMTPResponseException, OSError) as e:
+            pooled.close()
+            # A throttled session is not retried here; the caller waits for the governor
+            if not reused or throttle_code(e) is not None:
+                self._release(None)
+                raise
+            # The server dropped a connection we kept open; retry once on a new one
+            pooled = None
+            try:
+                pooled = _PooledConnection(current_app.extensions['mail'])
+                refused = pooled.send(message)
+            except Exception:
+                if pooled is not None:
+                    pooled.close()
+                self._release(None)
+                raise
+        except Exception:
+            # Rejected before anything reached the server (no sender, bad headers)
+            self._release(pooled)
+            raise
+        self._release(pooled)
+        return refused
+
+    def _reset(self, pooled):
+        try:
+            pooled.reset()
+            return pooled
+        except Exception:
+            pooled.close()
+            return None
+
+    def _acquire(self):
+        slots = self._get_slots()
+        if not slots.acquire(timeout=_config('SMTP_POOL_ACQUIRE_TIMEOUT')):
+            raise SMTPPoolExhausted('No SMTP connection became free')
+        max_messages = _config('SMTP_POOL_MAX_MESSAGES')
+        idle_timeout = _config('SMTP_POOL_IDLE_TIMEOUT')
+        try:
+            while True:
+                with self._lock:
+                    pooled = self._idle.pop() if self._idle else None
+                if pooled is None:
+                    return _PooledConnection(current_app.extensions['mail']), False
+                if not pooled.expired(max_messages, idle_timeout):
+                    return pooled, True
+                pooled.close()
+        except Exception:
+            slots.release()
+            raise
+
+    def _release(self, pooled):
+        with self._lock:
+            if pooled is not None:
+                self._idle.append(pooled)
+            slots = self._slots
+        slots.release()
+
+    def _get_slots(self):
+        with self._lock:
+            self._check_pid()
+            if self._slots is None:
+                self._slots = threading.BoundedSemaphore(_config('SMTP_POOL_SIZE'))
+            return self._slots
+
+    def _get_executor(self):
+        with self._lock:
+            self._check_pid()
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=_config('SMTP_SEND_WORKERS'), thread_name_prefix='smtp'
+                )
+            return self._executor
+
+    def _check_pid(self):
+        # After a fork the inherited sockets and threads belong to the parent
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._idle = []
+            self._slots = None
+            self._executor = None
+
+
+smtp_pool = SMTPPool()
+atexit.register(smtp_pool.close)
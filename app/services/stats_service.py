@@ -0,0 +1,403 @@
+"""
+Denormalized counters for the student dashboard.
+
+user_stats holds emails_received and is_subscribed for each user.
+year_group_stats holds the total and recent (last RECENT_DAYS days) bulletin
+counts that a year group can see. Session events keep both tables current,
+in the same transaction as the write that changes them: new email logs,
+subscription changes, and new or deleted bulletin items. emails_received
+also includes logs that email_retention has archived or purged, which are
+counted in archived_email_counts. ORM bulk updates and deletes of logs and
+subscriptions skip the flush events. The owners of the rows they touch are
+read before the statement runs (and, for updates, again after it), and only
+those users are recounted at commit.
+
+reconcile_stats() recomputes every counter from the source tables. The
+scheduler runs it periodically. That run also ages old items out of the
+recent counts.
+"""
+from sqlalchemy import event, select, update, insert, delete, func, exists, case, bindparam
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from app import db
+from app.models import (User, UserStats, YearGroupStats, BulletinItem, EmailLog, EmailSubscription,
+                        ArchivedEmailCount)
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+RECENT_DAYS = 7
+
+# User ids per statement when recounting the users a bulk write touched
+RECOUNT_CHUNK = 500
+
+user_stats_table = UserStats.__table__
+year_group_stats_table = YearGroupStats.__table__
+subscriptions_table = EmailSubscription.__table__
+archived_counts_table = ArchivedEmailCount.__table__
+
+
+def bulletin_visible_to(year_groups, year_group):
+    """Python form of the dashboard filter: year_groups LIKE '%group%' OR year_groups IS NULL"""
+    return year_groups is None or (year_group or '') in year_groups
+
+
+def get_dashboard_stats(user):
+    """Dashboard counters for a user, read with a single query.
+
+    Missing rows (a new user or year group) are computed and stored on demand.
+    """
+    group = user.year_group or ''
+    row = db.session.execute(
+        select(UserStats, YearGroupStats)
+        .outerjoin(YearGroupStats, YearGroupStats.year_group == group)
+        .where(UserStats.user_id == user.id)
+    ).first()
+    user_stats, group_stats = row if row else (None, None)
+
+    if user_stats is None or group_stats is None:
+        _create_missing_rows(user.id, group, user_stats is None, group_stats is None)
+        user_stats = db.session.get(UserStats, user.id)
+        group_stats = db.session.get(YearGroupStats, group)
+
+    return {
+        'total_bulletins': group_stats.total_bulletins,
+        'recent_bulletins': group_stats.recent_bulletins,
+        'emails_sent': user_stats.emails_received,
+        'is_subscribed': user_stats.is_subscribed
+    }
+
+
+def get_user_stats(user_id):
+    """The user's UserStats row, created on demand"""
+    stats = db.session.get(UserStats, user_id)
+    if stats is None:
+        _create_missing_rows(user_id, None, True, False)
+        stats = db.session.get(UserStats, user_id)
+    return stats
+
+
+def _create_missing_rows(user_id, group, need_user, need_group):
+    connection = db.session.connection()
+    try:
+        if need_user:
+            emails, subscribed = _count_user(connection, user_id)
+            connection.execute(insert(user_stats_table).values(
+                user_id=user_id, emails_received=emails, is_subscribed=subscribed,
+                updated_at=datetime.utcnow()
+            ))
+        if need_group:
+            total, recent = _count_year_groups(connection, [group])[group]
+            connection.execute(insert(year_group_stats_table).values(
+                year_group=group, total_bulletins=total, recent_bulletins=recent,
+                updated_at=datetime.utcnow()
+            ))
+        db.session.commit()
+    except IntegrityError:
+        # Another request created the row first
+        db.session.rollback()
+
+
+def _count_user(connection, user_id):
+    emails = connection.execute(
+        select(func.count(EmailLog.id)).where(EmailLog.user_id == user_id)
+    ).scalar()
+    emails += connection.execute(
+        select(archived_counts_table.c.emails).where(archived_counts_table.c.user_id == user_id)
+    ).scalar() or 0
+    subscribed = connection.execute(
+        select(exists().where(subscriptions_table.c.user_id == user_id,
+                              subscriptions_table.c.is_active == True))
+    ).scalar()
+    return emails, bool(subscribed)
+
+
+def _count_year_groups(connection, groups):
+    """{group: [total, recent]}, from one GROUP BY over the distinct year_groups values"""
+    week_ago = datetime.utcnow() - timedelta(days=RECENT_DAYS)
+    rows = connection.execute(
+        select(
+            BulletinItem.year_groups,
+            func.count(BulletinItem.id),
+            func.sum(case((BulletinItem.created_at >= week_ago, 1), else_=0))
+        ).group_by(BulletinItem.year_groups)
+    ).all()
+    counts = {group: [0, 0] for group in groups}
+    for year_groups, total, recent in rows:
+        for group in groups:
+            if bulletin_visible_to(year_groups, group):
+                counts[group][0] += total
+                counts[group][1] += recent or 0
+    return counts
+
+
+def _recount_users(connection):
+    now = datetime.utcnow()
+    emails = defaultdict(int, connection.execute(
+        select(EmailLog.user_id, func.count(EmailLog.id)).group_by(EmailLog.user_id)
+    ).all())
+    for user_id, archived in connection.execute(select(archived_counts_table)).all():
+        emails[user_id] += archived
+    subscribed = set(connection.execute(
+        select(subscriptions_table.c.user_id).where(subscriptions_table.c.is_active == True).distinct()
+    ).scalars())
+    rows = [
+        {'user_id': user_id, 'emails_received': emails.get(user_id, 0),
+         'is_subscribed': user_id in subscribed, 'updated_at': now}
+        for user_id in connection.execute(select(User.id)).scalars()
+    ]
+    # Replaced inside the caller's transaction, so readers never see it empty
+    connection.execute(delete(user_stats_table))
+    if rows:
+        connection.execute(insert(user_stats_table), rows)
+    return len(rows)
+
+
+def _recount_some_users(connection, user_ids):
+    """Recompute the user_stats rows of the given users that have one"""
+    user_ids = sorted(user_ids)
+    now = datetime.utcnow()
+    for start in range(0, len(user_ids), RECOUNT_CHUNK):
+        chunk = user_ids[start:start + RECOUNT_CHUNK]
+        emails = defaultdict(int, connection.execute(
+            select(EmailLog.user_id, func.count(EmailLog.id))
+            .where(EmailLog.user_id.in_(chunk)).group_by(EmailLog.user_id)
+        ).all())
+        for user_id, archived in connection.execute(
+                select(archived_counts_table).where(archived_counts_table.c.user_id.in_(chunk))).all():
+            emails[user_id] += archived
+        subscribed = set(connection.execute(
+            select(subscriptions_table.c.user_id)
+            .where(subscriptions_table.c.user_id.in_(chunk), subscriptions_table.c.is_active == True).distinct()
+        ).scalars())
+        existing = connection.execute(
+            select(user_stats_table.c.user_id).where(user_stats_table.c.user_id.in_(chunk))
+        ).scalars().all()
+        if existing:
+            # Rows are only updated; get_dashboard_stats creates missing ones on demand
+            connection.execute(
+                update(user_stats_table).where(user_stats_table.c.user_id == bindparam('uid')),
+                [{'uid': user_id, 'emails_received': emails.get(user_id, 0),
+                  'is_subscribed': user_id in subscribed, 'updated_at': now} for user_id in existing]
+            )
+
+
+def _recount_year_groups(connection):
+    groups = set(connection.execute(select(year_group_stats_table.c.year_group)).scalars())
+    groups.update(group or '' for group in connection.execute(select(User.year_group).distinct()).scalars())
+    now = datetime.utcnow()
+    rows = [
+        {'year_group': group, 'total_bulletins': total, 'recent_bulletins': recent, 'updated_at': now}
+        for group, (total, recent) in _count_year_groups(connection, sorted(groups)).items()
+    ]
+    connection.execute(delete(year_group_stats_table))
+    if rows:
+        connection.execute(insert(year_group_stats_table), rows)
+    return len(rows)
+
+
+def reconcile_stats():
+    """Recompute every counter from the source tables.
+
+    Returns (user rows, year group rows) written.
+    """
+    connection = db.session.connection()
+    users = _recount_users(connection)
+    groups = _recount_year_groups(connection)
+    db.session.commit()
+    return users, groups
+
+
+def _pending(session):
+    return session.info.setdefault('stats_pending', {
+        'email_deltas': defaultdict(int),
+        'subscription_users': set(),
+        'bulletins': [],  # (year_groups, created_at, +1 or -1)
+        'new_bulletins': [],
+        'deleted_users': set()
+    })
+
+
+@event.listens_for(Session, 'before_flush')
+def _collect_stat_changes(session, flush_context, instances):
+    pending = None
+    for obj in session.new:
+        if isinstance(obj, EmailLog):
+            pending = pending or _pending(session)
+            pending['email_deltas'][obj.user_id] += 1
+        elif isinstance(obj, EmailSubscription):
+            pending = pending or _pending(session)
+            pending['subscription_users'].add(obj.user_id)
+        elif isinstance(obj, BulletinItem):
+            pending = pending or _pending(session)
+            # created_at is only filled in by the INSERT, so read it after the flush
+            pending['new_bulletins'].append(obj)
+
+    for obj in session.dirty:
+        if isinstance(obj, EmailSubscription) and session.is_modified(obj):
+            pending = pending or _pending(session)
+            pending['subscription_users'].add(obj.user_id)
+        elif isinstance(obj, BulletinItem):
+            attrs = db.inspect(obj).attrs
+            if attrs.year_groups.history.has_changes() or attrs.created_at.history.has_changes():
+                session.info['stats_recount_year_groups'] = True
+
+    for obj in session.deleted:
+        if isinstance(obj, EmailLog):
+            pending = pending or _pending(session)
+            pending['email_deltas'][obj.user_id] -= 1
+        elif isinstance(obj, EmailSubscription):
+            pending = pending or _pending(session)
+            pending['subscription_users'].add(obj.user_id)
+        elif isinstance(obj, BulletinItem):
+            pending = pending or _pending(session)
+            pending['bulletins'].append((obj.year_groups, obj.created_at, -1))
+        elif isinstance(obj, User):
+            pending = pending or _pending(session)
+            pending['deleted_users'].add(obj.id)
+
+
+@event.listens_for(Session, 'after_flush')
+def _apply_stat_changes(session, flush_context):
+    pending = session.info.pop('stats_pending', None)
+    if not pending:
+        return
+    connection = session.connection()
+    now = datetime.utcnow()
+
+    _apply_email_deltas(connection, pending['email_deltas'], now)
+
+    if pending['subscription_users']:
+        connection.execute(
+            update(user_stats_table)
+            .where(user_stats_table.c.user_id.in_(pending['subscription_users']))
+            .values(
+                is_subscribed=exists().where(
+                    subscriptions_table.c.user_id == user_stats_table.c.user_id,
+                    subscriptions_table.c.is_active == True
+                ),
+                updated_at=now
+            )
+        )
+
+    bulletins = pending['bulletins'] + [(item.year_groups, item.created_at, 1)
+                                        for item in pending['new_bulletins']]
+    if bulletins:
+        _apply_bulletin_deltas(connection, bulletins, now)
+
+    if pending['deleted_users']:
+        connection.execute(
+            delete(user_stats_table).where(user_stats_table.c.user_id.in_(pending['deleted_users']))
+        )
+        connection.execute(
+            delete(archived_counts_table).where(archived_counts_table.c.user_id.in_(pending['deleted_users']))
+        )
+
+
+def _apply_email_deltas(connection, email_deltas, now):
+    # One UPDATE per distinct delta, so a batch of digests costs one statement rather than one per user
+    users_by_delta = defaultdict(list)
+    for user_id, delta in email_deltas.items():
+        if delta:
+            users_by_delta[delta].append(user_id)
+    for delta, user_ids in users_by_delta.items():
+        connection.execute(
+            update(user_stats_table)
+            .where(user_stats_table.c.user_id.in_(user_ids))
+            .values(emails_received=user_stats_table.c.emails_received + delta, updated_at=now)
+        )
+
+
+def _apply_bulletin_deltas(connection, bulletins, now):
+    groups = connection.execute(select(year_group_stats_table.c.year_group)).scalars().all()
+    week_ago = now - timedelta(days=RECENT_DAYS)
+    deltas = defaultdict(lambda: [0, 0])
+    for year_groups, created_at, sign in bulletins:
+        recent = created_at is not None and created_at >= week_ago
+        for group in groups:
+            if bulletin_visible_to(year_groups, group):
+                deltas[group][0] += sign
+                deltas[group][1] += sign if recent else 0
+    for group, (total, recent) in deltas.items():
+        connection.execute(
+            update(year_group_stats_table)
+            .where(year_group_stats_table.c.year_group == group)
+            .values(
+                total_bulletins=year_group_stats_table.c.total_bulletins + total,
+                recent_bulletins=year_group_stats_table.c.recent_bulletins + recent,
+                updated_at=now
+            )
+        )
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _flag_bulk_writes(orm_execute_state):
+    """Query.delete()/update() skip the flush events, so recount what they touch at commit instead"""
+    mapper = orm_execute_state.bind_mapper
+    if mapper is None:
+        return
+    session = orm_execute_state.session
+    if orm_execute_state.is_insert and mapper.class_ is EmailLog:
+        # A bulk insert of logs (EmailLog.insert_many) also skips the flush; count its rows at commit
+        rows = orm_execute_state.parameters
+        deltas = session.info.setdefault('stats_inserted_emails', defaultdict(int))
+        for row in rows if isinstance(rows, list) else [rows or {}]:
+            if row.get('user_id') is not None:
+                deltas[row['user_id']] += 1
+        return
+    if not (orm_execute_state.is_delete or orm_execute_state.is_update):
+        return
+    if mapper.class_ is BulletinItem:
+        session.info['stats_recount_year_groups'] = True
+    elif mapper.class_ in (EmailLog, EmailSubscription):
+        model = mapper.class_
+        params = orm_execute_state.parameters
+        # A list of parameter dicts is an ORM bulk UPDATE/DELETE by primary key
+        if isinstance(params, list):
+            condition = model.id.in_([row['id'] for row in params])
+        else:
+            condition = orm_execute_state.statement.whereclause
+        # Read the affected rows before the statement changes them, in the same transaction
+        affected = select(model.id, model.user_id)
+        if condition is not None:
+            affected = affected.where(condition)
+        rows = session.execute(affected).all()
+        recount = session.info.setdefault('stats_recount_user_ids', set())
+        recount.update(user_id for _, user_id in rows)
+        if not (orm_execute_state.is_update and rows):
+            return
+        # An update may also move the rows to other users: read whom they belong to afterwards
+        result = orm_execute_state.invoke_statement()
+        row_ids = [row_id for row_id, _ in rows]
+        for start in range(0, len(row_ids), RECOUNT_CHUNK):
+            recount.update(session.execute(
+                select(model.user_id).distinct().where(model.id.in_(row_ids[start:start + RECOUNT_CHUNK]))
+            ).scalars())
+        return result
+
+
+@event.listens_for(Session, 'before_commit')
+def _recount_flagged(session):
+    # before_commit runs ahead of commit's own flush, whose changes can set the flags below
+    session.flush()
+    recount_user_ids = session.info.pop('stats_recount_user_ids', None)
+    recount_year_groups = session.info.pop('stats_recount_year_groups', False)
+    inserted_emails = session.info.pop('stats_inserted_emails', None)
+    if not (recount_user_ids or recount_year_groups or inserted_emails):
+        return
+    connection = session.connection()
+    if inserted_emails:
+        # Users recounted below already include their new logs
+        _apply_email_deltas(connection, {user_id: delta for user_id, delta in inserted_emails.items()
+                                         if user_id not in (recount_user_ids or ())}, datetime.utcnow())
+    if recount_user_ids:
+        _recount_some_users(connection, recount_user_ids)
+    if recount_year_groups:
+        _recount_year_groups(connection)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_stat_changes(session):
+    session.info.pop('stats_pending', None)
+    session.info.pop('stats_recount_user_ids', None)
+    session.info.pop('stats_recount_year_groups', None)
+    session.info.pop('stats_inserted_emails', None)
@@ -0,0 +1,30 @@
+"""
+Gunicorn settings for the KGV Bulletin Service
+
+Prometheus metrics from every worker are written to PROMETHEUS_MULTIPROC_DIR
+and aggregated by /metrics. The directory is emptied when the master starts
+so counters from a previous run don't leak into the new one.
+
+Each worker starts its outbox sender threads once it has loaded the app.
+With --preload the app is created in the master, which sends nothing, and
+threads would not survive the fork anyway.
+"""
+import os
+import shutil
+
+multiproc_dir = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/kgv_bulletin_metrics')
+
+
+def on_starting(server):
+    shutil.rmtree(multiproc_dir, ignore_errors=True)
+    os.makedirs(multiproc_dir, exist_ok=True)
+
+
+def post_worker_init(worker):
+    from app.services.outbox_service import outbox_worker
+    outbox_worker.start()
+
+
+def child_exit(server, worker):
+    from app.services.metrics_service import mark_process_dead
+    mark_process_dead(worker.pid)
@@ -0,0 +1,69 @@
+"""add email log rollups and archive
+
+Revision ID: 62ac5aef805b
+Revises: a89e076bfabe
+Create Date: 2026-10-19 03:27:04.536872
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '62ac5aef805b'
+down_revision = 'a89e076bfabe'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    # create_all() may already have created the tables on app startup
+    if not inspector.has_table('email_logs_archive'):
+        op.create_table('archived_email_counts',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('emails', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('user_id')
+        )
+        op.create_table('email_log_daily',
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('status', sa.String(length=20), nullable=False),
+        sa.Column('year_group', sa.String(length=10), nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('day', 'status', 'year_group')
+        )
+        op.create_table('email_logs_archive',
+        sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('subject', sa.String(length=200), nullable=False),
+        sa.Column('content', sa.Text(), nullable=True),
+        sa.Column('body_hash', sa.String(length=64), nullable=True),
+        sa.Column('status', sa.String(length=20), nullable=True),
+        sa.Column('error_message', sa.Text(), nullable=True),
+        sa.Column('sent_at', sa.DateTime(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('archived_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+        )
+        with op.batch_alter_table('email_logs_archive', schema=None) as batch_op:
+            batch_op.create_index(batch_op.f('ix_email_logs_archive_body_hash'), ['body_hash'], unique=False)
+            batch_op.create_index(batch_op.f('ix_email_logs_archive_user_id'), ['user_id'], unique=False)
+
+    if 'ix_email_logs_created_at' not in {index['name'] for index in inspector.get_indexes('email_logs')}:
+        with op.batch_alter_table('email_logs', schema=None) as batch_op:
+            batch_op.create_index(batch_op.f('ix_email_logs_created_at'), ['created_at'], unique=False)
+
+
+def downgrade():
+    # ### commands auto generated by Alembic - please adjust! ###
+    with op.batch_alter_table('email_logs', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_email_logs_created_at'))
+
+    with op.batch_alter_table('email_logs_archive', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_email_logs_archive_user_id'))
+        batch_op.drop_index(batch_op.f('ix_email_logs_archive_body_hash'))
+
+    op.drop_table('email_logs_archive')
+    op.drop_table('email_log_daily')
+    op.drop_table('archived_email_counts')
+    # ### end Alembic commands ###
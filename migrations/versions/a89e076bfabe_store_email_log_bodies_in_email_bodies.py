@@ -0,0 +1,65 @@
+"""store email log bodies in email_bodies
+
+Revision ID: a89e076bfabe
+Revises: 572689c7d932
+Create Date: 2026-10-19 03:23:33.775657
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a89e076bfabe'
+down_revision = '572689c7d932'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    # create_all() may already have created the table on app startup
+    if not inspector.has_table('email_bodies'):
+        op.create_table('email_bodies',
+        sa.Column('hash', sa.String(length=64), nullable=False),
+        sa.Column('encoding', sa.String(length=10), nullable=False),
+        sa.Column('size', sa.Integer(), nullable=False),
+        sa.Column('data', sa.LargeBinary(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('hash')
+        )
+    # A database can have part of this already (e.g. body_hash but content still NOT NULL), so check each step
+    columns = {column['name']: column for column in inspector.get_columns('email_logs')}
+    add_body_hash = 'body_hash' not in columns
+    relax_content = not columns['content']['nullable']
+    add_index = 'ix_email_logs_body_hash' not in {index['name'] for index in inspector.get_indexes('email_logs')}
+    add_foreign_key = not any(key['referred_table'] == 'email_bodies'
+                              for key in inspector.get_foreign_keys('email_logs'))
+    if not (add_body_hash or relax_content or add_index or add_foreign_key):
+        return
+
+    # Existing bodies stay inline until utils/compact_email_bodies.py moves them
+    with op.batch_alter_table('email_logs', schema=None) as batch_op:
+        if add_body_hash:
+            batch_op.add_column(sa.Column('body_hash', sa.String(length=64), nullable=True))
+        if relax_content:
+            batch_op.alter_column('content',
+                   existing_type=sa.TEXT(),
+                   nullable=True)
+        if add_index:
+            batch_op.create_index(batch_op.f('ix_email_logs_body_hash'), ['body_hash'], unique=False)
+        if add_foreign_key:
+            batch_op.create_foreign_key('fk_email_logs_body_hash', 'email_bodies', ['body_hash'], ['hash'])
+
+
+def downgrade():
+    with op.batch_alter_table('email_logs', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_email_logs_body_hash', type_='foreignkey')
+        batch_op.drop_index(batch_op.f('ix_email_logs_body_hash'))
+        batch_op.alter_column('content',
+               existing_type=sa.TEXT(),
+               nullable=False)
+        batch_op.drop_column('body_hash')
+
+    op.drop_table('email_bodies')
+    # ### end Alembic commands ###
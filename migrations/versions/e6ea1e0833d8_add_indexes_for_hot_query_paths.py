@@ -0,0 +1,59 @@
+"""add indexes for hot query paths
+
+Revision ID: e6ea1e0833d8
+Revises: 62ac5aef805b
+Create Date: 2026-10-19 03:28:26.184616
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e6ea1e0833d8'
+down_revision = '62ac5aef805b'
+branch_labels = None
+depends_on = None
+
+# (table, index name, columns); see utils/explain_queries.py for the queries they serve
+INDEXES = [
+    ('bulletin_items', 'ix_bulletin_items_created_at', ['created_at']),
+    ('bulletin_items', 'ix_bulletin_items_is_feedback_created_at', ['is_feedback', 'created_at']),
+    ('bulletin_items', 'ix_bulletin_items_is_donation_created_at', ['is_donation', 'created_at']),
+    ('bulletin_items', 'ix_bulletin_items_category_created_at', ['category', 'created_at']),
+    ('email_logs', 'ix_email_logs_sent_at', ['sent_at']),
+    ('email_logs', 'ix_email_logs_user_id_created_at', ['user_id', 'created_at']),
+    ('email_logs', 'ix_email_logs_status_created_at', ['status', 'created_at']),
+    ('email_logs', 'ix_email_logs_status_sent_at', ['status', 'sent_at']),
+    ('email_subscriptions', 'ix_email_subscriptions_user_id_is_active', ['user_id', 'is_active']),
+    ('bulletin_filters', 'ix_bulletin_filters_user_id_created_at', ['user_id', 'created_at']),
+    ('admin_actions', 'ix_admin_actions_timestamp', ['timestamp']),
+    ('admin_actions', 'ix_admin_actions_action_type_timestamp', ['action_type', 'timestamp']),
+    ('admin_actions', 'ix_admin_actions_admin_user_id_timestamp', ['admin_user_id', 'timestamp']),
+    ('admin_actions', 'ix_admin_actions_target_user_id', ['target_user_id']),
+]
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    # create_all() may already have created the tables, with these indexes, on app startup
+    existing = {table: {index['name'] for index in inspector.get_indexes(table)}
+                for table in {table for table, _, _ in INDEXES}}
+    missing = [index for index in INDEXES if index[1] not in existing[index[0]]]
+    if not missing:
+        return
+
+    if bind.dialect.name == 'postgresql':
+        # CONCURRENTLY builds without blocking writes, but cannot run inside a transaction
+        with op.get_context().autocommit_block():
+            for table, name, columns in missing:
+                op.create_index(name, table, columns, unique=False, postgresql_concurrently=True)
+    else:
+        for table, name, columns in missing:
+            op.create_index(name, table, columns, unique=False)
+
+
+def downgrade():
+    for table, name, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Benchmark identical-content bulk sends
+
+Starts the local SMTP stand-in (utils/smtp_standin.py), creates the given
+number of users in a throwaway SQLite database and sends them one
+announcement three ways:
+
+  per message   a MIME message built and logged per user, as send_bulk_email
+                did before the fast path
+  re-addressed  EmailService.send_bulk_email with SMTP_BCC_BATCH_SIZE=1: the
+                message is encoded once and only To/Message-ID change
+  BCC batches   EmailService.send_bulk_email with SMTP_BCC_BATCH_SIZE=50
+
+Reports wall and CPU seconds, SMTP transactions, bytes sent to the server
+and SQL statements for each.
+
+Usage: python utils/benchmark_bulk_email.py [users] [workers]
+"""
+import sys
+import os
+import tempfile
+import time
+
+# Add the parent directory to the Python path so we can import from app
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from smtp_standin import SMTPStandIn
+
+DB_PATH = os.path.join(tempfile.mkdtemp(), 'bulk.db')
+os.environ['DATABASE_URL'] = f'sqlite:///{DB_PATH}'
+os.environ['ENABLE_SCHEDULER'] = 'false'
+os.environ['ENABLE_OUTBOX_WORKERS'] = 'false'
+
+from flask_mail import Message
+from sqlalchemy import event, insert
+from app import create_app, db
+from app.models import User, EmailLog
+from app.services.email_service import EmailService
+from app.services.smtp_pool import smtp_pool
+
+CONTENT = '<p>' + 'Announcement for all students. ' * 150 + '</p>'
+
+
+def send_per_message(service, users, subject):
+    """The previous send_bulk_email: one Message and one ORM log object per user"""
+    html_content = service.wrap_custom_content(subject, CONTENT)
+    messages = [
+        Message(subject=subject, recipients=[user.email], html=html_content, sender=service.sender_email)
+        for user in users
+    ]
+    errors = smtp_pool.send_many(messages, kind='custom')
+    for user, error in zip(users, errors):
+        db.session.add(EmailLog(user_id=user.id, subject=subject, content=html_content,
+                                status='sent' if error is None else 'failed', error_message=error))
+    db.session.commit()
+    return sum(1 for error in errors if error)
+
+
+def send_fast_path(service, users, subject):
+    return service.send_bulk_email(users, subject, CONTENT)['failed_sends']
+
+
+def run(label, server, statements, send, service, subject):
+    # Load the recipients up front, as the bulk email route does, so only the send is measured
+    users = User.query.all()
+    server.reset_stats()
+    statements[0] = 0
+    started, cpu_started = time.perf_counter(), time.process_time()
+    failed = send(service, users, subject)
+    elapsed, cpu = time.perf_counter() - started, time.process_time() - cpu_started
+    print(f'{label}:')
+    print(f'  {elapsed:6.2f} s   {cpu:6.2f} s CPU   {server.stats["messages"]} transactions   '
+          f'{server.stats["bytes"] / 1024:8.0f} KiB sent   {statements[0]} SQL statements   {failed} failed')
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+
+    server = SMTPStandIn(handshake_delay=0.01, message_delay=0.002).start()
+    os.environ.update({
+        'MAIL_SERVER': '127.0.0.1', 'MAIL_PORT': str(server.port), 'MAIL_USE_TLS': 'false',
+        'MAIL_USERNAME': 'bulletin@kgv.hk', 'MAIL_PASSWORD': 'benchmark'
+    })
+    app = create_app()
+    app.config['SMTP_POOL_SIZE'] = workers
+    app.config['SMTP_SEND_WORKERS'] = workers
+    # Measure the send path itself, not the send rate governor
+    app.config['SMTP_RATE_PER_SECOND'] = app.config['SMTP_RATE_PER_MINUTE'] = app.config['SMTP_RATE_PER_DAY'] = 0
+    print(f'{count} recipients, {workers} workers\n')
+
+    with app.app_context():
+        db.session.execute(insert(User), [
+            {'email': f'student{i}@kgv.hk', 'name': f'Student {i}', 'password_hash': 'x',
+             'year_group': '9', 'is_active': True}
+            for i in range(count)
+        ])
+        db.session.commit()
+        service = EmailService()
+
+        statements = [0]
+
+        @event.listens_for(db.engine, 'before_cursor_execute')
+        def _count(*args):
+            statements[0] += 1
+
+        run('per message', server, statements, send_per_message, service, 'Announcement 1')
+        app.config['SMTP_BCC_BATCH_SIZE'] = 1
+        run('re-addressed (one encode)', server, statements, send_fast_path, service, 'Announcement 2')
+        app.config['SMTP_BCC_BATCH_SIZE'] = 50
+        run('BCC batches of 50', server, statements, send_fast_path, service, 'Announcement 3')
+
+    smtp_pool.close()
+    server.stop()
+    os.remove(DB_PATH)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Benchmark bulletin list serialization and /api/bulletins throughput
+
+Compares the old path (to_dict() per item, encoded with Flask's stdlib JSON
+provider) with the new one (pre-serialized api_json spliced into the body,
+encoded with the orjson provider when it is installed). Uses an in-memory
+SQLite database, so nothing touches the real data.
+
+Usage: python utils/benchmark_bulletin_list.py [items] [requests]
+"""
+import sys
+import os
+import time
+
+# Add the parent directory to the Python path so we can import from app
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ['DATABASE_URL'] = 'sqlite://'
+os.environ['ENABLE_SCHEDULER'] = 'false'
+os.environ['ENABLE_OUTBOX_WORKERS'] = 'false'
+
+from flask import jsonify
+from flask.json.provider import DefaultJSONProvider
+from flask_jwt_extended import create_access_token
+from app import create_app, db
+from app.models import User, BulletinItem
+from app.services.serialization import RawJSON, json_response, OrjsonProvider, orjson
+
+PER_PAGE = 50
+
+def seed(item_count):
+    """Create one student and item_count realistic bulletin items"""
+    user = User(email='bench@kgv.hk', name='Bench', year_group='9', is_email_verified=True)
+    user.set_password('benchmark')
+    db.session.add(user)
+    
+    for i in range(item_count):
+        item = BulletinItem(
+            title=f'Bulletin item {i}',
+            content=('Students in Year 9 are invited to the lunchtime club. ' * 12).strip(),
+            ai_headline=f'Lunchtime club number {i} opens',
+            category='events',
+            year_groups='9,10',
+        )
+        item.set_metadata({'posted_info': f'Posted by Teacher {i % 7}', 'content_hash': f'{i:032x}'})
+        item.set_attachments([{'name': 'Consent form.pdf', 'url': f'https://example.com/{i}.pdf'}])
+        db.session.add(item)
+    
+    db.session.commit()
+    return user
+
+def time_calls(func, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    elapsed = time.perf_counter() - start
+    return iterations / elapsed
+
+def main():
+    item_count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    
+    app = create_app()
+    with app.app_context():
+        user = seed(item_count)
+        token = create_access_token(identity=str(user.id))
+        items = BulletinItem.query.order_by(BulletinItem.created_at.desc()).limit(PER_PAGE).all()
+    
+    pagination = {'page': 1, 'per_page': PER_PAGE, 'total': item_count}
+    
+    def old_serialize():
+        return jsonify({'bulletins': [item.to_dict() for item in items], 'pagination': pagination})
+    
+    def new_serialize():
+        return json_response({
+            'bulletins': RawJSON.array(item.to_json() for item in items),
+            'pagination': pagination
+        })
+    
+    client = app.test_client()
+    headers = {'Authorization': f'Bearer {token}'}
+    
+    def list_request():
+        response = client.get(f'/api/bulletins?per_page={PER_PAGE}', headers=headers)
+        assert response.status_code == 200, response.status_code
+    
+    print(f"{item_count} items, {PER_PAGE} per page, {iterations} iterations")
+    print(f"orjson installed: {'yes' if orjson else 'no'}")
+    print("-" * 60)
+    
+    providers = [('stdlib', DefaultJSONProvider)]
+    if orjson:
+        providers.append(('orjson', OrjsonProvider))
+    
+    with app.test_request_context():
+        app.json = DefaultJSONProvider(app)
+        baseline = time_calls(old_serialize, iterations)
+        print(f"{'to_dict + stdlib (before)':<40} {baseline:>10.0f} pages/s")
+        
+        for name, provider in providers:
+            app.json = provider(app)
+            rate = time_calls(new_serialize, iterations)
+            print(f"{'api_json splice + ' + name:<40} {rate:>10.0f} pages/s  ({rate / baseline:.1f}x)")
+    
+    print("-" * 60)
+    for name, provider in providers:
+        app.json = provider(app)
+        rate = time_calls(list_request, iterations)
+        print(f"{'GET /api/bulletins, ' + name:<40} {rate:>10.0f} req/s")
+    
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Benchmark bulletin email rendering
+
+Renders the same digest for many recipients through
+EmailService.generate_bulletin_email, first with the fragment cache cleared
+before every render (every item rendered every time, as before the cache),
+then with the cache warm (fragments joined into the compiled layout).
+Reports renders per second for each. Uses an in-memory SQLite database.
+
+Usage: python utils/benchmark_email_render.py [renders] [items]
+"""
+import sys
+import os
+import time
+
+# Add the parent directory to the Python path so we can import from app
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ['DATABASE_URL'] = 'sqlite://'
+os.environ['ENABLE_SCHEDULER'] = 'false'
+os.environ['ENABLE_OUTBOX_WORKERS'] = 'false'
+
+from app import create_app, db
+from app.models import User, BulletinItem
+from app.services.email_service import EmailService
+from app.services.email_templates import fragment_cache
+
+
+def seed(item_count):
+    for i in range(item_count):
+        item = BulletinItem(
+            title=f'Item {i}', ai_headline=f'Headline for announcement {i}',
+            content=('Students in Year 9 and 10 should bring their sports kit on Friday. ' * 12).strip(),
+            year_groups='9,10', category='sports'
+        )
+        item.set_attachments([{'url': f'https://example.com/file{i}.pdf', 'name': f'Form {i}.pdf'}])
+        item.set_metadata({'posted_info': f'Posted by Staff {i} on 19 Oct'})
+        db.session.add(item)
+    db.session.commit()
+
+
+def run(label, renders, items, cold):
+    service = EmailService()
+    user = User(year_group='9')
+    fragment_cache.clear()
+    started = time.perf_counter()
+    for _ in range(renders):
+        if cold:
+            fragment_cache.clear()
+        service.generate_bulletin_email(user, items)
+    elapsed = time.perf_counter() - started
+    print(f'{label}:')
+    line = f'  {renders / elapsed:9.1f} renders/s   {elapsed * 1000 / renders:6.2f} ms/render'
+    if not cold:
+        line += f'   cache hits {fragment_cache.hits}, misses {fragment_cache.misses}'
+    print(line)
+
+
+def main():
+    renders = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    item_count = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    app = create_app()
+    with app.app_context():
+        seed(item_count)
+        items = BulletinItem.query.all()
+        size = len(EmailService().generate_bulletin_email(User(year_group='9'), items)[1])
+        print(f'{renders} renders of {item_count} items ({size / 1024:.0f} KB each)\n')
+
+        run('cache cleared before each render', renders, items, cold=True)
+        run('warm fragment cache', renders, items, cold=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Benchmark login throughput under concurrency
+
+Fires concurrent POST /api/auth/login requests from a thread pool (the same
+model as the threaded dev server or gunicorn gthread workers) while another
+thread polls the cheap /api/auth/session endpoint. Runs once with password
+hashing inline on the request threads and once with the process pool, and
+reports logins per second, shed (503) logins and the latency of the
+unrelated requests. Uses a throwaway SQLite file, so nothing touches the
+real data.
+
+Usage: python utils/benchmark_login.py [logins] [concurrency] [pool_workers]
+"""
+import sys
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Add the parent directory to the Python path so we can import from app
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+db_file = os.path.join(tempfile.mkdtemp(), 'bench_login.db')
+os.environ['DATABASE_URL'] = f'sqlite:///{db_file}'
+os.environ['ENABLE_SCHEDULER'] = 'false'
+os.environ['ENABLE_OUTBOX_WORKERS'] = 'false'
+
+from app import create_app, db
+from app.models import User
+from app.services.password_service import password_hasher
+
+USERS = 50
+
+
+def seed(app):
+    with app.app_context():
+        db.create_all()
+        app.config['PASSWORD_HASH_WORKERS'] = 0
+        for i in range(USERS):
+            user = User(email=f'student{i}@kgv.hk', name=f'Student {i}', is_email_verified=True,
+                        preferences_set=True, year_group='9')
+            user.set_password('benchmark-password')
+            db.session.add(user)
+        db.session.commit()
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def run(app, logins, concurrency, workers):
+    app.config['PASSWORD_HASH_WORKERS'] = workers
+    password_hasher.shutdown()
+
+    client = app.test_client()
+    token = client.post('/api/auth/login', json={
+        'email': 'student0@kgv.hk', 'password': 'benchmark-password'
+    }).get_json()['access_token']
+    headers = {'Authorization': f'Bearer {token}'}
+
+    statuses = {}
+    statuses_lock = threading.Lock()
+    probe_latencies = []
+    done = threading.Event()
+
+    def login(i):
+        response = app.test_client().post('/api/auth/login', json={
+            'email': f'student{i % USERS}@kgv.hk', 'password': 'benchmark-password'
+        })
+        with statuses_lock:
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    def probe():
+        probe_client = app.test_client()
+        while not done.is_set():
+            started = time.perf_counter()
+            probe_client.get('/api/auth/session', headers=headers)
+            probe_latencies.append((time.perf_counter() - started) * 1000)
+            time.sleep(0.01)
+
+    probe_thread = threading.Thread(target=probe)
+    probe_thread.start()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(login, range(logins)))
+    elapsed = time.perf_counter() - started
+    done.set()
+    probe_thread.join()
+
+    mode = f'process pool ({workers} workers)' if workers else 'inline'
+    print(f'{mode}:')
+    print(f'  {logins / elapsed:8.1f} logins/s   statuses {dict(sorted(statuses.items()))}')
+    print(f'  /api/auth/session latency during the burst: '
+          f'p50 {percentile(probe_latencies, 50):.1f} ms, p99 {percentile(probe_latencies, 99):.1f} ms')
+
+
+def main():
+    logins = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else (os.cpu_count() or 2)
+
+    app = create_app()
+    seed(app)
+    print(f'{logins} logins, {concurrency} concurrent clients, '
+          f'method {app.config["PASSWORD_HASH_METHOD"]}\n')
+
+    run(app, logins, concurrency, 0)
+    run(app, logins, concurrency, workers)
+    password_hasher.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Benchmark SMTP delivery: one connection per message vs the connection pool
+
+Starts the local SMTP stand-in (utils/smtp_standin.py) with a simulated
+handshake cost, then sends the same batch of messages twice: serially with
+mail.send(), which connects and logs in for every message, and through
+smtp_pool.send_many() with pooled connections and sender threads. Reports
+messages per second and SMTP connections opened for each.
+
+Usage: python utils/benchmark_smtp.py [messages] [workers] [handshake_ms] [message_ms]
+"""
+import sys
+import os
+import time
+
+# Add the parent directory to the Python path so we can import from app
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from smtp_standin import SMTPStandIn
+
+os.environ['DATABASE_URL'] = 'sqlite://'
+os.environ['ENABLE_SCHEDULER'] = 'false'
+os.environ['ENABLE_OUTBOX_WORKERS'] = 'false'
+
+from flask_mail import Message
+from app import create_app, mail
+from app.services.smtp_pool import smtp_pool
+
+
+def make_messages(count):
+    return [
+        Message(subject='Benchmark', recipients=[f'student{i}@kgv.hk'],
+                html='<p>' + 'bulletin content ' * 200 + '</p>', sender='bulletin@kgv.hk')
+        for i in range(count)
+    ]
+
+
+def report(label, server, count, elapsed, failed=0):
+    print(f'{label}:')
+    print(f'  {count / elapsed:8.1f} msg/s   {elapsed:6.2f} s   '
+          f'{server.stats["connections"]} connections   {failed} failed')
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    handshake = float(sys.argv[3]) / 1000 if len(sys.argv) > 3 else 0.05
+    per_message = float(sys.argv[4]) / 1000 if len(sys.argv) > 4 else 0.005
+
+    server = SMTPStandIn(handshake_delay=handshake, message_delay=per_message).start()
+    os.environ.update({
+        'MAIL_SERVER': '127.0.0.1', 'MAIL_PORT': str(server.port), 'MAIL_USE_TLS': 'false',
+        'MAIL_USERNAME': 'bulletin@kgv.hk', 'MAIL_PASSWORD': 'benchmark'
+    })
+    app = create_app()
+    app.config['SMTP_POOL_SIZE'] = workers
+    app.config['SMTP_SEND_WORKERS'] = workers
+    # Measure the pool itself, not the send rate governor
+    app.config['SMTP_RATE_PER_SECOND'] = app.config['SMTP_RATE_PER_MINUTE'] = app.config['SMTP_RATE_PER_DAY'] = 0
+    print(f'{count} messages, {workers} workers, handshake {handshake * 1000:.0f} ms, '
+          f'message {per_message * 1000:.0f} ms\n')
+
+    with app.app_context():
+        messages = make_messages(count)
+        started = time.perf_counter()
+        for msg in messages:
+            mail.send(msg)
+        report('mail.send per message (serial)', server, count, time.perf_counter() - started)
+
+        server.reset_stats()
+        messages = make_messages(count)
+        started = time.perf_counter()
+        errors = smtp_pool.send_many(messages)
+        failed = sum(1 for error in errors if error)
+        report(f'smtp_pool.send_many ({workers} workers)', server, count,
+               time.perf_counter() - started, failed)
+
+    smtp_pool.close()
+    server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -7,6 +7,9 @@ import os
 
 # Add the parent directory to the Python path so we can import from app
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# One-off scripts never run the scheduled jobs
+os.environ.setdefault('ENABLE_SCHEDULER', 'false')
+os.environ.setdefault('ENABLE_OUTBOX_WORKERS', 'false')
 
 from app import create_app, db
 from app.models import BulletinItem
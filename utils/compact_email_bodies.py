@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Script to move email log bodies stored inline into email_bodies
+
+Logs written since email_bodies was introduced store their HTML there
+automatically. Older logs keep their inline content, which is still readable,
+until this script moves it. Each distinct body is stored once, compressed.
+Safe to interrupt and run again.
+
+Usage: python utils/compact_email_bodies.py [batch_size]
+"""
+import sys
+import os
+
+# Add the parent directory to the Python path so we can import from app
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# One-off scripts never run the scheduled jobs
+os.environ.setdefault('ENABLE_SCHEDULER', 'false')
+os.environ.setdefault('ENABLE_OUTBOX_WORKERS', 'false')
+
+from sqlalchemy import func
+from app import create_app, db
+from app.models import EmailLog, EmailBody
+from app.services.email_bodies import compact_legacy_bodies
+
+def main():
+    batch_size = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+
+    app = create_app()
+    with app.app_context():
+        moved = 0
+        while True:
+            count = compact_legacy_bodies(batch_size=batch_size, max_batches=1)
+            if not count:
+                break
+            moved += count
+            print(f"Compacted {moved} email logs...")
+
+        bodies, stored, original = db.session.query(
+            func.count(EmailBody.hash), func.sum(func.length(EmailBody.data)), func.sum(EmailBody.size)
+        ).one()
+        logs = EmailLog.query.filter(EmailLog.body_hash.isnot(None)).count()
+        print(f"Done: {moved} email logs compacted")
+        print(f"{logs} logs share {bodies} bodies, {(stored or 0) / 1024:.0f} KB stored "
+              f"for {(original or 0) / 1024:.0f} KB of HTML")
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+EXPLAIN the registered hot queries and flag full table scans
+
+Without options, runs EXPLAIN for every query in
+app/services/query_advisor.HOT_QUERIES against the configured database,
+prints each plan, and exits with status 1 if any query scans a whole table.
+
+With --seed N, builds a throwaway SQLite database with N bulletin items,
+N email logs and N admin actions (plus N/100 users with subscriptions and
+filters), then times every hot query twice: with the hot-path indexes
+dropped (before) and with them created (after).
+
+Usage: python utils/explain_queries.py [--verbose]
+       python utils/explain_queries.py --seed 100000 [--verbose]
+"""
+import sys
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+# Add the parent directory to the Python path so we can import from app
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('ENABLE_SCHEDULER', 'false')
+os.environ.setdefault('ENABLE_OUTBOX_WORKERS', 'false')
+
+SEED_PATH = None
+if '--seed' in sys.argv:
+    SEED_PATH = os.path.join(tempfile.mkdtemp(), 'explain.db')
+    os.environ['DATABASE_URL'] = f'sqlite:///{SEED_PATH}'
+
+from sqlalchemy import insert, text
+from app import create_app, db
+from app.models import User, BulletinItem, EmailLog, EmailSubscription, BulletinFilter, AdminAction
+from app.services.query_advisor import HOT_QUERIES, default_params, explain_hot_queries
+
+CHUNK = 10000
+CATEGORIES = ['general', 'sports', 'music', 'drama', 'academic', 'careers', 'clubs']
+YEAR_GROUPS = ['7', '8', '9', '10', '11', '12', '13']
+ACTIONS = ['create_user', 'update_user', 'delete_user', 'toggle_admin', 'reset_password']
+HOT_TABLES = [BulletinItem.__table__, EmailLog.__table__, EmailSubscription.__table__,
+              BulletinFilter.__table__, AdminAction.__table__]
+
+
+def _insert(connection, model, rows):
+    for start in range(0, len(rows), CHUNK):
+        connection.execute(insert(model.__table__), rows[start:start + CHUNK])
+
+
+def seed(connection, count):
+    rng = random.Random(42)
+    now = datetime.utcnow()
+
+    def moment():
+        return now - timedelta(seconds=rng.randint(0, 3 * 365 * 86400))
+
+    user_count = max(count // 100, 10)
+    _insert(connection, User, [
+        {'id': i, 'email': f'student{i}@kgv.hk', 'name': f'Student {i}', 'password_hash': 'x',
+         'is_admin': i <= 3, 'is_active': True, 'email_frequency': 'daily',
+         'year_group': rng.choice(YEAR_GROUPS), 'token_version': 0, 'created_at': moment()}
+        for i in range(1, user_count + 1)
+    ])
+    _insert(connection, EmailSubscription, [
+        {'user_id': i, 'frequency': 'daily', 'time_preference': '08:00',
+         'is_active': rng.random() < 0.8, 'created_at': moment()}
+        for i in range(1, user_count + 1)
+    ])
+    _insert(connection, BulletinFilter, [
+        {'user_id': rng.randint(1, user_count), 'name': f'Filter {i}', 'exclude_feedback': True,
+         'exclude_donations': True, 'is_active': True, 'created_at': moment()}
+        for i in range(user_count * 2)
+    ])
+    _insert(connection, BulletinItem, [
+        {'title': f'Item {i}', 'content': f'Announcement {i} for students', 'ai_headline': f'Headline {i}',
+         'is_feedback': rng.random() < 0.05, 'is_donation': rng.random() < 0.03,
+         'is_from_student': rng.random() < 0.1, 'has_specific_targeting': False,
+         'category': rng.choice(CATEGORIES),
+         'year_groups': None if rng.random() < 0.3 else ','.join(rng.sample(YEAR_GROUPS, 2)),
+         'created_at': moment(), 'scraped_at': now, 'version': 0}
+        for i in range(count)
+    ])
+    logs = []
+    for i in range(count):
+        created = moment()
+        roll = rng.random()
+        status = 'sent' if roll < 0.9 else ('failed' if roll < 0.98 else 'pending')
+        logs.append({'user_id': rng.randint(1, user_count), 'subject': 'Daily bulletin', 'status': status,
+                     'sent_at': created if status == 'sent' else None, 'created_at': created})
+    _insert(connection, EmailLog, logs)
+    _insert(connection, AdminAction, [
+        {'admin_user_id': rng.randint(1, 3), 'target_user_id': rng.randint(1, user_count),
+         'action_type': rng.choice(ACTIONS), 'timestamp': moment()}
+        for i in range(count)
+    ])
+
+
+def hot_indexes():
+    """Non-unique indexes on the hot tables (users.email and primary keys are left alone)"""
+    return [index for table in HOT_TABLES for index in table.indexes if not index.unique]
+
+
+def time_queries(connection, repeats=5):
+    """{name: median milliseconds}"""
+    params = default_params()
+    timings = {}
+    for name, (_, build) in HOT_QUERIES.items():
+        statement = build(params)
+        samples = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            connection.execute(statement).all()
+            samples.append((time.perf_counter() - started) * 1000)
+        timings[name] = statistics.median(samples)
+    return timings
+
+
+def print_report(report, verbose):
+    flagged = 0
+    for entry in report:
+        problems = [f'full scan of {table}' for table in entry['full_scans']] + entry['sorts']
+        flagged += bool(entry['full_scans'])
+        marker = '!!' if entry['full_scans'] else ('~ ' if entry['sorts'] else 'ok')
+        print(f"{marker} {entry['name']:<28} {entry['route']}")
+        for problem in problems:
+            print(f'     {problem}')
+        if verbose:
+            for line in entry['plan']:
+                print(f'       | {line}')
+    return flagged
+
+
+def run_seeded(app, count, verbose):
+    with app.app_context():
+        connection = db.session.connection()
+        print(f'Seeding {count} rows per hot table into {SEED_PATH}...')
+        seed(connection, count)
+        db.session.commit()
+
+        connection = db.session.connection()
+        for index in hot_indexes():
+            index.drop(connection)
+        connection.execute(text('ANALYZE'))
+        print('\nBefore (hot-path indexes dropped):')
+        print_report(explain_hot_queries(connection), verbose)
+        before = time_queries(connection)
+
+        for index in hot_indexes():
+            index.create(connection)
+        connection.execute(text('ANALYZE'))
+        print('\nAfter:')
+        flagged = print_report(explain_hot_queries(connection), verbose)
+        after = time_queries(connection)
+        db.session.commit()
+
+    print(f"\n{'query':<28} {'before ms':>10} {'after ms':>10} {'speedup':>8}")
+    for name in HOT_QUERIES:
+        print(f'{name:<28} {before[name]:10.2f} {after[name]:10.2f} {before[name] / max(after[name], 0.001):7.1f}x')
+    os.remove(SEED_PATH)
+    return flagged
+
+
+def main():
+    verbose = '--verbose' in sys.argv
+    app = create_app()
+
+    if SEED_PATH:
+        count = int(sys.argv[sys.argv.index('--seed') + 1])
+        flagged = run_seeded(app, count, verbose)
+    else:
+        with app.app_context():
+            flagged = print_report(explain_hot_queries(db.session.connection()), verbose)
+
+    print(f'\n{flagged} of {len(HOT_QUERIES)} queries scan a whole table')
+    return 1 if flagged else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+Email throughput load test against the local SMTP stand-in
+
+Starts utils/smtp_standin.py with the given latency, failure injection and
+rate limit, seeds a throwaway SQLite database with users, subscriptions and
+bulletin items, and drives the real send paths:
+
+  bulk      EmailService.send_bulk_email to every user
+  bulletin  EmailService.send_bulletin_email to every user, one call each
+  digest    digest_service.dispatch_due_digests with every user due, then the
+            outbox drained until every message is sent or dead
+
+For each it reports messages per second, p50/p99 latency of smtp_pool sends,
+database write statements per message, and what happened to the injected
+failures. Every recipient must end up with exactly one email log, and no
+more logs may say 'sent' than the server accepted. The exit status is 1 if
+a check fails or a path is slower than --min-rate messages per second.
+
+The send rate governor is off unless --governor is given, so the numbers
+measure the code rather than the configured provider limits.
+
+Usage: python utils/load_test_email.py [--users 500] [--workers 4] [--handshake-ms 50]
+           [--latency-ms 5] [--fail-rate 0] [--disconnect-rate 0] [--rate-limit 0]
+           [--governor] [--scenarios bulk,bulletin,digest] [--min-rate 0] [--seed 1]
+"""
+import sys
+import os
+import random
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+# Add the parent directory to the Python path so we can import from app
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from smtp_standin import SMTPStandIn
+
+DB_PATH = os.path.join(tempfile.mkdtemp(), 'load_test.db')
+os.environ['DATABASE_URL'] = f'sqlite:///{DB_PATH}'
+os.environ['ENABLE_SCHEDULER'] = 'false'
+os.environ['ENABLE_OUTBOX_WORKERS'] = 'false'
+os.environ['PASSWORD_HASH_WORKERS'] = '0'
+
+from sqlalchemy import event, insert, func
+from app import create_app, db
+from app.models import User, EmailSubscription, BulletinItem, EmailLog, OutboxMessage
+from app.services.email_service import EmailService
+from app.services.digest_service import dispatch_due_digests
+from app.services.outbox_service import drain_outbox, ACTIVE_STATUSES
+from app.services.smtp_pool import smtp_pool
+
+YEAR_GROUPS = ['7', '8', '9', '10', '11', '12', '13']
+CATEGORIES = ['sports', 'academic', 'events', 'general']
+SCENARIOS = ('bulk', 'bulletin', 'digest')
+
+
+def option(name, default, cast=str):
+    if name not in sys.argv:
+        return default
+    return cast(sys.argv[sys.argv.index(name) + 1])
+
+
+def seed(count, rng):
+    now = datetime.utcnow()
+    db.session.execute(insert(User), [
+        {'email': f'student{i}@kgv.hk', 'name': f'Student {i}', 'password_hash': 'x',
+         'year_group': rng.choice(YEAR_GROUPS), 'is_active': True, 'is_email_verified': True,
+         'email_frequency': 'daily', 'created_at': now}
+        for i in range(count)
+    ])
+    user_ids = db.session.execute(db.select(User.id)).scalars().all()
+    db.session.execute(insert(EmailSubscription), [
+        {'user_id': user_id, 'frequency': 'daily', 'time_preference': '00:00', 'is_active': True,
+         'created_at': now}
+        for user_id in user_ids
+    ])
+    db.session.execute(insert(BulletinItem), [
+        {'title': f'Item {i}', 'content': f'Announcement {i} for students. ' * 20,
+         'ai_headline': f'Headline {i}', 'category': rng.choice(CATEGORIES),
+         'year_groups': None if rng.random() < 0.5 else ','.join(rng.sample(YEAR_GROUPS, 3)),
+         'is_feedback': False, 'is_donation': False, 'is_from_student': False,
+         'has_specific_targeting': False, 'created_at': now - timedelta(hours=i), 'scraped_at': now,
+         'version': 0}
+        for i in range(20)
+    ])
+    db.session.commit()
+
+
+class Recorder:
+    """Per-send latencies from smtp_pool and write statements from the engine"""
+
+    def __init__(self, engine):
+        self._lock = threading.Lock()
+        self.latencies = []
+        self.writes = 0
+        self._send = smtp_pool.send
+        # Instrument the pool's send for the length of the run; _send_parallel looks it up on the instance
+        smtp_pool.send = self._timed_send
+        event.listen(engine, 'before_cursor_execute', self._count_statement)
+
+    def reset(self):
+        with self._lock:
+            self.latencies = []
+            self.writes = 0
+
+    def _timed_send(self, message, kind='custom'):
+        started = time.perf_counter()
+        try:
+            return self._send(message, kind)
+        finally:
+            with self._lock:
+                self.latencies.append(time.perf_counter() - started)
+
+    def _count_statement(self, conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip()[:6].upper() in ('INSERT', 'UPDATE', 'DELETE'):
+            with self._lock:
+                self.writes += 1
+
+
+def run_bulk(users, items):
+    EmailService().send_bulk_email(users, 'Load test announcement', '<p>' + 'Notice for all students. ' * 100 + '</p>')
+
+
+def run_bulletin(users, items):
+    service = EmailService()
+    for user in users:
+        service.send_bulletin_email(user, items)
+
+
+def run_digest(users, items):
+    # Make every subscriber due again
+    db.session.execute(db.update(EmailSubscription).values(last_digest_at=None))
+    db.session.commit()
+    dispatch_due_digests()
+    # Failures retry at once (OUTBOX_RETRY_BASE is 0); messages the governor defers need a moment
+    while True:
+        drain_outbox()
+        active = db.session.execute(
+            db.select(func.count(OutboxMessage.id)).where(OutboxMessage.status.in_(ACTIVE_STATUSES))
+        ).scalar()
+        if not active:
+            break
+        time.sleep(0.05)
+
+
+RUNNERS = {'bulk': run_bulk, 'bulletin': run_bulletin, 'digest': run_digest}
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run_scenario(name, server, recorder, min_rate):
+    users = User.query.order_by(User.id).all()
+    items = BulletinItem.query.order_by(BulletinItem.created_at.desc()).limit(10).all()
+    first_log = db.session.execute(db.select(func.coalesce(func.max(EmailLog.id), 0))).scalar()
+    server.reset_stats()
+    recorder.reset()
+
+    started = time.perf_counter()
+    error = None
+    try:
+        RUNNERS[name](users, items)
+    except Exception as e:
+        error = e
+        db.session.rollback()
+    elapsed = time.perf_counter() - started
+
+    statuses = dict(db.session.execute(
+        db.select(EmailLog.status, func.count(EmailLog.id)).where(EmailLog.id > first_log).group_by(EmailLog.status)
+    ).all())
+    logged_users = db.session.execute(
+        db.select(func.count(func.distinct(EmailLog.user_id))).where(EmailLog.id > first_log)
+    ).scalar()
+    sent = statuses.get('sent', 0)
+    failed = statuses.get('failed', 0)
+    stats = server.stats
+    rate = sent / elapsed if elapsed else 0.0
+
+    problems = []
+    if error is not None:
+        problems.append(f'raised {type(error).__name__}: {error}')
+    if sent + failed != len(users) or logged_users != len(users):
+        problems.append(f'{sent + failed} logs for {logged_users} of {len(users)} users, expected one each')
+    if sent > stats['recipients']:
+        problems.append(f"{sent} logged as sent but the server accepted {stats['recipients']}")
+    if min_rate and rate < min_rate:
+        problems.append(f'{rate:.1f} msg/s is below --min-rate {min_rate}')
+
+    latencies = [seconds * 1000 for seconds in recorder.latencies]
+    print(f'{name}:')
+    print(f'  {rate:8.1f} msg/s   {elapsed:6.2f} s   {sent} sent   {failed} failed')
+    print(f'  send latency p50 {percentile(latencies, 0.5):7.1f} ms   p99 {percentile(latencies, 0.99):7.1f} ms   '
+          f'({len(latencies)} SMTP transactions)')
+    print(f'  {recorder.writes / max(sent + failed, 1):6.2f} DB write statements per message '
+          f'({recorder.writes} total)')
+    print(f"  injected: {stats['rejected']} rejected, {stats['dropped']} dropped, {stats['throttled']} throttled; "
+          f"{stats['connections']} connections")
+    for problem in problems:
+        print(f'  !! {problem}')
+    return not problems
+
+
+def main():
+    count = option('--users', 500, int)
+    workers = option('--workers', 4, int)
+    scenarios = option('--scenarios', ','.join(SCENARIOS)).split(',')
+    min_rate = option('--min-rate', 0.0, float)
+    seed_value = option('--seed', 1, int)
+    unknown = [name for name in scenarios if name not in RUNNERS]
+    if unknown:
+        print(f"Unknown scenarios: {', '.join(unknown)} (choose from {', '.join(SCENARIOS)})")
+        return 2
+
+    server = SMTPStandIn(handshake_delay=option('--handshake-ms', 50.0, float) / 1000,
+                         message_delay=option('--latency-ms', 5.0, float) / 1000,
+                         rate_limit=option('--rate-limit', 0.0, float) or None,
+                         fail_rate=option('--fail-rate', 0.0, float),
+                         disconnect_rate=option('--disconnect-rate', 0.0, float),
+                         seed=seed_value).start()
+    os.environ.update({
+        'MAIL_SERVER': '127.0.0.1', 'MAIL_PORT': str(server.port), 'MAIL_USE_TLS': 'false',
+        'MAIL_USERNAME': 'bulletin@kgv.hk', 'MAIL_PASSWORD': 'load-test'
+    })
+    app = create_app()
+    app.config['SMTP_POOL_SIZE'] = workers
+    app.config['SMTP_SEND_WORKERS'] = workers
+    app.config['OUTBOX_RETRY_BASE'] = 0
+    if '--governor' not in sys.argv:
+        app.config['SMTP_RATE_PER_SECOND'] = app.config['SMTP_RATE_PER_MINUTE'] = app.config['SMTP_RATE_PER_DAY'] = 0
+    print(f"{count} users, {workers} workers, handshake {server.handshake_delay * 1000:.0f} ms, "
+          f"message {server.message_delay * 1000:.0f} ms, fail rate {server.fail_rate:.1%}, "
+          f"disconnect rate {server.disconnect_rate:.1%}, server rate limit {server.rate_limit or 'none'}, "
+          f"governor {'on' if '--governor' in sys.argv else 'off'}\n")
+
+    with app.app_context():
+        seed(count, random.Random(seed_value))
+        recorder = Recorder(db.engine)
+        results = [run_scenario(name, server, recorder, min_rate) for name in scenarios]
+
+    smtp_pool.close()
+    server.stop()
+    os.remove(DB_PATH)
+    passed = sum(results)
+    print(f'\n{passed} of {len(results)} paths passed')
+    return 0 if passed == len(results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
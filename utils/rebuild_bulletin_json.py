@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Script to (re)build the pre-serialized api_json column for bulletin items
+
+Items written since api_json was introduced are serialized automatically.
+Run this once after upgrading an existing database, or after changing
+BulletinItem.to_dict().
+"""
+import sys
+import os
+
+# Add the parent directory to the Python path so we can import from app
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# One-off scripts never run the scheduled jobs
+os.environ.setdefault('ENABLE_SCHEDULER', 'false')
+os.environ.setdefault('ENABLE_OUTBOX_WORKERS', 'false')
+
+from app import create_app, db
+from app.models import BulletinItem
+
+BATCH_SIZE = 200
+
+def rebuild_api_json(only_missing=False):
+    """Serialize bulletin items in batches and store the result"""
+    query = BulletinItem.query.order_by(BulletinItem.id)
+    if only_missing:
+        query = query.filter(BulletinItem.api_json.is_(None))
+    
+    updated = 0
+    last_id = 0
+    while True:
+        batch = query.filter(BulletinItem.id > last_id).limit(BATCH_SIZE).all()
+        if not batch:
+            break
+        
+        for item in batch:
+            db.session.execute(
+                BulletinItem.__table__.update()
+                .where(BulletinItem.__table__.c.id == item.id)
+                .values(api_json=item.serialize())
+            )
+        db.session.commit()
+        
+        updated += len(batch)
+        last_id = batch[-1].id
+        print(f"Serialized {updated} bulletin items...")
+    
+    return updated
+
+def main():
+    only_missing = '--missing' in sys.argv
+    
+    app = create_app()
+    with app.app_context():
+        count = rebuild_api_json(only_missing=only_missing)
+        print(f"Done: {count} bulletin items serialized")
+    
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Report the number of SQL statements issued per request for common endpoints
+
+Runs against an in-memory SQLite database seeded with a few students, one
+admin, their email logs and a page's worth of bulletin items. Each endpoint is
+requested twice so the effect of the cross-request identity cache is visible
+(cold vs warm). The "repeat" column is the most times any one statement shape
+ran in the warm request; anything above 1 is worth a look for N+1 loops.
+
+With --check the cold request of each endpoint runs under query_budget(): more
+statements than its budget, or one shape more than MAX_REPEATS times, fails
+the check and the script exits with status 1.
+
+Usage: python utils/report_query_counts.py
+       python utils/report_query_counts.py --check
+       IDENTITY_CACHE_TTL=0 python utils/report_query_counts.py   # per-request only
+"""
+import sys
+import os
+
+# Add the parent directory to the Python path so we can import from app
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ['DATABASE_URL'] = 'sqlite://'
+os.environ['ENABLE_SCHEDULER'] = 'false'
+os.environ['ENABLE_OUTBOX_WORKERS'] = 'false'
+
+from app import create_app, db
+from app.models import User, BulletinItem, EmailLog
+from app.services.identity_service import create_user_access_token
+from app.services.query_profiler import profile_queries, query_budget, QueryBudgetExceeded
+
+# (role, path, statement budget for the cold request)
+ENDPOINTS = [
+    ('student', '/api/profile', 4),
+    ('student', '/api/auth/profile', 7),
+    ('student', '/api/dashboard/stats', 6),
+    ('student', '/api/subscription/status', 1),
+    ('student', '/api/bulletins', 3),
+    ('student', '/api/filters', 1),
+    ('admin', '/api/admin/stats', 7),
+    ('admin', '/api/admin/users', 2),
+    ('admin', '/api/admin/email-logs', 2),
+]
+
+# Most times one statement shape may run in a request; a per-row loop goes far past it
+MAX_REPEATS = 2
+
+def seed():
+    student = User(email='student@kgv.hk', name='Student', year_group='9', is_email_verified=True)
+    admin = User(email='admin@kgv.hk', name='Admin', is_admin=True, is_email_verified=True)
+    classmates = [User(email=f'student{i}@kgv.hk', name=f'Student {i}', year_group='9', is_email_verified=True)
+                  for i in range(10)]
+    for user in [student, admin] + classmates:
+        user.set_password('report-password')
+        db.session.add(user)
+    for i in range(20):
+        db.session.add(BulletinItem(title=f'Item {i}', content=f'Bulletin content {i}', year_groups='9'))
+    db.session.flush()
+    for user in [student] + classmates:
+        for i in range(2):
+            db.session.add(EmailLog(user_id=user.id, subject=f'Digest {i}', content=f'<p>Digest {i}</p>', status='sent'))
+    db.session.commit()
+    return {
+        'student': create_user_access_token(student),
+        'admin': create_user_access_token(admin)
+    }
+
+def main():
+    check = '--check' in sys.argv
+    app = create_app()
+    
+    with app.app_context():
+        tokens = seed()
+    
+    client = app.test_client()
+    print(f"IDENTITY_CACHE_TTL={app.config.get('IDENTITY_CACHE_TTL')}")
+    print(f"{'endpoint':<32} {'status':>6} {'cold':>6} {'warm':>6} {'repeat':>6}")
+    print("-" * 61)
+    
+    failures = []
+    for role, path, budget in ENDPOINTS:
+        headers = {'Authorization': f'Bearer {tokens[role]}'}
+        profiles = []
+        for attempt in range(2):
+            measure = query_budget(budget, MAX_REPEATS) if check and attempt == 0 else profile_queries()
+            try:
+                with measure as profile:
+                    response = client.get(path, headers=headers)
+            except QueryBudgetExceeded as e:
+                failures.append(f"{path}: {e}")
+            profiles.append(profile)
+        if check and response.status_code != 200:
+            failures.append(f"{path}: status {response.status_code}")
+        repeat = max(profiles[1].shapes.values(), default=0)
+        print(f"{path:<32} {response.status_code:>6} {profiles[0].count:>6} {profiles[1].count:>6} {repeat:>6}")
+    
+    if failures:
+        print(f"\n{len(failures)} query budget check(s) failed:")
+        for failure in failures:
+            print(f"- {failure}")
+        return 1
+    if check:
+        print("\nAll endpoints within their query budgets")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Local SMTP stand-in for benchmarks and load tests
+
+A small threaded SMTP server that accepts every message and throws it away.
+It speaks enough of the protocol for smtplib and Flask-Mail (EHLO, AUTH
+PLAIN/LOGIN, MAIL, RCPT, DATA, RSET, NOOP, QUIT). handshake_delay is added
+to the greeting and to AUTH, standing in for the TLS handshake and login
+round trips of a real relay, and message_delay is added after each DATA.
+With rate_limit set, the server behaves like a provider that allows that
+many messages per second (burst of one second's worth): a MAIL over the
+limit gets "421 4.7.0 Try again later" and the connection is closed.
+Failures can be injected at random: fail_rate of RCPT commands get
+"550 5.1.1 Mailbox unavailable", and disconnect_rate of messages are read
+and then dropped with the connection, without a reply.
+Counts of connections, messages, recipients, message bytes, throttled
+attempts, rejected recipients and dropped messages are kept in .stats.
+
+Usage: python utils/smtp_standin.py [port] [handshake_delay] [message_delay] [rate_limit]
+"""
+import random
+import socketserver
+import sys
+import threading
+import time
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        server = self.server
+        server.count('connections')
+        time.sleep(server.handshake_delay)
+        self.reply('220 smtp-standin ready')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode(errors='replace').strip()
+            verb = command.split(' ', 1)[0].upper()
+            if verb == 'EHLO':
+                self.reply('250-smtp-standin')
+                self.reply('250-AUTH PLAIN LOGIN')
+                self.reply('250 8BITMIME')
+            elif verb == 'HELO':
+                self.reply('250 smtp-standin')
+            elif verb == 'AUTH':
+                time.sleep(server.handshake_delay)
+                if command.upper().startswith('AUTH LOGIN'):
+                    # Username and password prompts; smtplib may send the username inline
+                    if len(command.split()) < 3:
+                        self.reply('334 VXNlcm5hbWU6')
+                        self.rfile.readline()
+                    self.reply('334 UGFzc3dvcmQ6')
+                    self.rfile.readline()
+                self.reply('235 Authentication successful')
+            elif verb == 'MAIL' and not server.allow_message():
+                server.count('throttled')
+                self.reply('421 4.7.0 Try again later, closing connection')
+                return
+            elif verb == 'RCPT' and server.chance(server.fail_rate):
+                server.count('rejected')
+                self.reply('550 5.1.1 Mailbox unavailable')
+            elif verb in ('MAIL', 'RCPT', 'RSET', 'NOOP'):
+                if verb == 'RCPT':
+                    server.count('recipients')
+                self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                while True:
+                    data = self.rfile.readline()
+                    if data in (b'.\r\n', b'.\n', b''):
+                        break
+                    server.count('bytes', len(data))
+                if server.chance(server.disconnect_rate):
+                    server.count('dropped')
+                    return
+                time.sleep(server.message_delay)
+                server.count('messages')
+                self.reply('250 OK queued')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+
+class SMTPStandIn(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=0, handshake_delay=0.05, message_delay=0.005, rate_limit=None,
+                 fail_rate=0.0, disconnect_rate=0.0, seed=None):
+        super().__init__((host, port), _Handler)
+        self.handshake_delay = handshake_delay
+        self.message_delay = message_delay
+        self.rate_limit = rate_limit
+        self.fail_rate = fail_rate
+        self.disconnect_rate = disconnect_rate
+        self._random = random.Random(seed)
+        self.stats = {'connections': 0, 'messages': 0, 'recipients': 0, 'bytes': 0, 'throttled': 0, 'rejected': 0, 'dropped': 0}
+        self._stats_lock = threading.Lock()
+        self._tokens = rate_limit or 0
+        self._refilled = time.monotonic()
+        self._thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def count(self, key, amount=1):
+        with self._stats_lock:
+            self.stats[key] += amount
+
+    def reset_stats(self):
+        with self._stats_lock:
+            self.stats = {'connections': 0, 'messages': 0, 'recipients': 0, 'bytes': 0, 'throttled': 0, 'rejected': 0, 'dropped': 0}
+
+    def chance(self, rate):
+        if not rate:
+            return False
+        with self._stats_lock:
+            return self._random.random() < rate
+
+    def allow_message(self):
+        """Take one token from the server's own rate limit bucket"""
+        if not self.rate_limit:
+            return True
+        with self._stats_lock:
+            now = time.monotonic()
+            self._tokens = min(self.rate_limit, self._tokens + (now - self._refilled) * self.rate_limit)
+            self._refilled = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 2525
+    handshake_delay = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+    message_delay = float(sys.argv[3]) if len(sys.argv) > 3 else 0.005
+    rate_limit = float(sys.argv[4]) if len(sys.argv) > 4 else None
+    server = SMTPStandIn(port=port, handshake_delay=handshake_delay, message_delay=message_delay,
+                         rate_limit=rate_limit)
+    print(f'SMTP stand-in listening on 127.0.0.1:{server.port} '
+          f'(handshake {handshake_delay * 1000:.0f} ms, message {message_delay * 1000:.0f} ms)')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f'\n{server.stats}')
+
+
+if __name__ == '__main__':
+    main()
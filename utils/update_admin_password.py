@@ -8,6 +8,9 @@ from datetime import datetime
 
 # Add the app directory to the path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+# One-off scripts never run the scheduled jobs
+os.environ.setdefault('ENABLE_SCHEDULER', 'false')
+os.environ.setdefault('ENABLE_OUTBOX_WORKERS', 'false')
 
 from app import create_app, db
 from app.models import User